@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from . import database, models
+
+# --- Configuration ---
+
+CATALOG_TTL = float(os.environ.get("CATALOG_TTL", "5")) # seconds before other workers' changes are picked up
+CATALOG_MAX_USERS = int(os.environ.get("CATALOG_MAX_USERS", "10000")) # Cached per-user views
+
+class CatalogEntry(NamedTuple):
+    id: int
+    name: str
+    color: str
+    pgn_path: str
+
+class UserView(NamedTuple):
+    """A user's `/openings` response, serialized once and tagged by content."""
+    learned_ids: FrozenSet[int]
+    etag: str
+    body: bytes
+    loaded_at: float
+
+class OpeningCatalog:
+    """
+    In-memory copy of the opening catalog and each user's learned set.
+
+    Changes made through this worker are applied at once via `invalidate` /
+    `invalidate_user`; changes made by other workers are picked up after at
+    most `ttl` seconds. ETags are content hashes, so every worker hands out
+    the same tag for the same data.
+    """
+
+    def __init__(self, session_factory: Callable = database.SessionLocal,
+                 ttl: float = CATALOG_TTL, max_users: int = CATALOG_MAX_USERS):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_users = max_users
+
+        self._lock = threading.Lock()
+        self._entries: Optional[Tuple[CatalogEntry, ...]] = None
+        self._by_id: Dict[int, CatalogEntry] = {}
+        self._digest = ""
+        self._loaded_at = 0.0
+        self._users: "OrderedDict[int, UserView]" = OrderedDict()
+        self._generation = 0 # Bumped by every invalidation, so a load that raced one isn't cached
+
+        self.loads = 0
+        self.user_loads = 0
+
+    # --- Catalog ---
+
+    def _catalog(self, now: float):
+        """Caller holds the lock."""
+        if self._entries is not None and now - self._loaded_at <= self.ttl:
+            return
+        db = self.session_factory()
+        try:
+            rows = db.query(models.Opening.id, models.Opening.name, models.Opening.color, models.Opening.pgn_path) \
+                     .order_by(models.Opening.id).all()
+        finally:
+            db.close()
+        entries = tuple(CatalogEntry(*row) for row in rows)
+        digest = hashlib.sha1(repr(entries).encode()).hexdigest()[:16]
+        if digest != self._digest:
+            self._users.clear()
+        self._entries = entries
+        self._by_id = {e.id: e for e in entries}
+        self._digest = digest
+        self._loaded_at = now
+        self.loads += 1
+
+    def openings(self) -> Tuple[CatalogEntry, ...]:
+        with self._lock:
+            self._catalog(time.monotonic())
+            return self._entries
+
+    def get(self, opening_id: int) -> Optional[CatalogEntry]:
+        with self._lock:
+            self._catalog(time.monotonic())
+            return self._by_id.get(opening_id)
+
+    def colors(self) -> Dict[int, str]:
+        return {e.id: e.color for e in self.openings()}
+
+    # --- Per-user views ---
+
+    def user_view(self, user_id: int) -> UserView:
+        now = time.monotonic()
+        with self._lock:
+            self._catalog(now)
+            view = self._users.get(user_id)
+            if view is not None and now - view.loaded_at <= self.ttl:
+                self._users.move_to_end(user_id)
+                return view
+            entries, digest, generation = self._entries, self._digest, self._generation
+
+        db = self.session_factory()
+        try:
+            learned_ids = frozenset(
+                opening_id for (opening_id,) in
+                db.query(models.LearnedOpening.opening_id).filter(models.LearnedOpening.user_id == user_id)
+            )
+        finally:
+            db.close()
+
+        body = json.dumps(
+            [{"id": e.id, "name": e.name, "color": e.color, "is_learned": e.id in learned_ids} for e in entries],
+            separators=(",", ":"),
+        ).encode()
+        etag = f'"{digest}-{hashlib.sha1(body).hexdigest()[:16]}"'
+        view = UserView(learned_ids, etag, body, now)
+
+        with self._lock:
+            if generation == self._generation and digest == self._digest:
+                self._users[user_id] = view
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self.user_loads += 1
+        return view
+
+    def learned_ids(self, user_id: int) -> FrozenSet[int]:
+        return self.user_view(user_id).learned_ids
+
+    # --- Invalidation ---
+
+    def invalidate(self):
+        """Call after the catalog changes (e.g. an upload)."""
+        with self._lock:
+            self._entries = None
+            self._users.clear()
+            self._generation += 1
+
+    def invalidate_user(self, user_id: int):
+        """Call after a user's learned set changes."""
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._generation += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "openings": len(self._entries or ()),
+                "cached_users": len(self._users),
+                "loads": self.loads,
+                "user_loads": self.user_loads,
+            }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+# --- Global Catalog ---
+
+OPENING_CATALOG = OpeningCatalog()
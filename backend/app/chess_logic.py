@@ -2,227 +2,866 @@ import chess
 import chess.pgn
 import chess.engine
 import io
-import random
 import os
-from typing import List, Dict, Optional, Set
+import sys
+import random
+import threading
+import weakref
+from collections.abc import Mapping, MutableMapping
+from typing import Callable, FrozenSet, Iterable, Iterator, List, Dict, NamedTuple, Optional, Set, Tuple
 
-# --- Stockfish Integration ---
+from . import engine_cache, engine_pool, event_log, metrics, ponder, scheduler, search_budget
+from .engine_cache import position_key
+
+_log = metrics.get_logger("game", sampled=True) # Per-move lines; sampled
+_pgn_log = metrics.get_logger("pgn")
 
-STOCKFISH_PATH = os.environ.get("STOCKFISH_PATH", "stockfish.exe") # Default to same dir or PATH
+# --- Stockfish Integration ---
 
-def get_engine_move(fen: str) -> Optional[str]:
-    """Starts Stockfish, gets one best move, and closes it."""
-    # Note: For production, you might want to keep the engine process alive
-    # but for V1, starting/stopping is simpler and prevents ghost processes.
+def get_engine_move(fen: str, game: object = None, deadline_ms: float = scheduler.ENGINE_DEADLINE_MS,
+                    level: Optional[str] = None) -> Optional[str]:
+    """
+    Gets one best move, from the result cache if this position was searched before,
+    otherwise from the shared engine pool. `game` identifies the training session and
+    `level` picks its search budget (see search_budget.LEVELS).
+    Returns None if no engine is available or the scheduler shed the request.
+    """
     try:
-        # Check if file exists
-        search_paths = [STOCKFISH_PATH, "backend/stockfish.exe", "stockfish"]
-        engine_path = None
-        for p in search_paths:
-            if os.path.exists(p) or (os.name != 'nt' and os.access(p, os.X_OK)):
-                engine_path = p
-                break
-        
-        if not engine_path:
-            print(f"Stockfish binary NOT found. Searched: {search_paths}. Please place stockfish.exe in backend/ folder.")
+        board = chess.Board(fen)
+        forced = search_budget.forced_move(board)
+        if forced is not None:
+            return board.san(forced)
+
+        budget = search_budget.budget_for(level)
+        limit = budget.limit()
+
+        cached = engine_cache.ENGINE_CACHE.get(board, limit)
+        if cached:
+            return board.san(cached)
+
+        pool = engine_pool.get_engine_pool()
+        if pool is None:
             return None
 
-        with chess.engine.SimpleEngine.popen_uci(engine_path) as engine:
-            board = chess.Board(fen)
-            result = engine.play(board, chess.engine.Limit(time=0.5)) # 500ms think time
-            return board.san(result.move) if result.move else None
+        def search(movetime: float) -> Optional[str]:
+            # Under load the scheduler hands out less time; nodes shrink with it
+            scale = movetime / budget.movetime
+            result = pool.play(board, budget.limit(scale), game=game, stop_when=search_budget.stop_condition(movetime))
+            if not result.move:
+                return None
+            # Only full-budget results are cached; shrunk searches are weaker.
+            if scale >= 1.0:
+                engine_cache.ENGINE_CACHE.put(board, limit, result.move)
+            return board.san(result.move)
+
+        with metrics.span("engine_wait"):
+            return scheduler.ENGINE_SCHEDULER.run(game, search, budget.movetime, deadline_ms)
     except Exception as e:
-        print(f"Engine Error: {e}")
+        _log.error("Engine Error: %s", e)
         return None
 
-# --- In-Memory Opening Tree Structure ---
+# --- In-Memory Opening Graph Structure ---
+
+# Opening membership is a bitmask: Python ints are arbitrary-width bitmaps,
+# so a membership test against a session is a single AND however large the catalog.
+
+def ids_to_mask(opening_ids: Iterable[int]) -> int:
+    mask = 0
+    for oid in opening_ids:
+        mask |= 1 << oid
+    return mask
+
+def mask_to_ids(mask: int) -> List[int]:
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return ids
+
+_NO_NAGS: FrozenSet[int] = frozenset()
 
 class OpeningNode:
-    def __init__(self, fen: str, move_san: Optional[str] = None, parent: Optional['OpeningNode'] = None):
-        self.fen = fen
-        self.move_san = move_san
-        self.parent = parent
-        self.children: Dict[str, 'OpeningNode'] = {} # map move_san -> Node
-        self.opening_ids: Set[int] = set()
-
-    def add_child(self, move_san: str, fen: str) -> 'OpeningNode':
-        if move_san not in self.children:
-            self.children[move_san] = OpeningNode(fen, move_san, self)
-        return self.children[move_san]
+    """
+    One repertoire position. Nodes use __slots__ and keep their child edges in
+    one flat tuple (san0, node0, san1, node1, ...), with a shared empty tuple
+    for leaves. The FEN is not stored; it is rebuilt from the parent chain
+    when asked for.
+    """
+    __slots__ = ("key", "move_san", "parent", "edges", "opening_mask", "weight", "nags", "comment")
+
+    def __init__(self, key: int, move_san: Optional[str] = None, parent: Optional['OpeningNode'] = None):
+        self.key = key # Zobrist hash of the position
+        self.move_san = move_san # Move that first reached this position (interned)
+        self.parent = parent # First parent; transposed positions have several
+        self.edges: Tuple = ()
+        self.opening_mask = 0 # Bit i set <=> opening i passes through this position
+        self.weight = 0 # Number of repertoire lines through this move
+        self.nags: FrozenSet[int] = _NO_NAGS # PGN annotations ($1 = !, $2 = ?, ...)
+        self.comment: Optional[str] = None
+
+    def child(self, move_san: str) -> Optional['OpeningNode']:
+        # Nodes have a handful of children; a scan beats hashing here.
+        edges = self.edges
+        for i in range(0, len(edges), 2):
+            if edges[i] == move_san:
+                return edges[i + 1]
+        return None
+
+    def iter_children(self) -> Iterator[Tuple[str, 'OpeningNode']]:
+        it = iter(self.edges)
+        return zip(it, it)
+
+    def add_edge(self, move_san: str, node: 'OpeningNode'):
+        self.edges = self.edges + (move_san, node)
+
+    @property
+    def moves(self) -> Tuple[str, ...]:
+        return self.edges[::2]
+
+    @property
+    def nodes(self) -> Tuple['OpeningNode', ...]:
+        return self.edges[1::2]
+
+    @property
+    def children(self) -> Dict[str, 'OpeningNode']:
+        """map move_san -> Node (built on demand)"""
+        return dict(self.iter_children())
+
+    @property
+    def opening_ids(self) -> Set[int]:
+        return set(mask_to_ids(self.opening_mask))
+
+    @property
+    def line(self) -> List[str]:
+        """SAN moves from the start position along the first-parent chain; its length is the ply."""
+        sans = []
+        node = self
+        while node.parent is not None:
+            sans.append(node.move_san)
+            node = node.parent
+        sans.reverse()
+        return sans
+
+    @property
+    def fen(self) -> str:
+        board = chess.Board()
+        for san in self.line:
+            board.push_san(san)
+        return board.fen()
+
+class MoveRecord(NamedTuple):
+    """
+    One move of a parsed repertoire. `parent` indexes the record list; -1 is the start position.
+    `weight` is how many lines the move counts for (1 per PGN line, the entry weight for books).
+    """
+    parent: int
+    move_san: str
+    key: int
+    nags: Tuple[int, ...]
+    comment: Optional[str]
+    weight: int = 1
+
+def parse_repertoire(pgn_content: str) -> List[MoveRecord]:
+    """
+    Flattens every game in a PGN, including all variations (RAVs), into move records.
+    """
+    records: List[MoveRecord] = []
+    pgn = io.StringIO(pgn_content)
+
+    while True:
+        game = chess.pgn.read_game(pgn)
+        if game is None:
+            break
+        add_game_records(game, records)
+
+    return records
+
+def add_game_records(game: chess.pgn.Game, records: List[MoveRecord]) -> bool:
+    """
+    Appends one game's move records. Returns False if the game was skipped.
+
+    Walks the game's variation tree depth-first with an explicit stack and a
+    single board: before playing a move, the board is popped back to the
+    move's ply, which always leaves it on that move's parent position.
+    """
+    if game.errors:
+        _pgn_log.warning("PGN errors in '%s': %s", game.headers.get("Event", "?"), game.errors[0])
+
+    board = game.board()
+    if board.fen() != chess.STARTING_FEN:
+        _pgn_log.warning("Skipping game '%s': custom start positions are not supported.", game.headers.get("Event", "?"))
+        return False
+
+    stack = [(variation, -1, 0) for variation in reversed(game.variations)]
+    while stack:
+        pgn_node, parent, ply = stack.pop()
+        while len(board.move_stack) > ply:
+            board.pop()
+
+        move_san = board.san(pgn_node.move)
+        board.push(pgn_node.move)
+        records.append(MoveRecord(
+            parent, move_san, position_key(board),
+            tuple(pgn_node.nags), pgn_node.comment or None,
+        ))
+
+        index = len(records) - 1
+        stack.extend((variation, index, ply + 1) for variation in reversed(pgn_node.variations))
+    return True
+
+_VERSION_IDS = random.SystemRandom()
 
 class OpeningTree:
-    def __init__(self):
-        self.root = OpeningNode(chess.STARTING_FEN)
-        self.nodes_by_fen: Dict[str, List[OpeningNode]] = {} # For potential transposition handling, though strictly tree-based for now
+    """
+    Repertoire positions as a DAG. Each position exists once in `nodes_by_hash`,
+    so lines that transpose into each other share their nodes.
+
+    A tree is built in place (add_records) while it is private. Once published
+    as GLOBAL_OPENING_TREE it is never mutated again: changes go through a
+    TreeEdit, which produces a new version.
+    """
+
+    def __init__(self, root: Optional[OpeningNode] = None, nodes_by_hash: Optional[Mapping] = None,
+                 extra_parents: Optional[Mapping] = None):
+        if root is None:
+            root = OpeningNode(position_key(chess.Board()))
+            nodes_by_hash = {root.key: root}
+        self.root = root
+        self.nodes_by_hash: Mapping = nodes_by_hash # A dict, or a LayeredIndex after an edit
+        # Parents other than node.parent, for positions reached by several moves (transpositions)
+        self.extra_parents: Mapping = extra_parents if extra_parents is not None else {}
+        self.version = _VERSION_IDS.getrandbits(62) # Identifies this version to pinned sessions
+
+    def __len__(self) -> int:
+        return len(self.nodes_by_hash)
+
+    def add_child(self, parent: OpeningNode, move_san: str, key: int) -> OpeningNode:
+        """Links `parent` to the position `key` reached by `move_san`, reusing the node if it exists."""
+        child = parent.child(move_san)
+        if child is None:
+            move_san = sys.intern(move_san)
+            child = self.nodes_by_hash.get(key)
+            if child is None:
+                child = OpeningNode(key, move_san, parent)
+                self.nodes_by_hash[key] = child
+            else:
+                self.extra_parents[key] = self.extra_parents.get(key, ()) + (parent.key,)
+            parent.add_edge(move_san, child)
+        return child
+
+    def get_node(self, board: chess.Board) -> Optional[OpeningNode]:
+        return self.nodes_by_hash.get(position_key(board))
+
+    def add_records(self, opening_id: int, records: List[MoveRecord]):
+        """Merges parsed move records into the tree, tagging every branch with `opening_id`."""
+        if not records:
+            return
+
+        bit = 1 << opening_id
+        self.root.opening_mask |= bit
+        nodes: List[OpeningNode] = []
+        for record in records:
+            parent = nodes[record.parent] if record.parent >= 0 else self.root
+            node = self.add_child(parent, record.move_san, record.key)
+            node.opening_mask |= bit
+            node.weight += record.weight
+            if record.nags:
+                node.nags = node.nags.union(record.nags)
+            if record.comment and not node.comment:
+                node.comment = record.comment
+            nodes.append(node)
 
     def add_opening(self, opening_id: int, pgn_content: str):
-        pgn = io.StringIO(pgn_content)
-        game = chess.pgn.read_game(pgn)
-        
-        if not game:
+        """Adds every game and variation of a PGN repertoire."""
+        self.add_records(opening_id, parse_repertoire(pgn_content))
+
+    def to_records(self) -> List[MoveRecord]:
+        """
+        The tree as move records, one per move, breadth first. A position
+        reached by several moves carries its weight, NAGs and comment on the
+        first record only, so add_records on another tree adds it once.
+        """
+        records: List[MoveRecord] = []
+        index_of = {self.root.key: -1}
+        queue = [self.root]
+        for node in queue:
+            for san, child in node.iter_children():
+                if child.key in index_of:
+                    records.append(MoveRecord(index_of[node.key], san, child.key, (), None, 0))
+                    continue
+                records.append(MoveRecord(index_of[node.key], san, child.key, tuple(child.nags), child.comment, child.weight))
+                index_of[child.key] = len(records) - 1
+                queue.append(child)
+        return records
+
+# --- Versioned Updates ---
+
+_DELETED = object() # LayeredIndex entry for a key removed in that layer
+_MISSING = object()
+
+class LayeredIndex(MutableMapping):
+    """
+    A dict that shares an older version of itself: the entries one edit
+    added, replaced or removed, over the previous version's index, which is
+    never written to. Lookups try the layers top down.
+
+    `compacted` keeps the chain short: a layer is merged into the one below
+    while it is at least half that one's size (so there are O(log n) layers
+    and each entry is copied O(log n) times), and everything is flattened
+    into a plain dict once the layers hold a quarter of the entries.
+    """
+    __slots__ = ("changes", "base", "size")
+
+    def __init__(self, base: Mapping, changes: Optional[Dict] = None, size: Optional[int] = None):
+        self.base = base
+        self.changes: Dict = changes if changes is not None else {}
+        self.size = size if size is not None else len(base)
+
+    def get(self, key, default=None):
+        index = self
+        while type(index) is LayeredIndex:
+            value = index.changes.get(key, _MISSING)
+            if value is not _MISSING:
+                return default if value is _DELETED else value
+            index = index.base
+        return index.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _DELETED)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _DELETED) is not _DELETED
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.size += 1
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changes[key] = _DELETED
+        self.size -= 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator:
+        return iter(self.flatten())
+
+    def _layers(self) -> Tuple[List[Dict], Mapping]:
+        """The layers' changes, top first, and the plain mapping at the bottom."""
+        layers = []
+        index = self
+        while type(index) is LayeredIndex:
+            layers.append(index.changes)
+            index = index.base
+        return layers, index
+
+    def flatten(self) -> Dict:
+        layers, bottom = self._layers()
+        flat = dict(bottom)
+        for changes in reversed(layers):
+            for key, value in changes.items():
+                if value is _DELETED:
+                    flat.pop(key, None)
+                else:
+                    flat[key] = value
+        return flat
+
+    def compacted(self) -> Mapping:
+        """An equal index with fewer layers (see the class docstring); may be self."""
+        layers, _ = self._layers()
+        if sum(map(len, layers)) * 4 > self.size:
+            return self.flatten()
+        changes, base = self.changes, self.base
+        while type(base) is LayeredIndex and len(changes) * 2 >= len(base.changes):
+            merged = dict(base.changes)
+            merged.update(changes)
+            changes, base = merged, base.base
+        return self if changes is self.changes else LayeredIndex(base, changes, self.size)
+
+class TreeEdit:
+    """
+    Builds the next version of a published tree without touching it.
+
+    Before a node changes it is copied, and so is every node linking to it,
+    up to the root: only the affected paths are rebuilt, and every untouched
+    subtree is shared with the base version. The position index and the
+    transposition table are LayeredIndexes over the base version's, so they
+    hold only what this edit changed. Sessions holding the base version keep
+    reading it unchanged, and nobody sees the new version until `commit`
+    returns it.
+    """
+
+    def __init__(self, base: OpeningTree):
+        self.nodes = LayeredIndex(base.nodes_by_hash)
+        self.extra_parents = LayeredIndex(base.extra_parents)
+        self.root_key = base.root.key
+        self._owned: Set[int] = set() # Keys whose node in self.nodes is a private copy
+
+    def _copy(self, key: int) -> OpeningNode:
+        old = self.nodes[key]
+        node = OpeningNode(key, old.move_san, old.parent)
+        node.edges = old.edges
+        node.opening_mask = old.opening_mask
+        node.weight = old.weight
+        node.nags = old.nags
+        node.comment = old.comment
+        self.nodes[key] = node
+        self._owned.add(key)
+        return node
+
+    def _parent_keys(self, node: OpeningNode) -> Tuple[int, ...]:
+        first = (node.parent.key,) if node.parent is not None else ()
+        return first + self.extra_parents.get(node.key, ())
+
+    def own(self, key: int) -> OpeningNode:
+        """Returns a private, writable copy of the node, relinking its ancestors to it."""
+        if key in self._owned:
+            return self.nodes[key]
+        node = self._copy(key)
+        pending = [key]
+        while pending:
+            child_key = pending.pop()
+            child = self.nodes[child_key]
+            for parent_key in self._parent_keys(child):
+                if parent_key not in self.nodes:
+                    continue
+                if parent_key not in self._owned:
+                    self._copy(parent_key)
+                    pending.append(parent_key)
+                parent = self.nodes[parent_key]
+                edges = list(parent.edges)
+                for i in range(1, len(edges), 2):
+                    if edges[i].key == child_key:
+                        edges[i] = child
+                parent.edges = tuple(edges)
+        return node
+
+    def add_records(self, opening_id: int, records: List[MoveRecord]):
+        """Same as OpeningTree.add_records, on private copies."""
+        if not records:
             return
+        bit = 1 << opening_id
+        root = self.own(self.root_key)
+        root.opening_mask |= bit
+        nodes: List[OpeningNode] = []
+        for record in records:
+            parent = nodes[record.parent] if record.parent >= 0 else root
+            child = parent.child(record.move_san)
+            if child is not None:
+                child = self.own(child.key)
+            elif record.key in self.nodes:
+                # Transposition into a known position
+                child = self.own(record.key)
+                self.extra_parents[record.key] = self.extra_parents.get(record.key, ()) + (parent.key,)
+                parent.add_edge(sys.intern(record.move_san), child)
+            else:
+                child = OpeningNode(record.key, sys.intern(record.move_san), parent)
+                self.nodes[record.key] = child
+                self._owned.add(record.key)
+                parent.add_edge(child.move_san, child)
+            child.opening_mask |= bit
+            child.weight += record.weight
+            if record.nags:
+                child.nags = child.nags.union(record.nags)
+            if record.comment and not child.comment:
+                child.comment = record.comment
+            nodes.append(child)
 
-        board = game.board()
-        current_node = self.root
-        current_node.opening_ids.add(opening_id)
+    def subtract_records(self, records: List[MoveRecord]):
+        """Takes back the line weights an opening's records added (before `remove_opening`)."""
+        root = self.nodes[self.root_key]
+        nodes: List[Optional[OpeningNode]] = []
+        for record in records:
+            parent = nodes[record.parent] if record.parent >= 0 else root
+            child = parent.child(record.move_san) if parent is not None else None
+            if child is not None:
+                child = self.own(child.key)
+                child.weight = max(0, child.weight - record.weight)
+            nodes.append(child)
 
-        for move in game.mainline_moves():
-            move_san = board.san(move)
-            board.push(move)
-            fen = board.fen()
-            
-            current_node = current_node.add_child(move_san, fen)
-            current_node.opening_ids.add(opening_id)
-    
-    def get_candidate_nodes(self, opening_ids: List[int]) -> List[OpeningNode]:
+    def remove_opening(self, opening_id: int):
         """
-        Returns the root nodes (which are just the global root for now)
-        filtered by the user's learned openings.
-        Actually, it should returns the root, but we need to track which *specific* 
-        opening IDs are valid for a user.
+        Clears the opening's bit and drops the positions no other opening
+        reaches, and the moves between positions that no longer share an
+        opening (a transposition only this opening made).
         """
-        # For V1, we assume all openings start from the standard start position.
-        # We just verify that the root has the opening_ids.
-        # In a more complex scenario, we might have different starting positions.
-        return [self.root]
+        bit = 1 << opening_id
+        root = self.own(self.root_key)
+        root.opening_mask &= ~bit
+        stack = [root]
+        seen = {root.key}
+        tagged: List[OpeningNode] = []
+        while stack:
+            for child in stack.pop().nodes:
+                if child.opening_mask & bit and child.key not in seen:
+                    seen.add(child.key)
+                    child = self.own(child.key)
+                    child.opening_mask &= ~bit
+                    tagged.append(child)
+                    stack.append(child)
+
+        dead = {node.key: node for node in tagged if not node.opening_mask}
+        for key in dead:
+            del self.nodes[key]
+            self._owned.discard(key)
+            self.extra_parents.pop(key, None)
+
+        # Only moves out of the positions the opening passed through can have lost their last shared opening
+        parents = dict.fromkeys([root.key] + [node.key for node in tagged if node.key in self.nodes])
+        unlinked: Dict[int, None] = {} # Live positions that lost a parent
+        for node in dead.values():
+            parents.update(dict.fromkeys(k for k in self._parent_keys(node) if k in self.nodes))
+            unlinked.update(dict.fromkeys(child.key for child in node.nodes if child.key in self.nodes))
+        for parent_key in parents:
+            parent = self.nodes[parent_key]
+            kept = tuple((san, child) for san, child in parent.iter_children()
+                         if child.key in self.nodes and parent.opening_mask & child.opening_mask)
+            if len(kept) == len(parent.nodes):
+                continue
+            kept_keys = {child.key for _, child in kept}
+            unlinked.update(dict.fromkeys(child.key for child in parent.nodes
+                                          if child.key in self.nodes and child.key not in kept_keys))
+            self.own(parent_key).edges = tuple(x for pair in kept for x in pair)
+
+        moved: List[int] = []
+        for key in unlinked:
+            # Still reached by another opening, so it has a live parent left
+            child = self.own(key)
+            linked = tuple(k for k in self._parent_keys(child)
+                           if k in self.nodes and any(c.key == key for c in self.nodes[k].nodes))
+            if child.parent is not None and child.parent.key not in linked and linked:
+                # The move into it changes with the parent (transpositions)
+                child.parent = self.nodes[linked[0]]
+                child.move_san = next(san for san, c in child.parent.iter_children() if c.key == key)
+                moved.append(key)
+            extra = tuple(k for k in linked if child.parent is None or k != child.parent.key)
+            if extra:
+                self.extra_parents[key] = extra
+            else:
+                self.extra_parents.pop(key, None)
+
+        # Lines and FENs follow first parents: the positions below a moved one
+        # are copied so `commit` points them at its new copy.
+        stack = moved
+        seen = set(moved)
+        while stack:
+            for child in self.nodes[stack.pop()].nodes:
+                if child.parent is not None and child.parent.key in seen and child.key not in seen:
+                    seen.add(child.key)
+                    self.own(child.key)
+                    stack.append(child.key)
+
+    def commit(self) -> OpeningTree:
+        # Point copied nodes at their parents in this version, so old versions can be freed
+        for key in self._owned:
+            node = self.nodes[key]
+            if node.parent is not None:
+                node.parent = self.nodes.get(node.parent.key, node.parent)
+        self._owned = set()
+        return OpeningTree(self.nodes[self.root_key], self.nodes.compacted(), self.extra_parents.compacted())
+
+# --- Bulk Loading ---
+
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_PARSE_MIN_FILES = 8 # Below this, process startup costs more than it saves
+
+def parse_repertoire_file(pgn_path: str) -> List[MoveRecord]:
+    """Move records of a repertoire file: a PGN, or a Polyglot book (.bin)."""
+    if pgn_path.endswith(".bin"):
+        from . import polyglot
+        return polyglot.read_records(pgn_path)
+    with open(pgn_path, "r") as f:
+        return parse_repertoire(f.read())
 
 # --- Global State (Simple In-Memory Cache) ---
 # In a real app, this would be populated from the DB on startup.
 GLOBAL_OPENING_TREE = OpeningTree()
 
+# Readers just take a reference to GLOBAL_OPENING_TREE; writers hold this lock,
+# edit a copy and swap it in with publish_tree.
+TREE_WRITE_LOCK = threading.RLock()
+_TREE_VERSIONS: "weakref.WeakValueDictionary[int, OpeningTree]" = weakref.WeakValueDictionary()
+
+_TREE_LISTENERS: List[Callable[[object], None]] = [] # Called with each newly published tree
+
+def publish_tree(tree):
+    global GLOBAL_OPENING_TREE
+    _TREE_VERSIONS[tree.version] = tree
+    GLOBAL_OPENING_TREE = tree
+    for listener in _TREE_LISTENERS:
+        listener(tree)
+
+def add_tree_listener(listener: Callable[[object], None]):
+    if listener not in _TREE_LISTENERS:
+        _TREE_LISTENERS.append(listener)
+
+def remove_tree_listener(listener: Callable[[object], None]):
+    if listener in _TREE_LISTENERS:
+        _TREE_LISTENERS.remove(listener)
+
+def begin_edit() -> TreeEdit:
+    """Starts an edit of the current tree. Call with TREE_WRITE_LOCK held."""
+    base = GLOBAL_OPENING_TREE
+    if not isinstance(base, OpeningTree):
+        # Read-only snapshot: edits start from a private copy
+        base = base.thaw()
+    return TreeEdit(base)
+
+def tree_version(version: Optional[int]):
+    """The tree version a session was pinned to, if this worker still has it; else the current one."""
+    tree = _TREE_VERSIONS.get(version) if version is not None else None
+    return tree if tree is not None else GLOBAL_OPENING_TREE
+
 
 # --- Game Session Logic ---
 
+class SessionRecord(NamedTuple):
+    """Everything needed to rebuild a GameSession on any worker."""
+    session_id: int
+    user_id: Optional[int]
+    user_color: str
+    moves: Tuple[str, ...] # UCI, from the start position
+    node_key: Optional[int] # Current repertoire position, None out of theory
+    in_theory: bool
+    engine_mode: bool
+    learned_mask: int
+    tree_version: Optional[int] = None # Opening tree version the game started on
+    engine_level: Optional[str] = None # Search budget, None for the server default
+
+def board_from_moves(moves: Iterable[str]) -> chess.Board:
+    """Plays SAN or UCI moves from the start position. Raises ValueError on an illegal move."""
+    board = chess.Board()
+    for move in moves:
+        try:
+            board.push_san(move)
+        except ValueError:
+            board.push_uci(move)
+    return board
+
 class GameSession:
-    def __init__(self, session_id: int, learned_opening_ids: List[int], user_color: str, opening_colors: Dict[int, str]):
+    def __init__(self, session_id: int, learned_opening_ids: List[int], user_color: str, opening_colors: Dict[int, str],
+                 user_id: Optional[int] = None, engine_level: Optional[str] = None,
+                 start_moves: Optional[List[str]] = None):
         self.session_id = session_id
+        self.user_id = user_id
+        self.engine_level = engine_level
         self.board = chess.Board()
         self.user_color = user_color # 'white' or 'black'
+        self.tree = GLOBAL_OPENING_TREE
         
         # Filter learned IDs by color
         self.learned_opening_ids = {
             oid for oid in learned_opening_ids 
             if opening_colors.get(oid) == user_color
         }
+        self.learned_mask = ids_to_mask(self.learned_opening_ids)
         
-        # The set of current nodes in the tree that match the game state
-        self.current_candidates: List[OpeningNode] = []
+        # The position node matching the game state (None once out of theory).
+        # Transpositions share one node, so there is never more than one.
+        self.current_node: Optional[OpeningNode] = None
         
-        # Initialize candidates at root
-        root = GLOBAL_OPENING_TREE.root
-        common_ids = root.opening_ids.intersection(self.learned_opening_ids)
-        if common_ids:
-            self.current_candidates = [root]
+        # Initialize at root
+        root = self.tree.root
+        if root.opening_mask & self.learned_mask:
+            self.current_node = root
         
         self.in_theory = True
         self.engine_mode = False
+
+        # Resuming a drill: start from the position after `start_moves`
+        if start_moves:
+            self.board = board_from_moves(start_moves)
+            node = self.tree.get_node(self.board)
+            self.current_node = node if node is not None and self._is_learned(node) else None
+            self.in_theory = self.current_node is not None
+            self.engine_mode = not self.in_theory
         
-        # If User is Black, Bot (White) must move first
-        if self.user_color == "black":
+        # If it is the Bot's turn (User is Black, or a resumed position), the Bot moves first
+        if self.board.turn != (chess.BLACK if self.user_color == "black" else chess.WHITE):
             self.make_bot_move()
 
+    def to_record(self) -> SessionRecord:
+        return SessionRecord(
+            self.session_id, self.user_id, self.user_color,
+            tuple(move.uci() for move in self.board.move_stack),
+            self.current_node.key if self.current_node is not None else None,
+            self.in_theory, self.engine_mode, self.learned_mask, self.tree.version, self.engine_level,
+        )
+
+    @classmethod
+    def from_record(cls, record: SessionRecord) -> 'GameSession':
+        """Rehydrates a session without replaying the bot's first move."""
+        session = cls.__new__(cls)
+        session.session_id = record.session_id
+        session.user_id = record.user_id
+        session.engine_level = record.engine_level
+        session.user_color = record.user_color
+        session.tree = tree_version(record.tree_version)
+        session.board = chess.Board()
+        for uci in record.moves:
+            session.board.push_uci(uci)
+        session.learned_mask = record.learned_mask
+        session.learned_opening_ids = set(mask_to_ids(record.learned_mask))
+        session.current_node = session.tree.nodes_by_hash.get(record.node_key) if record.node_key is not None else None
+        session.in_theory = record.in_theory and session.current_node is not None
+        session.engine_mode = record.engine_mode or not session.in_theory
+        return session
+
+    @property
+    def current_candidates(self) -> List[OpeningNode]:
+        return [self.current_node] if self.current_node is not None else []
+
+    def _is_learned(self, node: OpeningNode) -> bool:
+        return bool(node.opening_mask & self.learned_mask)
+
+    def _has_continuations(self) -> bool:
+        if self.current_node is None:
+            return False
+        learned_mask = self.learned_mask
+        return any(child.opening_mask & learned_mask for child in self.current_node.nodes)
+
     def make_bot_move(self) -> Optional[str]:
         """Calculates and plays the bot move (Theory or Engine). Returns SAN."""
-        print(f"make_bot_move called. Color: {self.user_color}. Candidates: {len(self.current_candidates)}")
         bot_move = None
         
         if self.in_theory:
-            # Pick a reply from the remaining candidates
-            possible_replies = [] 
-            
-            for node in self.current_candidates:
-                for move_san_key, child_node in node.children.items():
-                    if child_node.opening_ids.intersection(self.learned_opening_ids):
-                        possible_replies.append((move_san_key, child_node))
-            
-            print(f"Theory replies: {len(possible_replies)}")
+            # Pick a reply from the current position
+            possible_replies = []
+            with metrics.span("theory_lookup"):
+                if self.current_node is not None:
+                    possible_replies = [
+                        (move_san_key, child_node)
+                        for move_san_key, child_node in self.current_node.iter_children()
+                        if self._is_learned(child_node)
+                    ]
             
             if possible_replies:
-                reply_san, reply_node = random.choice(possible_replies)
+                # Lines the repertoire (or book) plays more often come up more often
+                weights = [max(1, node.weight) for _, node in possible_replies]
+                reply_san, reply_node = random.choices(possible_replies, weights)[0]
                 bot_move = reply_san
                 self.board.push_san(reply_san)
-                print(f"Bot played theory: {bot_move}")
+                _log.debug("Session %s: theory reply %s (of %d)", self.session_id, bot_move, len(possible_replies))
                 
-                # Update candidates
-                new_candidates = []
-                for node in self.current_candidates:
-                    if reply_san in node.children:
-                        child = node.children[reply_san]
-                        if child.opening_ids.intersection(self.learned_opening_ids):
-                            new_candidates.append(child)
-                self.current_candidates = new_candidates
+                self.current_node = reply_node
                 
                 # Check continuation
-                has_continuations = False
-                for node in self.current_candidates:
-                    for child in node.children.values():
-                        if child.opening_ids.intersection(self.learned_opening_ids):
-                            has_continuations = True
-                            break
-                    if has_continuations: break
-                
-                if not has_continuations:
+                if not self._has_continuations():
                     self.in_theory = False
                     self.engine_mode = True
 
             else:
-                print("No theory moves found.")
+                _log.debug("Session %s: no theory replies, engine takes over", self.session_id)
                 self.in_theory = False
                 self.engine_mode = True
         
         if self.engine_mode and not bot_move:
-             print("Entering Engine Mode logic.")
              if not self.board.is_game_over():
-                 best_move_san = get_engine_move(self.board.fen())
+                 # A speculative search of this position makes the reply a cache hit
+                 ponder.PONDERER.resolve(self.session_id, self.board, timeout=scheduler.ENGINE_DEADLINE_MS / 1000)
+                 best_move_san = get_engine_move(self.board.fen(), game=self.session_id, level=self.engine_level)
                  if best_move_san:
                      bot_move = best_move_san
                      self.board.push_san(bot_move)
-                     print(f"Bot played Engine: {bot_move}")
+                     _log.debug("Session %s: engine reply %s", self.session_id, bot_move)
                  else:
                      # Fallback
-                     print("Engine failed, trying random.")
                      legal_moves = list(self.board.legal_moves)
                      if legal_moves:
                          random_move = random.choice(legal_moves)
                          bot_move = self.board.san(random_move)
                          self.board.push(random_move)
-                         print(f"Bot played Random: {bot_move}")
+                         _log.info("Session %s: no engine reply, played random %s", self.session_id, bot_move)
+
+        if self.engine_mode and bot_move and not self.board.is_game_over():
+            # The next reply will be an engine search; start on it while the trainee thinks
+            ponder.PONDERER.start(self.session_id, self.board, self.engine_level)
         
         return bot_move
 
     def process_user_move(self, move_san: str) -> Dict:
+        result = self.apply_user_move(move_san)
+        if not result["legal"]:
+            return result
+        return {**self.play_bot_reply(result["mistake_made"]), "mistake_made": result["mistake_made"]}
+
+    def apply_user_move(self, move_san: str) -> Dict:
+        """Validates and plays the user's move and updates the theory state, without replying."""
         # 1. Validate Legality
         try:
-            move = self.board.parse_san(move_san)
+            with metrics.span("san_parse"):
+                move = self.board.parse_san(move_san)
         except ValueError:
              return {"legal": False, "message": "Illegal move format."}
         
-        if move not in self.board.legal_moves:
+        with metrics.span("legality"):
+            legal = move in self.board.legal_moves
+        if not legal:
              return {"legal": False, "message": "Illegal move."}
 
+        # Remember where the user stood, for the move event log
+        ply = self.board.ply()
+        if self.current_node is not None and self.in_theory:
+            position_before = self.current_node.key
+            line_mask = self.current_node.opening_mask & self.learned_mask
+            opening_before = (line_mask & -line_mask).bit_length() - 1 if line_mask else None
+        else:
+            position_before = position_key(self.board)
+            opening_before = None
+        was_in_theory = self.in_theory
+
         # Apply move to board
         self.board.push(move)
         
         mistake_made = False
 
-        # 2. Update Candidates (Theory Check)
+        # 2. Update Position Node (Theory Check)
         if self.in_theory:
-            next_candidates = []
-            for node in self.current_candidates:
-                if move_san in node.children:
-                    child = node.children[move_san]
-                    if child.opening_ids.intersection(self.learned_opening_ids):
-                        next_candidates.append(child)
+            with metrics.span("candidate_update"):
+                next_node = None
+                if self.current_node is not None:
+                    next_node = self.current_node.child(move_san)
+                if next_node is None:
+                    # Different move order into a known repertoire position
+                    next_node = self.tree.get_node(self.board)
+                if next_node is not None and not self._is_learned(next_node):
+                    next_node = None
             
-            self.current_candidates = next_candidates
+            self.current_node = next_node
 
-            if not self.current_candidates:
+            if self.current_node is None:
                 self.in_theory = False
                 self.engine_mode = True
                 mistake_made = True
             else:
                 mistake_made = False
 
+        event_log.EVENT_LOG.record(
+            self.session_id, self.user_id, ply, position_before, opening_before,
+            in_theory=was_in_theory and not mistake_made, mistake=mistake_made,
+        )
+
+        return {
+            "legal": True,
+            "uci": move.uci(),
+            "in_theory": self.in_theory,
+            "mistake_made": mistake_made,
+        }
+
+    @property
+    def has_book_reply(self) -> bool:
+        """True if the next bot move comes from the repertoire, i.e. needs no engine search."""
+        return self.in_theory and self._has_continuations()
+
+    def play_bot_reply(self, mistake_made: bool = False) -> Dict:
+        """Plays the bot's reply to the user's last move. May run an engine search."""
         # 3. Bot Reply
         bot_move = self.make_bot_move()
         
@@ -231,12 +870,10 @@ class GameSession:
         if self.engine_mode and not mistake_made: message = "Engine mode."
         if self.board.is_game_over(): message = "Game Over."
 
-        # Calculate remaining candidate IDs
-        current_opening_ids = set()
-        for node in self.current_candidates:
-            current_opening_ids.update(node.opening_ids)
-        # Filter by what the user actually learned/is playing color-wise
-        final_ids = list(current_opening_ids.intersection(self.learned_opening_ids))
+        # Calculate remaining candidate IDs, filtered by what the user actually learned/is playing color-wise
+        final_ids = []
+        if self.current_node is not None:
+            final_ids = mask_to_ids(self.current_node.opening_mask & self.learned_mask)
 
         return {
             "legal": True,
@@ -247,8 +884,4 @@ class GameSession:
             "candidate_opening_ids": final_ids, # Actual Opening IDs
             "message": message,
             "fen": self.board.fen(),
-            "mistake_made": mistake_made
         }
-
-# Global Session Store (In-Memory for V1)
-ACTIVE_SESSIONS: Dict[int, GameSession] = {}
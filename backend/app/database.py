@@ -1,14 +1,61 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./chess_trainer.db"
+from . import metrics
+
+# --- Configuration ---
+
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "./chess_trainer.db")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL") # Safe with WAL: only the last commits can be lost on power failure
+SQLITE_CACHE_MB = int(os.environ.get("SQLITE_CACHE_MB", "32")) # Page cache per connection
+SQLITE_MMAP_MB = int(os.environ.get("SQLITE_MMAP_MB", "128")) # Memory-mapped reads (0 disables)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")) # Wait for another writer instead of failing
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5")) # Connections kept open per engine
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10")) # Extra connections under load
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30")) # seconds to wait for a connection
+
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+_POOL_ARGS = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run while one connection writes (the default rollback
+    journal blocks them); the rest trades a little durability and memory
+    for fewer fsyncs and disk reads.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+# --- Sync engine (background threads: imports, caches, event log, admin endpoints) ---
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, **_POOL_ARGS
 )
+event.listen(engine, "connect", set_sqlite_pragmas)
+metrics.instrument_sqlalchemy(engine) # Every statement is timed as the `db` span
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- Async engine (hot endpoints; DB waits don't hold a threadpool slot) ---
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_POOL_ARGS)
+event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+metrics.instrument_sqlalchemy(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -17,3 +64,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
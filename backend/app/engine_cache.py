@@ -0,0 +1,258 @@
+import chess
+import chess.engine
+import chess.polyglot
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import delete, func, literal_column, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import database, metrics, models
+
+_log = metrics.get_logger("engine_cache")
+
+# --- Configuration ---
+
+ENGINE_CACHE_SIZE = int(os.environ.get("ENGINE_CACHE_SIZE", "100000")) # In-memory LRU entries
+ENGINE_CACHE_DB_MAX_ROWS = int(os.environ.get("ENGINE_CACHE_DB_MAX_ROWS", "1000000")) # 0 disables pruning
+ENGINE_CACHE_FLUSH_BATCH = int(os.environ.get("ENGINE_CACHE_FLUSH_BATCH", "64"))
+ENGINE_CACHE_FLUSH_INTERVAL = float(os.environ.get("ENGINE_CACHE_FLUSH_INTERVAL", "5")) # seconds
+
+CacheKey = Tuple[int, str]
+
+def position_key(board: chess.Board) -> int:
+    """Zobrist hash of the position. Move counters are not part of it, so transpositions share entries."""
+    return chess.polyglot.zobrist_hash(board)
+
+def limit_key(limit: chess.engine.Limit) -> str:
+    """Stable string for the parts of a search limit that change the result."""
+    parts = []
+    for name in ("time", "depth", "nodes", "mate"):
+        value = getattr(limit, name)
+        if value is not None:
+            parts.append(f"{name}={value:g}" if isinstance(value, float) else f"{name}={value}")
+    return ",".join(parts)
+
+def signed_key(h: int) -> int:
+    """Maps a 64-bit hash into SQLite's signed INTEGER range."""
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+def unsigned_key(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+class EngineCache:
+    """
+    Two-tier cache of engine best moves keyed by (position hash, search limit).
+
+    The memory tier is a bounded LRU. New results are also queued for the
+    `engine_cache` table and written in batches by a background thread
+    (write-behind), so cached replies survive restarts without slowing down
+    the request that produced them.
+    """
+
+    def __init__(self, max_entries: int = ENGINE_CACHE_SIZE,
+                 session_factory: Optional[Callable] = database.SessionLocal,
+                 max_db_rows: int = ENGINE_CACHE_DB_MAX_ROWS,
+                 flush_batch: int = ENGINE_CACHE_FLUSH_BATCH,
+                 flush_interval: float = ENGINE_CACHE_FLUSH_INTERVAL):
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self.max_db_rows = max_db_rows
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+
+        self._lru: "OrderedDict[CacheKey, str]" = OrderedDict()
+        self._pending: Dict[CacheKey, str] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._db_rows: Optional[int] = None # Running estimate of the table's rows (flushed rows all counted as new)
+
+        # Stats
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+    # --- Memory tier ---
+
+    def _remember(self, key: CacheKey, move_uci: str):
+        """Caller holds the lock."""
+        self._lru[key] = move_uci
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    # --- Public API ---
+
+    def get(self, board: chess.Board, limit: chess.engine.Limit) -> Optional[chess.Move]:
+        key = (position_key(board), limit_key(limit))
+
+        with self._lock:
+            move_uci = self._lru.get(key)
+            if move_uci is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+
+        if move_uci is None:
+            move_uci = self._load(key)
+            with self._lock:
+                if move_uci is None:
+                    self.misses += 1
+                    return None
+                self.db_hits += 1
+                self._remember(key, move_uci)
+
+        move = chess.Move.from_uci(move_uci)
+        # Guard against hash collisions handing back a move from another position.
+        return move if board.is_legal(move) else None
+
+    def contains(self, board: chess.Board, limit: chess.engine.Limit) -> bool:
+        """True if either tier has a result for the position. Not counted in the hit stats."""
+        key = (position_key(board), limit_key(limit))
+        with self._lock:
+            if key in self._lru:
+                return True
+        return self._load(key) is not None
+
+    def put(self, board: chess.Board, limit: chess.engine.Limit, move: chess.Move):
+        key = (position_key(board), limit_key(limit))
+        with self._lock:
+            self._remember(key, move.uci())
+            if self.session_factory is not None:
+                self._pending[key] = move.uci()
+                if len(self._pending) >= self.flush_batch:
+                    self._flush_event.set()
+        self._ensure_writer()
+
+    def clear_memory(self):
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.db_hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "pending_writes": len(self._pending),
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "writes": self.writes,
+            }
+
+    # --- Persistent tier ---
+
+    def _load(self, key: CacheKey) -> Optional[str]:
+        if self.session_factory is None:
+            return None
+        with self._lock:
+            # Not flushed yet, but still ours.
+            pending = self._pending.get(key)
+        if pending is not None:
+            return pending
+        try:
+            db = self.session_factory()
+            try:
+                entry = db.get(models.EngineCacheEntry, (signed_key(key[0]), key[1]))
+                return entry.move_uci if entry else None
+            finally:
+                db.close()
+        except Exception as e:
+            _log.warning("Engine cache read failed: %s", e)
+            return None
+
+    def flush(self):
+        """Writes pending entries to the database in one statement."""
+        if self.session_factory is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, {}
+
+            rows = [
+                {"position_hash": signed_key(h), "limit_key": lk, "move_uci": uci, "created_at": datetime.now(timezone.utc)}
+                for (h, lk), uci in batch.items()
+            ]
+            try:
+                db = self.session_factory()
+                try:
+                    stmt = sqlite_insert(models.EngineCacheEntry)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["position_hash", "limit_key"],
+                        set_={"move_uci": stmt.excluded.move_uci, "created_at": stmt.excluded.created_at},
+                    )
+                    db.execute(stmt, rows)
+                    self._prune(db, len(rows))
+                    db.commit()
+                finally:
+                    db.close()
+                with self._lock:
+                    self.writes += len(rows)
+            except Exception as e:
+                _log.error("Engine cache flush failed: %s", e)
+
+    def _prune(self, db, added: int):
+        """
+        Keeps the table under max_db_rows, dropping the oldest inserts first.
+        Rows are counted once, then tracked as a running estimate; only when
+        that passes the cap is the table counted again and cut to 10% below
+        it, so the full count runs once per max_db_rows / 10 new rows.
+        """
+        if self.max_db_rows <= 0:
+            return
+        if self._db_rows is None:
+            self._db_rows = db.scalar(select(func.count()).select_from(models.EngineCacheEntry))
+        else:
+            self._db_rows += added
+        if self._db_rows <= self.max_db_rows:
+            return
+
+        # Other workers write to the same table, so the estimate is checked before deleting
+        count = db.scalar(select(func.count()).select_from(models.EngineCacheEntry))
+        excess = count - (self.max_db_rows - self.max_db_rows // 10)
+        if excess > 0:
+            # rowid follows insertion order (upserts keep theirs), and walking it uses the table's own b-tree
+            rowid = literal_column("rowid")
+            cutoff = db.scalar(select(rowid).select_from(models.EngineCacheEntry).order_by(rowid).offset(excess - 1).limit(1))
+            db.execute(delete(models.EngineCacheEntry).where(rowid <= cutoff))
+            count -= excess
+        self._db_rows = count
+
+    def _ensure_writer(self):
+        if self._writer is not None or self.session_factory is None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name="engine-cache-writer", daemon=True)
+                self._writer.start()
+
+    def _writer_loop(self):
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def close(self):
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._writer is not None:
+            self._writer.join(timeout=2)
+            self._writer = None
+        self.flush()
+
+# --- Global Cache ---
+
+ENGINE_CACHE = EngineCache()
@@ -0,0 +1,250 @@
+import chess
+import chess.engine
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Optional, Union
+
+from . import metrics
+
+_log = metrics.get_logger("engine")
+
+# --- Configuration ---
+
+STOCKFISH_PATH = os.environ.get("STOCKFISH_PATH", "stockfish.exe") # Default to same dir or PATH
+ENGINE_POOL_SIZE = int(os.environ.get("ENGINE_POOL_SIZE", str(os.cpu_count() or 2)))
+ENGINE_HASH_MB = int(os.environ.get("ENGINE_HASH_MB", "16"))
+ENGINE_HEALTH_INTERVAL = float(os.environ.get("ENGINE_HEALTH_INTERVAL", "30")) # seconds, 0 disables
+ENGINE_ACQUIRE_TIMEOUT = float(os.environ.get("ENGINE_ACQUIRE_TIMEOUT", "10"))
+
+def find_engine_path() -> Optional[str]:
+    """Returns the first Stockfish binary found on disk, or None."""
+    search_paths = [STOCKFISH_PATH, "backend/stockfish.exe", "stockfish"]
+    for p in search_paths:
+        if os.path.exists(p) or (os.name != 'nt' and os.access(p, os.X_OK)):
+            return p
+    _log.warning("Stockfish binary NOT found. Searched: %s. Please place stockfish.exe in backend/ folder.", search_paths)
+    return None
+
+# --- Worker ---
+
+StopCondition = Callable[[chess.engine.InfoDict], bool]
+
+class EngineWorker:
+    """One long-lived UCI process. Not thread-safe; the pool hands it to one caller at a time."""
+
+    def __init__(self, worker_id: int, command: Union[str, List[str]], options: Dict[str, object]):
+        self.worker_id = worker_id
+        self.command = command
+        self.options = options
+        self.engine: Optional[chess.engine.SimpleEngine] = None
+        self.restarts = 0
+        self.searches = 0
+
+    def start(self):
+        self.engine = chess.engine.SimpleEngine.popen_uci(self.command)
+        supported = {name: value for name, value in self.options.items() if name in self.engine.options}
+        if supported:
+            self.engine.configure(supported)
+
+    def close(self):
+        if self.engine is None:
+            return
+        try:
+            self.engine.quit()
+        except Exception:
+            pass
+        try:
+            self.engine.close()
+        except Exception:
+            pass
+        self.engine = None
+
+    def restart(self):
+        self.close()
+        self.restarts += 1
+        self.start()
+
+    def is_alive(self) -> bool:
+        if self.engine is None:
+            return False
+        try:
+            self.engine.ping()
+            return True
+        except Exception:
+            return False
+
+    def play(self, board: chess.Board, limit: chess.engine.Limit, game: object = None,
+             stop_when: Optional[StopCondition] = None) -> chess.engine.PlayResult:
+        # Passing a new `game` key makes python-chess send `ucinewgame`, which
+        # clears the engine's hash and history between training sessions.
+        self.searches += 1
+        if stop_when is None:
+            return self.engine.play(board, limit, game=game)
+        # Watch the search's info lines and send `stop` as soon as the condition holds
+        with self.engine.analysis(board, limit, game=game) as analysis:
+            for info in analysis:
+                if stop_when(info):
+                    analysis.stop()
+                    break
+            best = analysis.wait()
+            return chess.engine.PlayResult(best.move, best.ponder, analysis.info)
+
+# --- Pool ---
+
+class EnginePool:
+    """
+    Fixed-size pool of persistent engine workers.
+    Workers are started once, health-checked in the background, restarted
+    if they crash, and shut down together with the application.
+    """
+
+    def __init__(self, command: Union[str, List[str]], size: int = ENGINE_POOL_SIZE,
+                 options: Optional[Dict[str, object]] = None,
+                 health_interval: float = ENGINE_HEALTH_INTERVAL):
+        self.command = command
+        self.size = max(1, size)
+        self.options = options if options is not None else {"Hash": ENGINE_HASH_MB, "Threads": 1}
+        self.health_interval = health_interval
+
+        self.workers: List[EngineWorker] = []
+        self._idle: "queue.Queue[EngineWorker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self):
+        for i in range(self.size):
+            worker = EngineWorker(i, self.command, self.options)
+            worker.start()
+            self.workers.append(worker)
+            self._idle.put(worker)
+
+        if self.health_interval > 0:
+            self._monitor = threading.Thread(target=self._monitor_loop, name="engine-health", daemon=True)
+            self._monitor.start()
+
+    @contextmanager
+    def acquire(self, timeout: float = ENGINE_ACQUIRE_TIMEOUT):
+        if self._closed:
+            raise RuntimeError("Engine pool is shut down.")
+        worker = self._idle.get(timeout=timeout)
+        try:
+            if worker.engine is None:
+                worker.restart()
+            yield worker
+        finally:
+            if self._closed:
+                worker.close()
+            else:
+                self._idle.put(worker)
+
+    def play(self, board: chess.Board, limit: chess.engine.Limit, game: object = None,
+             stop_when: Optional[StopCondition] = None) -> chess.engine.PlayResult:
+        """
+        Runs one search on an idle worker, restarting it once if the process died.
+        `stop_when` is checked against each info line and ends the search early.
+        """
+        with self.acquire() as worker:
+            try:
+                return worker.play(board, limit, game=game, stop_when=stop_when)
+            except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+                _log.warning("Engine worker %s crashed, restarting.", worker.worker_id)
+                worker.restart()
+                return worker.play(board, limit, game=game, stop_when=stop_when)
+
+    def health_check(self) -> List[Dict]:
+        """Pings every idle worker and restarts the dead ones. Busy workers are reported as busy."""
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        for worker in checked:
+            if not worker.is_alive() and not self._closed:
+                _log.warning("Engine worker %s failed health check, restarting.", worker.worker_id)
+                try:
+                    worker.restart()
+                except Exception as e:
+                    _log.error("Engine restart failed: %s", e)
+                    worker.close()
+
+        statuses = []
+        for worker in self.workers:
+            statuses.append({
+                "worker_id": worker.worker_id,
+                "busy": worker not in checked,
+                "alive": worker.engine is not None,
+                "searches": worker.searches,
+                "restarts": worker.restarts,
+            })
+
+        for worker in checked:
+            self._idle.put(worker)
+        return statuses
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(self.health_interval):
+            self.health_check()
+
+    def shutdown(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop_event.set()
+        # Busy workers are closed by `acquire` when they are handed back.
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._monitor is not None:
+            self._monitor.join(timeout=1)
+
+# --- Global Pool ---
+
+ENGINE_POOL: Optional[EnginePool] = None
+_pool_lock = threading.Lock()
+_pool_failed = False # No binary, or it would not start: not searched for again until shutdown_engine_pool
+
+def get_engine_pool() -> Optional[EnginePool]:
+    """
+    Returns the shared pool, starting it on first use. None if no engine
+    binary is available; that is remembered, so games without an engine
+    don't search the disk (and log) on every move.
+
+    python-chess runs each engine on a non-daemon thread, so the pool must
+    be closed before the interpreter exits: the app's shutdown hook does it,
+    and scripts call shutdown_engine_pool themselves.
+    """
+    global ENGINE_POOL, _pool_failed
+    if ENGINE_POOL is not None or _pool_failed:
+        return ENGINE_POOL
+    with _pool_lock:
+        if ENGINE_POOL is None and not _pool_failed:
+            engine_path = find_engine_path()
+            if not engine_path:
+                _pool_failed = True
+                return None
+            pool = EnginePool(engine_path)
+            try:
+                pool.start()
+            except Exception:
+                pool.shutdown()
+                _pool_failed = True
+                raise
+            ENGINE_POOL = pool
+    return ENGINE_POOL
+
+def shutdown_engine_pool():
+    global ENGINE_POOL, _pool_failed
+    with _pool_lock:
+        _pool_failed = False
+        if ENGINE_POOL is not None:
+            ENGINE_POOL.shutdown()
+            ENGINE_POOL = None
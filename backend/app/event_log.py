@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from . import database, metrics, models
+from .engine_cache import signed_key
+
+_log = metrics.get_logger("event_log")
+
+# --- Configuration ---
+
+EVENT_LOG_FLUSH_BATCH = int(os.environ.get("EVENT_LOG_FLUSH_BATCH", "500"))
+EVENT_LOG_FLUSH_INTERVAL = float(os.environ.get("EVENT_LOG_FLUSH_INTERVAL", "2")) # seconds
+EVENT_LOG_ENABLED = os.environ.get("EVENT_LOG_ENABLED", "1") != "0"
+
+_NONE = -1 # Column sentinel for NULL user_id / opening_id
+
+class _Columns:
+    """One buffered batch of move events, stored column by column in typed arrays."""
+
+    def __init__(self):
+        self.session_id = array("q")
+        self.user_id = array("q")
+        self.ply = array("i")
+        self.position_hash = array("q")
+        self.opening_id = array("q")
+        self.in_theory = array("b")
+        self.mistake = array("b")
+        self.created_at = array("d")
+
+    def __len__(self) -> int:
+        return len(self.session_id)
+
+    def rows(self) -> List[Dict]:
+        return [
+            {
+                "session_id": s, "user_id": None if u == _NONE else u, "ply": p,
+                "position_hash": h, "opening_id": None if o == _NONE else o,
+                "in_theory": bool(t), "mistake": bool(m),
+                "created_at": datetime.utcfromtimestamp(c),
+            }
+            for s, u, p, h, o, t, m, c in zip(
+                self.session_id, self.user_id, self.ply, self.position_hash, self.opening_id,
+                self.in_theory, self.mistake, self.created_at,
+            )
+        ]
+
+class MoveEventLog:
+    """
+    Append-only log of user moves.
+
+    `record` only appends to in-memory column arrays; a background thread
+    swaps the batch out and writes it with a single bulk INSERT.
+    """
+
+    def __init__(self, session_factory: Optional[Callable] = database.SessionLocal,
+                 flush_batch: int = EVENT_LOG_FLUSH_BATCH,
+                 flush_interval: float = EVENT_LOG_FLUSH_INTERVAL,
+                 enabled: bool = EVENT_LOG_ENABLED):
+        self.session_factory = session_factory
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+
+        self._batch = _Columns()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+        self.recorded = 0
+        self.written = 0
+
+    def record(self, session_id: int, user_id: Optional[int], ply: int, position_key: int,
+               opening_id: Optional[int], in_theory: bool, mistake: bool):
+        if not self.enabled:
+            return
+        with self._lock:
+            b = self._batch
+            b.session_id.append(session_id)
+            b.user_id.append(_NONE if user_id is None else user_id)
+            b.ply.append(ply)
+            b.position_hash.append(signed_key(position_key))
+            b.opening_id.append(_NONE if opening_id is None else opening_id)
+            b.in_theory.append(in_theory)
+            b.mistake.append(mistake)
+            b.created_at.append(time.time())
+            self.recorded += 1
+            if len(b) >= self.flush_batch:
+                self._flush_event.set()
+            if self._writer is None and self.session_factory is not None:
+                self._writer = threading.Thread(target=self._writer_loop, name="event-log-writer", daemon=True)
+                self._writer.start()
+
+    def flush(self):
+        if self.session_factory is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not len(self._batch):
+                    return
+                batch, self._batch = self._batch, _Columns()
+
+            try:
+                db = self.session_factory()
+                try:
+                    db.execute(insert(models.MoveEvent), batch.rows())
+                    db.commit()
+                finally:
+                    db.close()
+                with self._lock:
+                    self.written += len(batch)
+            except Exception as e:
+                _log.error("Event log flush failed (%d events dropped): %s", len(batch), e)
+
+    def _writer_loop(self):
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def close(self):
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._writer is not None:
+            self._writer.join(timeout=2)
+            self._writer = None
+        self.flush()
+
+# --- Global Log ---
+
+EVENT_LOG = MoveEventLog()
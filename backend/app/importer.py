@@ -0,0 +1,283 @@
+import io
+import os
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+import chess.pgn
+
+from . import chess_logic, database, lessons, metrics, models, polyglot, tree_loader
+from .chess_logic import MoveRecord
+
+_log = metrics.get_logger("importer")
+
+# --- Configuration ---
+
+IMPORT_BATCH_GAMES = int(os.environ.get("IMPORT_BATCH_GAMES", "200")) # Games parsed and applied together
+IMPORT_PARSE_WORKERS = int(os.environ.get("IMPORT_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+IMPORT_MAX_JOBS = int(os.environ.get("IMPORT_MAX_JOBS", "1")) # Imports running at once
+
+# --- Streaming ---
+
+def iter_game_texts(handle: TextIO) -> Iterator[str]:
+    """
+    Splits a PGN stream into the raw text of each game, one game in memory
+    at a time. A game ends where a tag line follows movetext (outside a
+    `{}` comment); no moves are parsed here.
+    """
+    lines: List[str] = []
+    in_moves = False
+    comment_depth = 0
+    for line in handle:
+        is_tag = comment_depth == 0 and line.startswith("[")
+        if is_tag and in_moves:
+            yield "".join(lines)
+            lines = []
+            in_moves = False
+        lines.append(line)
+        if line.strip() and not is_tag:
+            in_moves = True
+        comment_depth = max(0, comment_depth + line.count("{") - line.count("}"))
+    if in_moves:
+        yield "".join(lines)
+
+class ParsedBatch(NamedTuple):
+    records: List[MoveRecord]
+    games: int
+    errors: int
+
+def parse_batch(pgn_text: str) -> ParsedBatch:
+    """Parses a batch of games (runs in a worker process). Record parents are batch-local."""
+    records: List[MoveRecord] = []
+    games = errors = 0
+    pgn = io.StringIO(pgn_text)
+    while True:
+        game = chess.pgn.read_game(pgn)
+        if game is None:
+            break
+        games += 1
+        if not chess_logic.add_game_records(game, records) or game.errors:
+            errors += 1
+    return ParsedBatch(records, games, errors)
+
+def _batches(text: TextIO, batch_games: int) -> Iterator[str]:
+    batch: List[str] = []
+    for game_text in iter_game_texts(text):
+        batch.append(game_text)
+        if len(batch) >= batch_games:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+def parse_file(pgn_path: str, batch_games: int = IMPORT_BATCH_GAMES,
+               pool: Optional[Executor] = None, in_flight: int = 1,
+               is_book: Optional[bool] = None) -> Iterator[Tuple[ParsedBatch, int]]:
+    """
+    Streams a PGN file as parsed batches, in file order, each with the number
+    of bytes read so far. With a pool, up to `in_flight` batches parse ahead.
+    A Polyglot book (.bin, or `is_book` for uploads under a temp name) is read
+    in one batch; its lookups are binary searches in the mapped file, so
+    there is nothing to parse ahead.
+    """
+    if is_book if is_book is not None else pgn_path.endswith(".bin"):
+        yield ParsedBatch(polyglot.read_records(pgn_path), 0, 0), os.path.getsize(pgn_path)
+        return
+    with open(pgn_path, "rb") as raw:
+        text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+        pending: Deque[Tuple[Future, int]] = deque()
+        for batch_text in _batches(text, batch_games):
+            if pool is None:
+                yield parse_batch(batch_text), raw.tell()
+                continue
+            pending.append((pool.submit(parse_batch, batch_text), raw.tell()))
+            if len(pending) > in_flight:
+                future, offset = pending.popleft()
+                yield future.result(), offset
+        while pending:
+            future, offset = pending.popleft()
+            yield future.result(), offset
+
+def read_tree(pgn_path: str, batch_games: int = IMPORT_BATCH_GAMES,
+              pool: Optional[Executor] = None, in_flight: int = 1,
+              is_book: Optional[bool] = None) -> chess_logic.OpeningTree:
+    """
+    A private tree of one file's positions. Each parsed batch is merged in
+    and dropped, so memory follows the distinct positions, not the file.
+    """
+    tree = chess_logic.OpeningTree()
+    for parsed, _ in parse_file(pgn_path, batch_games, pool, in_flight, is_book):
+        tree.add_records(0, parsed.records)
+    return tree
+
+def remove_opening(opening_id: int, pgn_path: Optional[str] = None):
+    """Takes an opening out of the live tree; its PGN (if still there) gives back the line weights."""
+    # Loaded first, or the warm-up could add it back afterwards
+    tree_loader.TREE_LOADER.ensure([opening_id])
+    old_records = []
+    if pgn_path and os.path.exists(pgn_path):
+        old_records = read_tree(pgn_path).to_records()
+    with chess_logic.TREE_WRITE_LOCK:
+        edit = chess_logic.begin_edit()
+        edit.subtract_records(old_records)
+        edit.remove_opening(opening_id)
+        chess_logic.publish_tree(edit.commit())
+
+# --- Jobs ---
+
+class ImportJobs:
+    """
+    Runs PGN imports in the background.
+
+    The file is read as a stream and cut into batches of games. Batches are
+    parsed in a process pool (so the API's threads keep the GIL) and merged
+    in file order into a private tree of the file's positions, then
+    dropped. When the file is done that tree goes into the live one in a
+    single TreeEdit. Each batch updates the job's row in `import_jobs`,
+    which any worker can report.
+    """
+
+    def __init__(self, session_factory: Callable = database.SessionLocal,
+                 batch_games: int = IMPORT_BATCH_GAMES, parse_workers: int = IMPORT_PARSE_WORKERS,
+                 max_jobs: int = IMPORT_MAX_JOBS):
+        self.session_factory = session_factory
+        self.batch_games = batch_games
+        self.parse_workers = parse_workers
+        self.max_jobs = max_jobs
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+
+    def submit(self, opening_id: int, pgn_path: str, upload_path: Optional[str] = None) -> str:
+        """
+        Queues an import of `pgn_path` into the opening. With `upload_path`,
+        the opening already exists: the job swaps its current lines for the
+        upload's and moves the upload over `pgn_path` once that has committed.
+        """
+        job_id = uuid.uuid4().hex
+        db = self.session_factory()
+        try:
+            db.add(models.ImportJob(
+                id=job_id, opening_id=opening_id, filename=os.path.basename(pgn_path),
+                status="queued", bytes_total=os.path.getsize(upload_path or pgn_path),
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="pgn-import")
+            future = self._executor.submit(self._run, job_id, opening_id, pgn_path, upload_path)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return job_id
+
+    def _forget(self, job_id: str):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None):
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+
+    def _update(self, job_id: str, **values):
+        db = self.session_factory()
+        try:
+            db.query(models.ImportJob).filter(models.ImportJob.id == job_id).update(values)
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self, job_id: str, opening_id: int, pgn_path: str, upload_path: Optional[str]):
+        self._update(job_id, status="running", started_at=datetime.utcnow())
+        games = errors = positions = 0
+        try:
+            if upload_path is not None:
+                # The old lines must be in the tree before they can be swapped out
+                tree_loader.TREE_LOADER.ensure([opening_id])
+            # Parse into private trees first, without the tree lock: warm-up
+            # loads, deletes and other imports only wait for the merge below.
+            # A private edit of the live tree would go stale if any of them
+            # published while the file is read.
+            new_tree = chess_logic.OpeningTree()
+            old_records: List[MoveRecord] = []
+            pool: Optional[Executor] = None
+            if self.parse_workers > 1:
+                pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+            try:
+                source = upload_path or pgn_path
+                for parsed, offset in parse_file(source, self.batch_games, pool, self.parse_workers,
+                                                 is_book=pgn_path.endswith(".bin")):
+                    new_tree.add_records(opening_id, parsed.records)
+                    games += parsed.games
+                    errors += parsed.errors
+                    positions = len(new_tree) - 1
+                    self._update(job_id, bytes_read=offset, games=games, errors=errors, positions=positions)
+                if upload_path is not None and os.path.exists(pgn_path):
+                    old_records = read_tree(pgn_path, self.batch_games, pool, self.parse_workers).to_records()
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+            new_records = new_tree.to_records()
+            del new_tree
+
+            # One writer at a time. Readers keep using the published tree
+            # until the whole import is in, then see all of it at once.
+            with chess_logic.TREE_WRITE_LOCK:
+                edit = chess_logic.begin_edit()
+                if upload_path is not None:
+                    edit.subtract_records(old_records)
+                    edit.remove_opening(opening_id)
+                edit.add_records(opening_id, new_records)
+                tree = edit.commit()
+                # The upload replaces the old file only once its lines are in
+                if upload_path is not None:
+                    os.replace(upload_path, pgn_path)
+                chess_logic.publish_tree(tree)
+
+            lessons.write_lesson(pgn_path)
+            self._update(job_id, status="done", bytes_read=os.path.getsize(pgn_path), finished_at=datetime.utcnow())
+            _log.info("Import %s: %d games, %d errors, %d positions.", job_id, games, errors, positions)
+        except Exception as e:
+            _log.error("Import %s failed: %s", job_id, e)
+            # The old file and lines stay; only the rejected upload goes
+            if upload_path is not None and os.path.exists(upload_path):
+                os.remove(upload_path)
+            self._update(job_id, status="failed", message=str(e), finished_at=datetime.utcnow())
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def job_status(job: models.ImportJob) -> Dict:
+    """Progress fields for the API, with throughput over the time the job has run."""
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    return {
+        "job_id": job.id,
+        "opening_id": job.opening_id,
+        "filename": job.filename,
+        "status": job.status,
+        "progress": round(job.bytes_read / job.bytes_total, 4) if job.bytes_total else (1.0 if job.status == "done" else 0.0),
+        "bytes_read": job.bytes_read,
+        "bytes_total": job.bytes_total,
+        "games": job.games,
+        "errors": job.errors,
+        "positions": job.positions,
+        "games_per_sec": round(job.games / elapsed, 1) if elapsed > 0 else 0.0,
+        "elapsed_sec": round(elapsed, 3),
+        "message": job.message,
+    }
+
+# --- Global Jobs ---
+
+IMPORT_JOBS = ImportJobs()
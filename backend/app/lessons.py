@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, TextIO, Tuple, Union
+
+import chess
+import chess.pgn
+
+from . import metrics
+
+_log = metrics.get_logger("lessons")
+
+# --- Configuration ---
+
+LESSON_CACHE_SIZE = int(os.environ.get("LESSON_CACHE_SIZE", "512")) # Lessons kept in memory
+LESSON_MAX_GAMES = int(os.environ.get("LESSON_MAX_GAMES", "50")) # Games per lesson; large imports are cut off here
+LESSON_SUFFIX = ".lesson.json.gz"
+
+# --- Payload ---
+
+def build_lesson(pgn_content: Union[str, TextIO], max_games: int = LESSON_MAX_GAMES) -> Dict:
+    """
+    Flattens a repertoire PGN into the lesson payload.
+
+    Every line (game mainline or variation) becomes one entry of `lines`:
+    `parent` is the index of the line it branches from (-1 for a game's
+    mainline), `ply` the number of half-moves played before its first move,
+    and `san` / `fen` the moves and the position after each of them. The
+    first line is the mainline of the first game, which the lesson page shows.
+    Games with a custom starting position are skipped, as in the opening tree.
+    `pgn_content` may be a string or an open text file.
+    """
+    lines: List[Dict] = []
+    pgn_io = io.StringIO(pgn_content) if isinstance(pgn_content, str) else pgn_content
+    for _ in range(max_games):
+        game = chess.pgn.read_game(pgn_io)
+        if game is None:
+            break
+        if "FEN" in game.headers:
+            continue
+
+        # (first node of the line, board before it, parent line index)
+        game_line = len(lines)
+        stack: List[Tuple[chess.pgn.ChildNode, chess.Board, int]] = []
+        for variation in reversed(game.variations[1:]):
+            stack.append((variation, chess.Board(), game_line))
+        if game.variations:
+            stack.append((game.variations[0], chess.Board(), -1))
+
+        while stack:
+            node, board, parent = stack.pop()
+            line = {"parent": parent, "ply": board.ply(), "san": [], "fen": []}
+            index = len(lines)
+            lines.append(line)
+            while True:
+                line["san"].append(board.san(node.move))
+                board.push(node.move)
+                line["fen"].append(board.fen())
+                if not node.variations:
+                    break
+                # Side variations branch off this line at the next ply
+                for variation in reversed(node.variations[1:]):
+                    stack.append((variation, board.copy(stack=False), index))
+                node = node.variations[0]
+    return {"lines": lines}
+
+def encode_lesson(lesson: Dict) -> bytes:
+    body = json.dumps(lesson, separators=(",", ":")).encode()
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+def lesson_path(pgn_path: str) -> str:
+    root, _ = os.path.splitext(pgn_path)
+    return root + LESSON_SUFFIX
+
+def write_lesson(pgn_path: str, pgn_content: Optional[str] = None) -> bytes:
+    """Builds the lesson for a PGN (or Polyglot book) and stores it, compressed, next to it."""
+    if pgn_content is None and pgn_path.endswith(".bin"):
+        from . import polyglot
+        data = encode_lesson(build_lesson(polyglot.book_to_pgn(pgn_path)))
+    elif pgn_content is None:
+        with open(pgn_path, "r", errors="replace") as f:
+            data = encode_lesson(build_lesson(f))
+    else:
+        data = encode_lesson(build_lesson(pgn_content))
+    path = lesson_path(pgn_path)
+    # A temp file of its own: a request and the warm-up may rebuild the same lesson at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return data
+
+def _is_stale(pgn_path: str) -> bool:
+    try:
+        return os.stat(lesson_path(pgn_path)).st_mtime_ns < os.stat(pgn_path).st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+def ensure_lessons(pgn_paths: Iterable[str]) -> int:
+    """Builds lessons that are missing or older than their PGN. Returns how many were built."""
+    built = 0
+    for pgn_path in pgn_paths:
+        if os.path.exists(pgn_path) and _is_stale(pgn_path):
+            try:
+                write_lesson(pgn_path)
+                built += 1
+            except (OSError, ValueError) as e:
+                _log.warning("Could not build lesson for %s: %s", pgn_path, e)
+    return built
+
+# --- Cache ---
+
+class Lesson(NamedTuple):
+    etag: str
+    gzip_body: bytes
+    mtime_ns: int
+
+    def body(self) -> bytes:
+        return gzip.decompress(self.gzip_body)
+
+class LessonCache:
+    """
+    Compressed lesson payloads by opening ID, bounded LRU.
+
+    A hit costs one stat() of the lesson file: a lesson rewritten by another
+    worker (after an upload) has a new mtime and is reloaded. Lessons older
+    than their PGN are rebuilt on load.
+    """
+
+    def __init__(self, max_entries: int = LESSON_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lessons: "OrderedDict[int, Lesson]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, opening_id: int, pgn_path: str) -> Optional[Lesson]:
+        path = lesson_path(pgn_path)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        with self._lock:
+            lesson = self._lessons.get(opening_id)
+            if lesson is not None and lesson.mtime_ns == mtime_ns:
+                self._lessons.move_to_end(opening_id)
+                self.hits += 1
+                return lesson
+
+        # Miss: rebuild the lesson if it is missing or older than its PGN
+        if not os.path.exists(pgn_path):
+            return None
+        if mtime_ns is None or _is_stale(pgn_path):
+            data = write_lesson(pgn_path)
+            mtime_ns = os.stat(path).st_mtime_ns
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+        lesson = Lesson(f'"{hashlib.sha1(data).hexdigest()[:20]}"', data, mtime_ns)
+
+        with self._lock:
+            self._lessons[opening_id] = lesson
+            self._lessons.move_to_end(opening_id)
+            while len(self._lessons) > self.max_entries:
+                self._lessons.popitem(last=False)
+            self.loads += 1
+        return lesson
+
+    def invalidate(self, opening_id: int):
+        with self._lock:
+            self._lessons.pop(opening_id, None)
+
+# --- Global Cache ---
+
+LESSON_CACHE = LessonCache()
@@ -0,0 +1,298 @@
+import bisect
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+# --- Configuration ---
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01")) # Share of hot-path debug/info lines kept
+
+# Seconds; spans range from microsecond tree lookups to engine searches
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# --- Logging ---
+
+class SampleFilter(logging.Filter):
+    """Keeps a random share of records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+_root_logger = logging.getLogger("chess_trainer")
+if not _root_logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _root_logger.addHandler(_handler)
+    _root_logger.setLevel(LOG_LEVEL)
+
+def get_logger(name: str, sampled: bool = False) -> logging.Logger:
+    """
+    Loggers under `chess_trainer`, leveled by LOG_LEVEL. Hot-path loggers are
+    `sampled`: below WARNING only LOG_SAMPLE_RATE of their records are kept.
+    Log with %-style arguments so disabled levels cost one level check.
+    """
+    logger = logging.getLogger(f"chess_trainer.{name}")
+    if sampled and not any(isinstance(f, SampleFilter) for f in logger.filters):
+        logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+    return logger
+
+_log = get_logger("metrics")
+
+# --- Metric Types ---
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _format_labels(labels: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Cumulative-bucket histogram of one labeled series. `observe` is a bisect and three adds."""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (what Prometheus would estimate at best)."""
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+class MetricsRegistry:
+    """
+    Named metric families with labeled series, rendered in the Prometheus
+    text format. Collectors are callbacks that report gauges (e.g. a cache's
+    `stats()`) at scrape time, so components need no instrumentation of their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families: Dict[str, Tuple[str, str, Dict[LabelKey, object]]] = {} # name -> (type, help, series)
+        self._collectors: List[Tuple[str, Callable[[], Dict]]] = []
+
+    def _series(self, kind: str, name: str, help_text: str, labels: Dict[str, str], factory: Callable):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is not None:
+            series = family[2].get(key)
+            if series is not None:
+                return series
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help_text, {}))
+            return family[2].setdefault(key, factory())
+
+    def histogram(self, name: str, help_text: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: str) -> Histogram:
+        return self._series("histogram", name, help_text, labels, lambda: Histogram(buckets))
+
+    def counter(self, name: str, help_text: str = "", **labels: str) -> Counter:
+        """Counter names end in `_total`, as Prometheus expects."""
+        return self._series("counter", name, help_text, labels, Counter)
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict]):
+        """Numeric values of `collect()` are exported as gauges named `<prefix>_<key>`."""
+        with self._lock:
+            self._collectors = [(p, c) for p, c in self._collectors if p != prefix] + [(prefix, collect)]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            families = [(name, kind, help_text, list(series.items())) for name, (kind, help_text, series) in sorted(self._families.items())]
+            collectors = list(self._collectors)
+
+        for name, kind, help_text, series in families:
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in sorted(series, key=lambda item: item[0]):
+                if isinstance(metric, Histogram):
+                    counts, total, count = metric.snapshot()
+                    cumulative = 0
+                    for bound, n in zip(metric.buckets + (float("inf"),), counts):
+                        cumulative += n
+                        le = 'le="%s"' % _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+
+        for prefix, collect in collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                _log.warning("Metrics collector %s failed: %s", prefix, e)
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+# --- Global Registry ---
+
+METRICS = MetricsRegistry()
+
+# --- Spans ---
+
+SPAN_METRIC = "chess_span_seconds"
+
+class _Span:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+_span_histograms: Dict[str, Histogram] = {}
+
+def span_histogram(name: str) -> Histogram:
+    histogram = _span_histograms.get(name)
+    if histogram is None:
+        histogram = METRICS.histogram(SPAN_METRIC, "Time spent in one step of handling a move or request.", span=name)
+        _span_histograms[name] = histogram
+    return histogram
+
+def span(name: str):
+    """
+    Times a block into the `chess_span_seconds{span=name}` histogram:
+
+        with metrics.span("theory_lookup"):
+            ...
+
+    With METRICS_ENABLED=0 this returns a shared no-op context.
+    """
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return _Span(_span_histograms.get(name) or span_histogram(name))
+
+def observe(name: str, seconds: float):
+    """Records a span measured elsewhere (e.g. across callbacks)."""
+    if METRICS_ENABLED:
+        (_span_histograms.get(name) or span_histogram(name)).observe(seconds)
+
+# --- Database ---
+
+def instrument_sqlalchemy(engine_or_class):
+    """Times every statement executed through `engine_or_class` as the `db` span."""
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if started:
+            observe("db", time.perf_counter() - started.pop())
+
+    event.listen(engine_or_class, "before_cursor_execute", before)
+    event.listen(engine_or_class, "after_cursor_execute", after)
+
+# --- HTTP ---
+
+HTTP_METRIC = "chess_http_request_seconds"
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route template and status.
+    Plain ASGI rather than BaseHTTPMiddleware, so it adds no task or
+    response re-streaming per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            METRICS.histogram(
+                HTTP_METRIC, "HTTP request latency by route.",
+                method=scope["method"], route=path, status=str(status[0]),
+            ).observe(time.perf_counter() - started)
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from datetime import datetime, timezone
 from .database import Base
 
 class User(Base):
@@ -45,3 +45,64 @@ class Session(Base):
     end_time = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="sessions")
+
+
+class EngineCacheEntry(Base):
+    __tablename__ = "engine_cache"
+
+    # Zobrist hash stored as a signed 64-bit integer (SQLite INTEGER range)
+    position_hash = Column(Integer, primary_key=True)
+    limit_key = Column(String, primary_key=True)
+    move_uci = Column(String)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class MoveEvent(Base):
+    __tablename__ = "move_events"
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True, nullable=True)
+    ply = Column(Integer)
+    position_hash = Column(Integer, index=True) # Position before the user's move (signed Zobrist)
+    opening_id = Column(Integer, index=True, nullable=True) # Line the user was on, if in theory
+    in_theory = Column(Boolean) # Move matched the repertoire
+    mistake = Column(Boolean) # Move left the repertoire
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class GameState(Base):
+    """Compact live-game state shared by all API workers (see session_store)."""
+    __tablename__ = "game_states"
+
+    session_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=True)
+    user_color = Column(String)
+    moves = Column(String, default="") # Space-separated UCI moves
+    ply = Column(Integer, default=0)
+    node_key = Column(Integer, nullable=True) # Signed Zobrist key
+    in_theory = Column(Boolean)
+    engine_mode = Column(Boolean)
+    learned_mask = Column(String) # Hex; may exceed 64 bits
+    tree_version = Column(Integer, nullable=True) # Opening tree version the game is pinned to
+    engine_level = Column(String, nullable=True) # Search budget level, NULL for the server default
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ImportJob(Base):
+    """Progress of a background PGN import (see importer), readable from any worker."""
+    __tablename__ = "import_jobs"
+
+    id = Column(String, primary_key=True)
+    opening_id = Column(Integer, ForeignKey("openings.id"), nullable=True)
+    filename = Column(String)
+    status = Column(String, default="queued") # 'queued', 'running', 'done' or 'failed'
+    bytes_total = Column(Integer, default=0)
+    bytes_read = Column(Integer, default=0)
+    games = Column(Integer, default=0)
+    errors = Column(Integer, default=0) # Games skipped or cut short by PGN errors
+    positions = Column(Integer, default=0) # Move records added to the tree
+    message = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
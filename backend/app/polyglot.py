@@ -0,0 +1,158 @@
+import os
+import struct
+import tempfile
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+from . import metrics
+from .chess_logic import MoveRecord, position_key
+
+_log = metrics.get_logger("polyglot")
+
+# --- Configuration ---
+
+BOOK_MAX_PLIES = int(os.environ.get("BOOK_MAX_PLIES", "24")) # Deepest book move imported
+BOOK_MAX_POSITIONS = int(os.environ.get("BOOK_MAX_POSITIONS", "200000")) # Positions expanded per imported book
+BOOK_MIN_WEIGHT = int(os.environ.get("BOOK_MIN_WEIGHT", "1")) # Entries below this weight are ignored
+BOOK_LESSON_PLIES = int(os.environ.get("BOOK_LESSON_PLIES", "16")) # Depth of the lesson built from a book
+BOOK_LESSON_BRANCHES = int(os.environ.get("BOOK_LESSON_BRANCHES", "3")) # Moves shown per lesson position
+BOOK_LESSON_POSITIONS = int(os.environ.get("BOOK_LESSON_POSITIONS", "60")) # Positions that get side lines
+
+# Polyglot entry: key, move, weight, learn (big-endian, 16 bytes)
+ENTRY = struct.Struct(">QHHI")
+MAX_WEIGHT = 0xFFFF
+
+# --- Writing ---
+
+def encode_move(board: chess.Board, move: chess.Move) -> int:
+    """Polyglot move bits: to | from << 6 | promotion << 12. Castling is written as king-takes-rook."""
+    to_square = move.to_square
+    if board.is_castling(move):
+        rook_file = 7 if board.is_kingside_castling(move) else 0
+        to_square = chess.square(rook_file, chess.square_rank(move.from_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return to_square | move.from_square << 6 | promotion << 12
+
+def book_entries(tree, mask: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    (key, move, weight) for every move in the tree, or only the moves of
+    the openings in `mask`. Each position is visited once, however many
+    lines transpose into it.
+    """
+    entries: List[Tuple[int, int, int]] = []
+    board = chess.Board()
+    seen = {tree.root.key}
+    # (node, ply before the move into it, that move)
+    stack = [(tree.root, 0, None)]
+    while stack:
+        node, ply, move_san = stack.pop()
+        while len(board.move_stack) > ply:
+            board.pop()
+        if move_san is not None:
+            board.push_san(move_san)
+        for san, child in node.iter_children():
+            if mask is not None and not child.opening_mask & mask:
+                continue
+            move = board.parse_san(san)
+            entries.append((node.key, encode_move(board, move), child.weight))
+            if child.key not in seen:
+                seen.add(child.key)
+                stack.append((child, len(board.move_stack), san))
+    return entries
+
+def book_bytes(tree, mask: Optional[int] = None) -> bytes:
+    """The tree as a Polyglot book: entries sorted by key, heaviest move first."""
+    entries = book_entries(tree, mask)
+    heaviest = max((weight for _, _, weight in entries), default=0)
+    scale = MAX_WEIGHT / heaviest if heaviest > MAX_WEIGHT else 1.0
+    entries.sort(key=lambda e: (e[0], -e[2]))
+    out = bytearray(ENTRY.size * len(entries))
+    for i, (key, move, weight) in enumerate(entries):
+        ENTRY.pack_into(out, i * ENTRY.size, key, move, max(1, int(weight * scale)), 0)
+    return bytes(out)
+
+def write_book(tree, path: str, mask: Optional[int] = None):
+    data = book_bytes(tree, mask)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# --- Reading ---
+
+def _walk(reader: chess.polyglot.MemoryMappedReader, max_plies: int, max_positions: int,
+          min_weight: int) -> Iterator[Tuple[int, int, chess.polyglot.Entry, chess.Board]]:
+    """
+    Depth-first walk of a book from the start position. Yields (parent record
+    index, ply, entry, board before the move); positions are looked up by
+    binary search in the mapped file, and each is expanded once.
+    """
+    board = chess.Board()
+    expanded = {position_key(board)}
+    # (parent record index, ply, entry)
+    stack: List[Tuple[int, int, chess.polyglot.Entry]] = [
+        (-1, 0, entry) for entry in reversed(list(reader.find_all(board, minimum_weight=min_weight)))
+    ]
+    index = 0
+    while stack:
+        parent, ply, entry = stack.pop()
+        while len(board.move_stack) > ply:
+            board.pop()
+        yield parent, ply, entry, board
+
+        board.push(entry.move)
+        key = position_key(board)
+        if ply + 1 < max_plies and key not in expanded and len(expanded) < max_positions:
+            expanded.add(key)
+            replies = list(reader.find_all(board, minimum_weight=min_weight))
+            stack.extend((index, ply + 1, reply) for reply in reversed(replies))
+        index += 1
+
+def read_records(path: str, max_plies: int = BOOK_MAX_PLIES, max_positions: int = BOOK_MAX_POSITIONS,
+                 min_weight: int = BOOK_MIN_WEIGHT) -> List[MoveRecord]:
+    """Move records for the book's lines from the start position, weighted by the book."""
+    records: List[MoveRecord] = []
+    with chess.polyglot.open_reader(path) as reader:
+        for parent, _, entry, board in _walk(reader, max_plies, max_positions, min_weight):
+            san = board.san(entry.move)
+            board.push(entry.move)
+            records.append(MoveRecord(parent, san, position_key(board), (), None, entry.weight))
+            board.pop()
+    _log.info("Read %d book moves from %s.", len(records), path)
+    return records
+
+def book_to_pgn(path: str, max_plies: int = BOOK_LESSON_PLIES, branches: int = BOOK_LESSON_BRANCHES,
+                max_positions: int = BOOK_LESSON_POSITIONS) -> str:
+    """
+    A short PGN of the book for the lesson page: the heaviest move is the
+    mainline and the next `branches - 1` moves are variations. Past
+    `max_positions` branched positions, lines only follow their heaviest move.
+    """
+    game = chess.pgn.Game()
+    game.headers["Event"] = os.path.splitext(os.path.basename(path))[0].replace("_", " ").title()
+    seen = set()
+    with chess.polyglot.open_reader(path) as reader:
+        # Breadth first, so the branches near the start are the ones kept
+        queue: Deque[Tuple[chess.pgn.GameNode, int]] = deque([(game, 0)])
+        while queue:
+            node, ply = queue.popleft()
+            board = node.board()
+            key = position_key(board)
+            if ply >= max_plies or key in seen:
+                continue
+            seen.add(key)
+            entries: Dict[chess.Move, int] = {}
+            for entry in reader.find_all(board):
+                entries.setdefault(entry.move, entry.weight)
+            moves = sorted(entries, key=entries.get, reverse=True)
+            for move in moves[:branches if len(seen) <= max_positions else 1]:
+                queue.append((node.add_variation(move), ply + 1))
+    return str(game)
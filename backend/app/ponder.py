@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Optional
+
+import chess
+
+from . import engine_cache, engine_pool, metrics, scheduler, search_budget
+from .engine_cache import position_key
+
+_log = metrics.get_logger("ponder", sampled=True)
+
+# --- Configuration ---
+
+PONDER_ENABLED = os.environ.get("PONDER_ENABLED", "1") == "1"
+PONDER_MAX_SEARCHES = int(os.environ.get("PONDER_MAX_SEARCHES", "1")) # Games pondering at once, server-wide (per worker)
+PONDER_SESSION_SECONDS = float(os.environ.get("PONDER_SESSION_SECONDS", "30")) # Speculative engine time per game
+PONDER_DEADLINE_MS = float(os.environ.get("PONDER_DEADLINE_MS", "50")) # Wait for an engine slot before giving up
+PONDER_MAX_SESSIONS = 10000 # Games whose spent time is remembered
+
+class _PonderJob:
+    __slots__ = ("session_id", "cancelled", "done", "target_key")
+
+    def __init__(self, session_id: Hashable):
+        self.session_id = session_id
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.target_key: Optional[int] = None # Position the job is answering, once predicted
+
+class Ponderer:
+    """
+    Speculative engine searches during the trainee's turn.
+
+    After an engine reply, the game's position is searched from the
+    trainee's side to predict their move, then the position after that
+    move is searched with the game's budget and the reply goes into the
+    engine cache. When the real move arrives, a matching job is waited
+    for (its reply is then a cache hit) and any other is cancelled.
+
+    Each game ponders one turn at a time and at most `session_seconds`
+    in total; at most `max_searches` games ponder at once, and searches
+    go through the scheduler and yield to any game waiting for a slot.
+    """
+
+    def __init__(self, max_searches: int = PONDER_MAX_SEARCHES, session_seconds: float = PONDER_SESSION_SECONDS,
+                 deadline_ms: float = PONDER_DEADLINE_MS, enabled: bool = PONDER_ENABLED):
+        self.enabled = enabled
+        self.max_searches = max(1, max_searches)
+        self.session_seconds = session_seconds
+        self.deadline_ms = deadline_ms
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[Hashable, _PonderJob] = {}
+        self._active = 0
+        self._spent: "OrderedDict[Hashable, float]" = OrderedDict()
+
+        # Stats
+        self.started = 0
+        self.skipped = 0 # Global or per-game cap reached
+        self.hits = 0 # Real move was the predicted one
+        self.misses = 0
+        self.cancelled = 0
+
+    # --- Game hooks ---
+
+    def start(self, session_id: Hashable, board: chess.Board, level: Optional[str] = None):
+        """Starts pondering the trainee's turn in `board`, if the caps allow."""
+        pool = engine_pool.ENGINE_POOL
+        if not self.enabled or pool is None or session_id is None or board.is_game_over():
+            return
+        with self._lock:
+            self._cancel(session_id)
+            if self._active >= self.max_searches or self._spent.get(session_id, 0.0) >= self.session_seconds:
+                self.skipped += 1
+                return
+            job = _PonderJob(session_id)
+            self._jobs[session_id] = job
+            self._active += 1
+            self.started += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_searches, thread_name_prefix="ponder")
+            executor = self._executor
+        executor.submit(self._run, pool, job, board.copy(stack=False), level)
+
+    def resolve(self, session_id: Hashable, board: chess.Board, timeout: float):
+        """
+        Called when the trainee has moved and the engine must reply in `board`.
+        Waits (up to `timeout`) for a job that predicted this position, so the
+        reply comes from the cache; cancels a job that predicted something else.
+        """
+        with self._lock:
+            job = self._jobs.pop(session_id, None)
+        if job is None:
+            return
+        if job.target_key == position_key(board) and not job.cancelled.is_set():
+            with self._lock:
+                self.hits += 1
+            job.done.wait(timeout)
+            return
+        job.cancelled.set()
+        with self._lock:
+            self.misses += 1
+
+    def cancel(self, session_id: Hashable):
+        with self._lock:
+            self._cancel(session_id)
+
+    def _cancel(self, session_id: Hashable):
+        """Caller holds the lock."""
+        job = self._jobs.pop(session_id, None)
+        if job is not None and not job.done.is_set():
+            job.cancelled.set()
+            self.cancelled += 1
+
+    # --- Searching ---
+
+    def _run(self, pool: engine_pool.EnginePool, job: _PonderJob, board: chess.Board, level: Optional[str]):
+        started = time.perf_counter()
+        try:
+            budget = search_budget.budget_for(level)
+            limit = budget.limit()
+
+            # 1. The trainee's most likely move: the engine's choice for their side
+            predicted = self._search(pool, job, board, budget)
+            if predicted is None:
+                return
+            board.push(predicted)
+            if board.is_game_over():
+                return
+            job.target_key = position_key(board)
+
+            # 2. The reply to it, stored where the game's own search would look
+            if engine_cache.ENGINE_CACHE.contains(board, limit):
+                return
+            reply = self._search(pool, job, board, budget)
+            if reply is not None:
+                engine_cache.ENGINE_CACHE.put(board, limit, reply)
+                _log.debug("Session %s: pondered %s", job.session_id, board.peek().uci())
+        except Exception as e:
+            _log.warning("Ponder failed for session %s: %s", job.session_id, e)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._spent[job.session_id] = self._spent.get(job.session_id, 0.0) + time.perf_counter() - started
+                self._spent.move_to_end(job.session_id)
+                while len(self._spent) > PONDER_MAX_SESSIONS:
+                    self._spent.popitem(last=False)
+                if self._jobs.get(job.session_id) is job and (job.cancelled.is_set() or job.target_key is None):
+                    del self._jobs[job.session_id] # Nothing to hand over
+                elif len(self._jobs) > PONDER_MAX_SESSIONS:
+                    # Finished jobs of games that never came back
+                    for session_id in [sid for sid, j in self._jobs.items() if j.done.is_set()]:
+                        del self._jobs[session_id]
+            job.done.set()
+
+    def _search(self, pool: engine_pool.EnginePool, job: _PonderJob, board: chess.Board,
+                budget: search_budget.SearchBudget) -> Optional[chess.Move]:
+        if job.cancelled.is_set():
+            return None
+        decisive = search_budget.stop_condition(budget.movetime)
+
+        def stop_when(info) -> bool:
+            # Give the slot back as soon as the real move or another game's request arrives
+            if job.cancelled.is_set() or scheduler.ENGINE_SCHEDULER.queue_depth > 0:
+                job.cancelled.set()
+                return True
+            return decisive is not None and decisive(info)
+
+        def search(movetime: float) -> Optional[chess.Move]:
+            if movetime < budget.movetime:
+                return None # Shrunk under load; not worth a slot
+            return pool.play(board, budget.limit(), game=job.session_id, stop_when=stop_when).move
+
+        # The scheduler's deadline covers the search too; only the wait for a slot is kept short
+        deadline_ms = budget.movetime * 1000 + self.deadline_ms
+        move = scheduler.ENGINE_SCHEDULER.run(("ponder", job.session_id), search, budget.movetime, deadline_ms)
+        return None if job.cancelled.is_set() else move
+
+    def stats(self) -> Dict:
+        with self._lock:
+            resolved = self.hits + self.misses
+            return {
+                "active": self._active,
+                "started": self.started,
+                "skipped": self.skipped,
+                "cancelled": self.cancelled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / resolved, 4) if resolved else 0.0,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for session_id in list(self._jobs):
+                self._cancel(session_id)
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# --- Global Ponderer ---
+
+PONDERER = Ponderer()
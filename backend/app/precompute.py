@@ -0,0 +1,253 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import chess
+
+from . import catalog, chess_logic, engine_cache, engine_pool, metrics, scheduler, search_budget
+from .engine_cache import position_key
+
+_log = metrics.get_logger("precompute")
+
+# --- Configuration ---
+
+PRECOMPUTE_ENABLED = os.environ.get("PRECOMPUTE_ENABLED", "1") == "1"
+PRECOMPUTE_WORKERS = int(os.environ.get("PRECOMPUTE_WORKERS", "1")) # Engine searches the job runs at once
+PRECOMPUTE_MAX_POSITIONS = int(os.environ.get("PRECOMPUTE_MAX_POSITIONS", "5000")) # Exit positions per tree version
+# Levels whose replies are stored; games at other levels search as before
+PRECOMPUTE_LEVELS = [level for level in os.environ.get("PRECOMPUTE_LEVELS", search_budget.ENGINE_LEVEL).split(",") if level]
+PRECOMPUTE_IDLE_WAIT = float(os.environ.get("PRECOMPUTE_IDLE_WAIT", "0.05")) # seconds between checks while games are queued
+
+PRECOMPUTE_SESSION = "precompute" # Scheduler queue of the job; round-robin keeps it to one share
+
+# --- Exit Positions ---
+
+def exit_positions(tree, colors: Optional[Dict[int, str]] = None,
+                   max_positions: int = PRECOMPUTE_MAX_POSITIONS) -> Iterator[chess.Board]:
+    """
+    Positions where a game leaves the repertoire and the engine has to answer:
+    leaves where the bot is to move, and every legal move the trainee could
+    play instead of the repertoire move. `colors` maps opening IDs to the
+    color the trainee plays (white if missing). Shallow positions come first,
+    since every game passes through them; each position is yielded once.
+    """
+    black_mask = chess_logic.ids_to_mask(oid for oid, color in (colors or {}).items() if color == "black")
+    seen = set()
+    # (node, board at the node), breadth first
+    queue: Deque[Tuple[object, chess.Board]] = deque([(tree.root, chess.Board())])
+    expanded = {tree.root.key}
+    while queue and len(seen) < max_positions:
+        node, board = queue.popleft()
+        mask = node.opening_mask
+        white_lines, black_lines = mask & ~black_mask, mask & black_mask
+        trainee_to_move = white_lines if board.turn == chess.WHITE else black_lines
+        bot_to_move = black_lines if board.turn == chess.WHITE else white_lines
+
+        children = list(node.iter_children())
+        if not children and bot_to_move and position_key(board) not in seen:
+            seen.add(position_key(board))
+            yield board
+
+        if trainee_to_move:
+            known = {san for san, _ in children}
+            for move in board.legal_moves:
+                if board.san(move) in known:
+                    continue
+                after = board.copy(stack=False)
+                after.push(move)
+                key = position_key(after)
+                if key in seen or after.is_game_over():
+                    continue
+                seen.add(key)
+                yield after
+                if len(seen) >= max_positions:
+                    return
+
+        for san, child in children:
+            if child.key not in expanded:
+                expanded.add(child.key)
+                after = board.copy(stack=False)
+                after.push_san(san)
+                queue.append((child, after))
+
+# --- Background Job ---
+
+class Precomputer:
+    """
+    Searches the theory exit positions of the published tree in the
+    background and stores the replies in the engine cache, so the first
+    engine move after theory is a cache hit.
+
+    A run starts whenever a tree is published; a newer tree cancels the run
+    in progress. Searches go through the engine scheduler under their own
+    queue and only start while no game is waiting for an engine slot.
+    """
+
+    def __init__(self, workers: int = PRECOMPUTE_WORKERS, max_positions: int = PRECOMPUTE_MAX_POSITIONS,
+                 levels: Optional[List[str]] = None, idle_wait: float = PRECOMPUTE_IDLE_WAIT):
+        self.workers = max(1, workers)
+        self.max_positions = max_positions
+        self.levels = levels if levels is not None else PRECOMPUTE_LEVELS
+        self.idle_wait = idle_wait
+
+        self._lock = threading.Lock()
+        self._pending = None # Tree waiting for a run
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Stats
+        self.runs = 0
+        self.positions = 0
+        self.searched = 0
+        self.cached = 0 # Already stored by an earlier run or another worker
+        self.skipped = 0 # Shed or shrunk by the scheduler
+        self.running = False
+        self.last_run_sec = 0.0
+
+    def start(self):
+        """Precomputes the current tree now and every tree published from here on."""
+        chess_logic.add_tree_listener(self.schedule)
+        self.schedule(chess_logic.GLOBAL_OPENING_TREE)
+
+    def schedule(self, tree):
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._pending = tree
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="engine-precompute", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        """Waits until no run is pending or in progress (for tests and benchmarks)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._pending is None and not self.running:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            with self._lock:
+                self._wake.clear()
+                tree, self._pending = self._pending, None
+                self.running = tree is not None
+            if tree is None:
+                continue
+            try:
+                self.run(tree)
+            except Exception as e:
+                _log.error("Precompute run failed: %s", e)
+            finally:
+                with self._lock:
+                    self.running = False
+
+    def _superseded(self) -> bool:
+        return self._stop.is_set() or self._pending is not None
+
+    def run(self, tree):
+        pool = engine_pool.get_engine_pool()
+        if pool is None:
+            _log.info("No engine available; skipping precompute.")
+            return
+        try:
+            colors = catalog.OPENING_CATALOG.colors()
+        except Exception as e:
+            _log.warning("Opening colors unavailable, assuming white: %s", e)
+            colors = {}
+
+        started = time.perf_counter()
+        budgets = [search_budget.budget_for(level) for level in self.levels]
+        counts = {"positions": 0, "searched": 0}
+
+        def analyse(board: chess.Board):
+            for budget in budgets:
+                if self._superseded():
+                    return
+                self._analyse(pool, board, budget, counts)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="precompute") as executor:
+            in_flight: Deque = deque()
+            for board in exit_positions(tree, colors, self.max_positions):
+                if self._superseded():
+                    break
+                counts["positions"] += 1
+                in_flight.append(executor.submit(analyse, board))
+                # Enumerate only as far ahead as the workers can use
+                while len(in_flight) > self.workers * 2:
+                    in_flight.popleft().result()
+            for future in in_flight:
+                future.result()
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.runs += 1
+            self.positions += counts["positions"]
+            self.last_run_sec = elapsed
+        _log.info("Precomputed %d exit positions (%d searched) in %.1fs.",
+                  counts["positions"], counts["searched"], elapsed)
+
+    def _analyse(self, pool: engine_pool.EnginePool, board: chess.Board,
+                 budget: search_budget.SearchBudget, counts: Dict[str, int]):
+        limit = budget.limit()
+        if board.legal_moves.count() == 1 or engine_cache.ENGINE_CACHE.contains(board, limit): # Forced moves need no search
+            with self._lock:
+                self.cached += 1
+            return
+
+        # Live games first: start only once nobody is waiting for the engine
+        while scheduler.ENGINE_SCHEDULER.queue_depth > 0:
+            if self._superseded():
+                return
+            time.sleep(self.idle_wait)
+
+        def search(movetime: float) -> bool:
+            if movetime < budget.movetime:
+                return False # Shrunk under load; weaker than what games would cache
+            result = pool.play(board, limit, game=PRECOMPUTE_SESSION,
+                               stop_when=search_budget.stop_condition(budget.movetime))
+            if not result.move:
+                return False
+            engine_cache.ENGINE_CACHE.put(board, limit, result.move)
+            return True
+
+        done = scheduler.ENGINE_SCHEDULER.run(PRECOMPUTE_SESSION, search, budget.movetime)
+        with self._lock:
+            if done:
+                self.searched += 1
+                counts["searched"] += 1
+            else:
+                self.skipped += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "runs": self.runs,
+                "positions": self.positions,
+                "searched": self.searched,
+                "cached": self.cached,
+                "skipped": self.skipped,
+                "last_run_sec": round(self.last_run_sec, 3),
+            }
+
+    def shutdown(self):
+        chess_logic.remove_tree_listener(self.schedule)
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+# --- Global Job ---
+
+PRECOMPUTER = Precomputer()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from app import database, models, chess_logic
+from app import database, models, chess_logic, engine_cache, engine_pool, scheduler, session_store, tree_loader
 
 router = APIRouter()
 
@@ -17,6 +17,7 @@ def debug_play_black(db: Session = Depends(database.get_db)):
     logs.append(f"Learned IDs: {learned_ids}")
     
     # Create Session
+    tree_loader.TREE_LOADER.ensure(learned_ids)
     session = chess_logic.GameSession(999, learned_ids, "black", opening_colors)
     
     logs.append(f"Session Color: {session.user_color}")
@@ -27,3 +28,18 @@ def debug_play_black(db: Session = Depends(database.get_db)):
     logs.append(f"Board FEN: {session.board.fen()}")
     
     return logs
+
+@router.get("/debug/engine")
+def debug_engine():
+    pool = engine_pool.get_engine_pool()
+    stats = {
+        "scheduler": scheduler.ENGINE_SCHEDULER.stats(),
+        "cache": engine_cache.ENGINE_CACHE.stats(),
+    }
+    if pool is None:
+        return {"running": False, "workers": [], **stats}
+    return {"running": True, "workers": pool.health_check(), **stats}
+
+@router.get("/debug/sessions")
+def debug_sessions():
+    return session_store.SESSION_STORE.stats()
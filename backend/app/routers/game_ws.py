@@ -0,0 +1,149 @@
+import asyncio
+import json
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from app import chess_logic, session_store
+
+router = APIRouter()
+
+# --- Protocol ---
+#
+# One socket per game. The server sends the full state once, then only deltas:
+#   -> {"t": "state", "fen": ..., "ply": n, "theory": b, "engine": b, "ids": [...]}
+#   <- {"t": "move", "san": "e4"}
+#   -> {"t": "ack", "ply": n, "ok": true, "uci": "e2e4", "theory": b, "mistake": b}
+#   -> {"t": "bot", "ply": n, "san": "e5", "uci": "e7e5", "theory": b, "engine": b,
+#       "drop": [ids no longer possible], "msg": "...", "over": b}
+# A rejected move is acknowledged with {"t": "ack", "ok": false, "msg": ...}. A move sent
+# after the game moved on elsewhere (over HTTP, or another socket) is rejected the same
+# way and followed by a fresh "state".
+# Keys with default values (false, empty lists) are left out.
+
+def _compact(payload: Dict) -> Dict:
+    return {k: v for k, v in payload.items() if v not in (False, None, [])}
+
+def _candidate_ids(game: chess_logic.GameSession) -> List[int]:
+    if game.current_node is None:
+        return []
+    return chess_logic.mask_to_ids(game.current_node.opening_mask & game.learned_mask)
+
+class GameChannel:
+    """
+    Per-connection state: the ply and the candidate IDs the client already
+    knows about. The game itself is loaded from the session store for every
+    move, like the HTTP API does, so moves played over HTTP or on another
+    worker are seen and never overwritten.
+    """
+
+    def __init__(self, websocket: WebSocket, game: chess_logic.GameSession):
+        self.websocket = websocket
+        self.session_id = game.session_id
+        self.ply = game.board.ply()
+        self.known_ids = set(_candidate_ids(game))
+        self.reply_task: Optional[asyncio.Task] = None
+
+    async def send_state(self, game: chess_logic.GameSession):
+        self.ply = game.board.ply()
+        self.known_ids = set(_candidate_ids(game))
+        await self.websocket.send_json({
+            "t": "state", "fen": game.board.fen(), "ply": self.ply,
+            "theory": game.in_theory, "engine": game.engine_mode, "ids": sorted(self.known_ids),
+        })
+
+    async def load(self) -> Optional[chess_logic.GameSession]:
+        return await session_store.SESSION_STORE.get_async(self.session_id)
+
+    async def refresh(self):
+        game = await self.load()
+        if game is None:
+            await self.websocket.close(code=4404, reason="Active game session not found.")
+            return
+        await self.send_state(game)
+
+    async def resync(self):
+        """The game moved on elsewhere: reject the move and send the current state."""
+        await self.websocket.send_json({"t": "ack", "ok": False, "msg": "The game changed elsewhere."})
+        await self.refresh()
+
+    async def on_move(self, san: str):
+        if self.reply_task is not None and not self.reply_task.done():
+            await self.websocket.send_json({"t": "ack", "ok": False, "msg": "Wait for the bot's reply."})
+            return
+
+        game = await self.load()
+        if game is None or game.board.ply() != self.ply:
+            await self.resync()
+            return
+
+        result = game.apply_user_move(san)
+        if not result["legal"]:
+            await self.websocket.send_json({"t": "ack", "ok": False, "msg": result["message"]})
+            return
+
+        await self.websocket.send_json(_compact({
+            "t": "ack", "ply": game.board.ply(), "ok": True, "uci": result["uci"],
+            "theory": result["in_theory"], "mistake": result["mistake_made"],
+        }))
+
+        if game.has_book_reply:
+            # Theory replies are a dict lookup; answer straight away
+            await self.send_reply(game, game.play_bot_reply(result["mistake_made"]))
+        else:
+            self.reply_task = asyncio.create_task(self.engine_reply(game, result["mistake_made"]))
+
+    async def engine_reply(self, game: chess_logic.GameSession, mistake_made: bool):
+        reply = await run_in_threadpool(game.play_bot_reply, mistake_made)
+        await self.send_reply(game, reply)
+
+    async def send_reply(self, game: chess_logic.GameSession, reply: Dict):
+        # Saved only if nobody played in the game since it was loaded for this move
+        if not await session_store.SESSION_STORE.put_async(game, expected_ply=self.ply):
+            await self.resync()
+            return
+        self.ply = game.board.ply()
+
+        ids = set(reply["candidate_opening_ids"])
+        dropped = sorted(self.known_ids - ids)
+        self.known_ids = ids
+
+        san = reply["bot_move"]
+        uci = game.board.peek().uci() if san else None
+        await self.websocket.send_json(_compact({
+            "t": "bot", "ply": self.ply, "san": san, "uci": uci,
+            "theory": reply["in_theory"], "engine": reply["engine_mode"],
+            "drop": dropped, "msg": reply["message"], "over": game.board.is_game_over(),
+        }))
+
+@router.websocket("/game/ws/{session_id}")
+async def game_channel(websocket: WebSocket, session_id: int):
+    game = await session_store.SESSION_STORE.get_async(session_id)
+    if game is None:
+        await websocket.close(code=4404, reason="Active game session not found.")
+        return
+
+    await websocket.accept()
+    channel = GameChannel(websocket, game)
+    await channel.send_state(game)
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                message = {}
+            if not isinstance(message, dict):
+                message = {}
+            if message.get("t") == "move" and isinstance(message.get("san"), str):
+                await channel.on_move(message["san"])
+            elif message.get("t") == "state":
+                await channel.refresh()
+            else:
+                await websocket.send_json({"t": "error", "msg": "Unknown message."})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if channel.reply_task is not None and not channel.reply_task.done():
+            # Let the search finish so the game state is saved; the push to the closed socket just fails
+            await asyncio.shield(asyncio.gather(channel.reply_task, return_exceptions=True))
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Response
+from fastapi.responses import JSONResponse
+
+from app import catalog, engine_cache, metrics, ponder, precompute, scheduler, session_store, tree_loader
+
+router = APIRouter()
+
+# Component stats are read at scrape time; nothing extra runs on the request path
+metrics.METRICS.register_collector("chess_engine_scheduler", scheduler.ENGINE_SCHEDULER.stats)
+metrics.METRICS.register_collector("chess_engine_cache", engine_cache.ENGINE_CACHE.stats)
+metrics.METRICS.register_collector("chess_sessions", session_store.SESSION_STORE.stats)
+metrics.METRICS.register_collector("chess_catalog", catalog.OPENING_CATALOG.stats)
+metrics.METRICS.register_collector("chess_precompute", precompute.PRECOMPUTER.stats)
+metrics.METRICS.register_collector("chess_ponder", ponder.PONDERER.stats)
+metrics.METRICS.register_collector("chess_tree_loader", tree_loader.TREE_LOADER.stats)
+
+@router.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- Health ---
+#
+# Both report the opening tree warm-up. Ready (200) as soon as requests can
+# be served, which may still wait for their openings; live fails only if the
+# warm-up did, so a restart can retry it.
+
+@router.get("/health/live")
+def liveness():
+    stats = tree_loader.TREE_LOADER.stats()
+    return JSONResponse(stats, status_code=503 if stats["stage"] == "failed" else 200)
+
+@router.get("/health/ready")
+def readiness():
+    return JSONResponse(tree_loader.TREE_LOADER.stats(), status_code=200 if tree_loader.TREE_LOADER.ready else 503)
@@ -0,0 +1,64 @@
+from typing import Optional
+
+import chess
+from fastapi import APIRouter, HTTPException
+
+from app import catalog, chess_logic, schemas, tree_loader
+
+router = APIRouter()
+
+# The position index is the tree's own `nodes_by_hash` (Zobrist key -> node):
+# a dict for in-memory trees and a binary search over the mapped keys for
+# snapshots. Both are kept current by every tree version, so nothing here
+# is rebuilt on import.
+
+@router.get("/positions", response_model=schemas.PositionLookup)
+def lookup_position(fen: Optional[str] = None, moves: Optional[str] = None, user_id: Optional[int] = None):
+    """
+    Which openings reach a position, the repertoire moves from it and how to
+    resume a drill there. Give either a FEN or moves from the start position
+    (SAN or UCI, separated by spaces or commas).
+    """
+    if (fen is None) == (moves is None):
+        raise HTTPException(status_code=400, detail="Give either fen or moves.")
+    try:
+        move_list = moves.replace(",", " ").split() if moves is not None else None
+        board = chess_logic.board_from_moves(move_list) if move_list is not None else chess.Board(fen)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid position: {e}")
+
+    # Any opening may reach the position, so this waits for the whole warm-up
+    if not tree_loader.TREE_LOADER.wait(tree_loader.TREE_LOAD_TIMEOUT):
+        raise HTTPException(status_code=503, detail="Openings are still loading, try again shortly.")
+    node = chess_logic.GLOBAL_OPENING_TREE.get_node(board)
+    if node is None:
+        return schemas.PositionLookup(fen=board.fen(), in_repertoire=False)
+
+    learned = catalog.OPENING_CATALOG.learned_ids(user_id) if user_id is not None else frozenset()
+    openings = []
+    for opening_id in chess_logic.mask_to_ids(node.opening_mask):
+        entry = catalog.OPENING_CATALOG.get(opening_id)
+        if entry is not None:
+            openings.append(schemas.PositionOpening(id=entry.id, name=entry.name, color=entry.color, is_learned=entry.id in learned))
+
+    next_moves = sorted((
+        schemas.PositionMove(san=san, uci=board.parse_san(san).uci(), weight=child.weight,
+                             opening_ids=chess_logic.mask_to_ids(child.opening_mask))
+        for san, child in node.iter_children()
+    ), key=lambda m: -m.weight)
+
+    line = node.line
+    resume = None
+    if openings:
+        # Drill as the side of a learned opening if there is one
+        color = next((o.color for o in openings if o.is_learned), openings[0].color)
+        resume = schemas.PositionResume(
+            color=color,
+            moves=move_list if move_list is not None else line,
+            trainee_to_move=board.turn == (chess.BLACK if color == "black" else chess.WHITE),
+        )
+
+    return schemas.PositionLookup(
+        fen=board.fen(), in_repertoire=True, ply=len(line), line=line,
+        openings=openings, next_moves=next_moves, resume=resume,
+    )
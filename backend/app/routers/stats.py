@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import Integer, cast, func
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import List
+
+from app import database, models, schemas, chess_logic, event_log
+from app.engine_cache import unsigned_key
+
+router = APIRouter()
+
+# All aggregation runs in SQL (GROUP BY over the move_events columns);
+# Python only reshapes the grouped rows.
+
+E = models.MoveEvent
+_mistakes = func.sum(cast(E.mistake, Integer))
+_theory_moves = func.sum(cast(E.in_theory, Integer))
+
+@router.get("/stats/mistakes", response_model=List[schemas.OpeningMistakeHeatmap])
+def mistake_heatmap(user_id: int = 1, db: Session = Depends(database.get_db)):
+    """Per-opening, per-ply attempts and mistakes while the user was in theory."""
+    event_log.EVENT_LOG.flush()
+    rows = (
+        db.query(E.opening_id, models.Opening.name, E.ply, func.count(E.id), _mistakes)
+        .outerjoin(models.Opening, models.Opening.id == E.opening_id)
+        .filter(E.user_id == user_id, E.opening_id.isnot(None))
+        .group_by(E.opening_id, E.ply)
+        .order_by(E.opening_id, E.ply)
+        .all()
+    )
+
+    heatmap = {}
+    for opening_id, name, ply, attempts, mistakes in rows:
+        entry = heatmap.setdefault(opening_id, schemas.OpeningMistakeHeatmap(opening_id=opening_id, name=name, plies=[]))
+        entry.plies.append(schemas.PlyStats(ply=ply, attempts=attempts, mistakes=mistakes, mistake_rate=round(mistakes / attempts, 4)))
+    return list(heatmap.values())
+
+@router.get("/stats/hardest_positions", response_model=List[schemas.HardPosition])
+def hardest_positions(user_id: int = 1, limit: int = 10, min_attempts: int = 3, db: Session = Depends(database.get_db)):
+    """Repertoire positions with the highest mistake rate."""
+    event_log.EVENT_LOG.flush()
+    attempts = func.count(E.id)
+    rows = (
+        db.query(E.position_hash, func.min(E.opening_id), attempts, _mistakes)
+        .filter(E.user_id == user_id, E.opening_id.isnot(None))
+        .group_by(E.position_hash)
+        .having(attempts >= min_attempts)
+        .order_by((_mistakes * 1.0 / attempts).desc(), attempts.desc())
+        .limit(limit)
+        .all()
+    )
+
+    result = []
+    for position_hash, opening_id, count, mistakes in rows:
+        node = chess_logic.GLOBAL_OPENING_TREE.nodes_by_hash.get(unsigned_key(position_hash))
+        result.append(schemas.HardPosition(
+            fen=node.fen if node else None,
+            opening_id=opening_id,
+            expected_moves=list(node.moves) if node else [],
+            attempts=count,
+            mistakes=mistakes,
+            mistake_rate=round(mistakes / count, 4),
+        ))
+    return result
+
+@router.get("/stats/accuracy", response_model=List[schemas.AccuracyPoint])
+def accuracy_over_time(user_id: int = 1, days: int = 30, db: Session = Depends(database.get_db)):
+    """Daily share of theory moves played correctly."""
+    event_log.EVENT_LOG.flush()
+    day = func.date(E.created_at)
+    rows = (
+        db.query(day, _theory_moves, _mistakes)
+        .filter(E.user_id == user_id, E.created_at >= datetime.utcnow() - timedelta(days=days))
+        .group_by(day)
+        .order_by(day)
+        .all()
+    )
+
+    result = []
+    for d, theory_moves, mistakes in rows:
+        tested = theory_moves + mistakes
+        result.append(schemas.AccuracyPoint(
+            day=str(d), theory_moves=theory_moves, mistakes=mistakes,
+            accuracy=round(theory_moves / tested, 4) if tested else 1.0,
+        ))
+    return result
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Optional, TypeVar
+
+from . import engine_pool
+
+# --- Configuration ---
+
+ENGINE_MAX_CONCURRENCY = int(os.environ.get("ENGINE_MAX_CONCURRENCY", str(engine_pool.ENGINE_POOL_SIZE))) # Never more than the pool has engines
+ENGINE_DEADLINE_MS = float(os.environ.get("ENGINE_DEADLINE_MS", "2000")) # Latency budget per engine request
+ENGINE_SHRINK_DEPTH = int(os.environ.get("ENGINE_SHRINK_DEPTH", str(ENGINE_MAX_CONCURRENCY))) # Queue depth where budgets start shrinking
+ENGINE_MAX_QUEUE_DEPTH = int(os.environ.get("ENGINE_MAX_QUEUE_DEPTH", str(ENGINE_MAX_CONCURRENCY * 8))) # Beyond this, requests are shed
+ENGINE_MIN_MOVETIME = float(os.environ.get("ENGINE_MIN_MOVETIME", "0.05")) # seconds
+
+T = TypeVar("T")
+
+class _Ticket:
+    __slots__ = ("session_key", "enqueued_at", "granted")
+
+    def __init__(self, session_key: Hashable):
+        self.session_key = session_key
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+class EngineScheduler:
+    """
+    Admission control for engine searches.
+
+    At most `max_concurrency` searches run at once. Waiting requests are queued
+    per session and slots are handed out round-robin across sessions, so a
+    burst from one game can't starve the others. Every request has a deadline:
+    under load the search budget shrinks, and a request that can't get a slot
+    in time is shed (the caller falls back to a random legal move).
+
+    With `pool_size`, slots are also capped at the running engine pool's
+    size: a search admitted beyond it would only queue again for an engine,
+    outside the deadlines and budgets managed here.
+    """
+
+    def __init__(self, max_concurrency: int = ENGINE_MAX_CONCURRENCY,
+                 shrink_depth: int = ENGINE_SHRINK_DEPTH,
+                 max_queue_depth: int = ENGINE_MAX_QUEUE_DEPTH,
+                 min_movetime: float = ENGINE_MIN_MOVETIME,
+                 pool_size: Optional[Callable[[], Optional[int]]] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.pool_size = pool_size
+        self.shrink_depth = max(1, shrink_depth)
+        self.max_queue_depth = max_queue_depth
+        self.min_movetime = min_movetime
+
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[Hashable, Deque[_Ticket]]" = OrderedDict()
+        self._queue_depth = 0
+        self._running = 0
+
+        # Stats
+        self.requests = 0
+        self.completed = 0
+        self.shed = 0
+        self.shrunk = 0
+        self.max_wait_ms = 0.0
+        self._wait_total_ms = 0.0
+        self._wait_count = 0
+        self._recent_waits: Deque[float] = deque(maxlen=1000)
+
+    # --- Queueing ---
+
+    @property
+    def concurrency(self) -> int:
+        """Searches allowed at once: max_concurrency, or fewer if the engine pool is smaller."""
+        size = self.pool_size() if self.pool_size is not None else None
+        return min(self.max_concurrency, size) if size else self.max_concurrency
+
+    def _grant_next(self):
+        """Hands free slots to waiting tickets, one session at a time. Caller holds the lock."""
+        granted = False
+        slots = self.concurrency
+        while self._running < slots and self._queues:
+            session_key, tickets = next(iter(self._queues.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self._queues.move_to_end(session_key)
+            else:
+                del self._queues[session_key]
+            self._queue_depth -= 1
+            self._running += 1
+            ticket.granted = True
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, ticket: _Ticket):
+        tickets = self._queues.get(ticket.session_key)
+        if tickets is None:
+            return
+        tickets.remove(ticket)
+        self._queue_depth -= 1
+        if not tickets:
+            del self._queues[ticket.session_key]
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._grant_next()
+
+    def _record_wait(self, wait_ms: float):
+        self._wait_total_ms += wait_ms
+        self._wait_count += 1
+        self._recent_waits.append(wait_ms)
+        if wait_ms > self.max_wait_ms:
+            self.max_wait_ms = wait_ms
+
+    # --- Public API ---
+
+    def run(self, session_key: Hashable, search: Callable[[float], T], movetime: float,
+            deadline_ms: float = ENGINE_DEADLINE_MS) -> Optional[T]:
+        """
+        Runs `search(budget_seconds)` once a slot is free.
+        Returns None if the request was shed instead.
+        """
+        deadline = time.monotonic() + deadline_ms / 1000.0
+        ticket = _Ticket(session_key)
+
+        with self._cond:
+            self.requests += 1
+            if self._queue_depth >= self.max_queue_depth:
+                self.shed += 1
+                return None
+
+            self._queues.setdefault(session_key, deque()).append(ticket)
+            self._queue_depth += 1
+            self._grant_next()
+
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self.shed += 1
+                    self._record_wait((time.monotonic() - ticket.enqueued_at) * 1000)
+                    return None
+                self._cond.wait(remaining)
+
+            self._record_wait((time.monotonic() - ticket.enqueued_at) * 1000)
+            budget = self._budget(movetime, deadline)
+            if budget is None:
+                self.shed += 1
+                self._running -= 1
+                self._grant_next()
+                return None
+
+        try:
+            return search(budget)
+        finally:
+            with self._cond:
+                self.completed += 1
+            self._release()
+
+    def _budget(self, movetime: float, deadline: float) -> Optional[float]:
+        """Shrinks the search time when the queue is deep or the deadline is close. Caller holds the lock."""
+        floor = min(movetime, self.min_movetime)
+        budget = movetime
+        if self._queue_depth >= self.shrink_depth:
+            # Load alone never shrinks a search below the minimum; short budgets would all be shed
+            budget = max(floor, movetime * self.shrink_depth / (self._queue_depth + 1))
+        budget = min(budget, deadline - time.monotonic())
+        if budget < floor:
+            # Not even a minimal search fits; let the caller use its cheap fallback.
+            return None
+        if budget < movetime:
+            self.shrunk += 1
+        return budget
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for a slot (read without the lock; may be slightly stale)."""
+        return self._queue_depth
+
+    def stats(self) -> Dict:
+        with self._cond:
+            waits = sorted(self._recent_waits)
+            return {
+                "max_concurrency": self.concurrency,
+                "running": self._running,
+                "queue_depth": self._queue_depth,
+                "queued_sessions": len(self._queues),
+                "requests": self.requests,
+                "completed": self.completed,
+                "shed": self.shed,
+                "shrunk": self.shrunk,
+                "avg_wait_ms": round(self._wait_total_ms / self._wait_count, 3) if self._wait_count else 0.0,
+                "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+# --- Global Scheduler ---
+
+def _engine_pool_size() -> Optional[int]:
+    pool = engine_pool.ENGINE_POOL
+    return pool.size if pool is not None else None
+
+ENGINE_SCHEDULER = EngineScheduler(pool_size=_engine_pool_size)
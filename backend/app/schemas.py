@@ -4,6 +4,8 @@ from typing import Optional, List
 class GameStartRequest(BaseModel):
     user_id: int
     color: str = "white" # 'white' or 'black'
+    engine_level: Optional[str] = None # 'beginner', 'club', 'advanced' or 'master'; server default if omitted
+    moves: Optional[List[str]] = None # SAN/UCI moves from the start position, to resume a drill there
 
 class GameStartResponse(BaseModel):
     session_id: int
@@ -32,3 +34,69 @@ class OpeningCreate(BaseModel):
 class UserCreate(BaseModel):
     name: str
     email: str
+
+class PlyStats(BaseModel):
+    ply: int
+    attempts: int
+    mistakes: int
+    mistake_rate: float
+
+class OpeningMistakeHeatmap(BaseModel):
+    opening_id: int
+    name: Optional[str] = None
+    plies: List[PlyStats]
+
+class HardPosition(BaseModel):
+    fen: Optional[str] = None # None if the position is no longer in the repertoire
+    opening_id: Optional[int] = None
+    expected_moves: List[str] = []
+    attempts: int
+    mistakes: int
+    mistake_rate: float
+
+class AccuracyPoint(BaseModel):
+    day: str
+    theory_moves: int
+    mistakes: int
+    accuracy: float
+
+class ImportJobStatus(BaseModel):
+    job_id: str
+    opening_id: Optional[int] = None
+    filename: Optional[str] = None
+    status: str # 'queued', 'running', 'done' or 'failed'
+    progress: float # Fraction of the file read
+    bytes_read: int
+    bytes_total: int
+    games: int
+    errors: int
+    positions: int
+    games_per_sec: float
+    elapsed_sec: float
+    message: Optional[str] = None
+
+class PositionOpening(BaseModel):
+    id: int
+    name: str
+    color: str
+    is_learned: bool
+
+class PositionMove(BaseModel):
+    san: str
+    uci: str
+    weight: int # Repertoire lines through the move
+    opening_ids: List[int]
+
+class PositionResume(BaseModel):
+    color: str # Side the trainee plays to drill this position
+    moves: List[str] # Pass as GameStartRequest.moves
+    trainee_to_move: bool
+
+class PositionLookup(BaseModel):
+    fen: str
+    in_repertoire: bool
+    ply: Optional[int] = None # Plies from the start along the repertoire line (None if not in it)
+    line: List[str] = [] # A repertoire line reaching the position (SAN)
+    openings: List[PositionOpening] = []
+    next_moves: List[PositionMove] = []
+    resume: Optional[PositionResume] = None
@@ -0,0 +1,89 @@
+import os
+from typing import Callable, Dict, NamedTuple, Optional
+
+import chess
+import chess.engine
+
+from . import metrics
+
+# --- Configuration ---
+
+ENGINE_LEVEL = os.environ.get("ENGINE_LEVEL", "club") # Default difficulty for new games
+ENGINE_DECISIVE_CP = int(os.environ.get("ENGINE_DECISIVE_CP", "600")) # Eval that ends a search early
+ENGINE_EARLY_STOP_DEPTH = int(os.environ.get("ENGINE_EARLY_STOP_DEPTH", "6")) # Shallower evals are not trusted
+# Watching a search's info lines costs a few thread hops per line; only worth it for long searches
+ENGINE_EARLY_STOP_MIN_TIME = float(os.environ.get("ENGINE_EARLY_STOP_MIN_TIME", "0.2")) # seconds
+
+class SearchBudget(NamedTuple):
+    """
+    Search limits for one engine reply. The engine stops at whichever limit
+    it reaches first; `movetime` is always set, so the scheduler can shrink
+    every budget the same way.
+    """
+    movetime: float # seconds
+    depth: Optional[int] = None
+    nodes: Optional[int] = None
+
+    def limit(self, scale: float = 1.0) -> chess.engine.Limit:
+        """The UCI limit, with time and nodes scaled down when the scheduler shrinks the budget."""
+        if scale >= 1.0:
+            return chess.engine.Limit(time=self.movetime, depth=self.depth, nodes=self.nodes)
+        return chess.engine.Limit(
+            time=self.movetime * scale, depth=self.depth,
+            nodes=max(1, int(self.nodes * scale)) if self.nodes else None,
+        )
+
+# Trainees mostly need a plausible club-level reply, not the engine's best:
+# everything below "master" is capped by depth and nodes well before its movetime.
+LEVELS: Dict[str, SearchBudget] = {
+    "beginner": SearchBudget(movetime=0.05, depth=4, nodes=5_000),
+    "club": SearchBudget(movetime=0.1, depth=8, nodes=50_000),
+    "advanced": SearchBudget(movetime=0.25, depth=14, nodes=400_000),
+    "master": SearchBudget(movetime=0.5), # The old fixed 500ms search
+}
+
+def _overridden(budget: SearchBudget) -> SearchBudget:
+    """ENGINE_MOVETIME / ENGINE_DEPTH / ENGINE_NODES override the default level (0 removes a limit)."""
+    values = budget._asdict()
+    for name, parse in (("movetime", float), ("depth", int), ("nodes", int)):
+        raw = os.environ.get(f"ENGINE_{name.upper()}")
+        if raw is not None:
+            values[name] = parse(raw) or None
+    values["movetime"] = values["movetime"] or budget.movetime
+    return SearchBudget(**values)
+
+DEFAULT_BUDGET = _overridden(LEVELS.get(ENGINE_LEVEL, LEVELS["club"]))
+
+def budget_for(level: Optional[str]) -> SearchBudget:
+    if level is None or level == ENGINE_LEVEL:
+        return DEFAULT_BUDGET
+    return LEVELS.get(level, DEFAULT_BUDGET)
+
+# --- Early Exits ---
+
+_forced = metrics.METRICS.counter("chess_engine_forced_moves_total", "Engine replies played without a search (one legal move).")
+_early_stops = metrics.METRICS.counter("chess_engine_early_stops_total", "Searches stopped early on a decisive evaluation.")
+
+def forced_move(board: chess.Board) -> Optional[chess.Move]:
+    """The only legal move, if there is exactly one."""
+    moves = iter(board.legal_moves)
+    first = next(moves, None)
+    if first is None or next(moves, None) is not None:
+        return None
+    _forced.inc()
+    return first
+
+def stop_condition(movetime: float) -> Optional[Callable[[chess.engine.InfoDict], bool]]:
+    """The early-stop check for a search of `movetime` seconds, or None when it would cost more than it saves."""
+    return is_decisive if movetime >= ENGINE_EARLY_STOP_MIN_TIME else None
+
+def is_decisive(info: chess.engine.InfoDict) -> bool:
+    """True once the search has found a mate, or a large enough advantage at a trusted depth."""
+    score = info.get("score")
+    if score is None:
+        return False
+    pov = score.relative
+    decisive = pov.is_mate() or (info.get("depth", 0) >= ENGINE_EARLY_STOP_DEPTH and abs(pov.score()) >= ENGINE_DECISIVE_CP)
+    if decisive:
+        _early_stops.inc()
+    return decisive
@@ -0,0 +1,301 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from starlette.concurrency import run_in_threadpool
+
+from . import database, models, tree_loader
+from .chess_logic import GameSession, SessionRecord, mask_to_ids
+from .engine_cache import signed_key, unsigned_key
+
+# --- Configuration ---
+
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "sqlite") # 'sqlite' (shared) or 'memory'
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "5000")) # Live sessions kept in this worker's memory
+SESSION_CACHE_MB = float(os.environ.get("SESSION_CACHE_MB", "64")) # Memory budget for them (estimated)
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "1800")) # seconds before a local session is dropped
+SESSION_RETENTION = float(os.environ.get("SESSION_RETENTION", str(7 * 24 * 3600))) # seconds before a shared record is purged
+
+# Measured with tracemalloc: a GameSession and its board, plus each played
+# move (python-chess keeps a Move and a board state per ply for undo)
+SESSION_BASE_BYTES = 1100
+SESSION_PLY_BYTES = 500
+
+def session_size(session: GameSession) -> int:
+    """Estimated memory held by a live session."""
+    return SESSION_BASE_BYTES + SESSION_PLY_BYTES * len(session.board.move_stack)
+
+# --- Backends ---
+
+class MemorySessionBackend:
+    """Process-local backend; only valid with a single worker."""
+
+    def __init__(self):
+        self._records: Dict[int, Tuple[SessionRecord, float]] = {}
+
+    def load(self, session_id: int) -> Optional[SessionRecord]:
+        entry = self._records.get(session_id)
+        return entry[0] if entry else None
+
+    def save(self, record: SessionRecord):
+        self._records[record.session_id] = (record, time.monotonic())
+
+    async def load_async(self, session_id: int) -> Optional[SessionRecord]:
+        return self.load(session_id)
+
+    async def save_async(self, record: SessionRecord):
+        self.save(record)
+
+    def delete(self, session_id: int):
+        self._records.pop(session_id, None)
+
+    def purge(self, older_than: float):
+        cutoff = time.monotonic() - older_than
+        for session_id, (_, saved_at) in list(self._records.items()):
+            if saved_at < cutoff:
+                del self._records[session_id]
+
+    async def purge_async(self, older_than: float):
+        self.purge(older_than)
+
+def _record_from_row(row: models.GameState) -> SessionRecord:
+    return SessionRecord(
+        row.session_id, row.user_id, row.user_color,
+        tuple(row.moves.split()) if row.moves else (),
+        unsigned_key(row.node_key) if row.node_key is not None else None,
+        row.in_theory, row.engine_mode, int(row.learned_mask, 16), row.tree_version, row.engine_level,
+    )
+
+def _upsert(record: SessionRecord):
+    values = {
+        "session_id": record.session_id,
+        "user_id": record.user_id,
+        "user_color": record.user_color,
+        "moves": " ".join(record.moves),
+        "ply": len(record.moves),
+        "node_key": signed_key(record.node_key) if record.node_key is not None else None,
+        "in_theory": record.in_theory,
+        "engine_mode": record.engine_mode,
+        "learned_mask": format(record.learned_mask, "x"),
+        "tree_version": record.tree_version,
+        "engine_level": record.engine_level,
+        "updated_at": datetime.utcnow(),
+    }
+    stmt = sqlite_insert(models.GameState).values(**values)
+    return stmt.on_conflict_do_update(index_elements=["session_id"], set_=values)
+
+class SQLiteSessionBackend:
+    """
+    Keeps session records in the `game_states` table, so every worker can
+    rehydrate any game. The async methods serve the HTTP handlers; the sync
+    ones are for callers already on a worker thread.
+    """
+
+    def __init__(self, session_factory: Callable = database.SessionLocal,
+                 async_session_factory: Callable = database.AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+
+    def load(self, session_id: int) -> Optional[SessionRecord]:
+        db = self.session_factory()
+        try:
+            row = db.get(models.GameState, session_id)
+            return _record_from_row(row) if row is not None else None
+        finally:
+            db.close()
+
+    async def load_async(self, session_id: int) -> Optional[SessionRecord]:
+        async with self.async_session_factory() as db:
+            row = await db.get(models.GameState, session_id)
+            return _record_from_row(row) if row is not None else None
+
+    def save(self, record: SessionRecord):
+        db = self.session_factory()
+        try:
+            db.execute(_upsert(record))
+            db.commit()
+        finally:
+            db.close()
+
+    async def save_async(self, record: SessionRecord):
+        async with self.async_session_factory() as db:
+            await db.execute(_upsert(record))
+            await db.commit()
+
+    def delete(self, session_id: int):
+        db = self.session_factory()
+        try:
+            db.execute(delete(models.GameState).where(models.GameState.session_id == session_id))
+            db.commit()
+        finally:
+            db.close()
+
+    def purge(self, older_than: float):
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        db = self.session_factory()
+        try:
+            db.execute(delete(models.GameState).where(models.GameState.updated_at < cutoff))
+            db.commit()
+        finally:
+            db.close()
+
+    async def purge_async(self, older_than: float):
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        async with self.async_session_factory() as db:
+            await db.execute(delete(models.GameState).where(models.GameState.updated_at < cutoff))
+            await db.commit()
+
+# --- Store ---
+
+class SessionStore:
+    """
+    Two-tier game session store.
+
+    The backend holds the compact SessionRecord and is the source of truth.
+    Each worker keeps recently used GameSession objects in an LRU with an
+    idle TTL, which saves replaying the moves; a local copy is reused only
+    if its ply count still matches the backend record (another worker may
+    have played a move in between). The LRU is bounded by an estimated
+    memory budget (long games cost more) and by a session count.
+    """
+
+    def __init__(self, backend, max_local: int = SESSION_CACHE_SIZE, max_bytes: int = int(SESSION_CACHE_MB * 1024 * 1024),
+                 idle_ttl: float = SESSION_IDLE_TTL, retention: float = SESSION_RETENTION):
+        self.backend = backend
+        self.max_local = max_local
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.retention = retention
+
+        self._local: "OrderedDict[int, Tuple[GameSession, float, int]]" = OrderedDict() # id -> (session, last used, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+        self.hits = 0
+        self.rehydrations = 0
+        self.evictions = 0
+
+    def get(self, session_id: int) -> Optional[GameSession]:
+        record = self.backend.load(session_id)
+        if record is not None:
+            tree_loader.TREE_LOADER.ensure(mask_to_ids(record.learned_mask))
+        return self._resolve(session_id, record)
+
+    async def get_async(self, session_id: int) -> Optional[GameSession]:
+        record = await self.backend.load_async(session_id)
+        # A game from another worker (or before a restart) needs its openings in this worker's tree
+        if record is not None and not tree_loader.TREE_LOADER.is_loaded(mask_to_ids(record.learned_mask)):
+            await run_in_threadpool(tree_loader.TREE_LOADER.ensure, mask_to_ids(record.learned_mask))
+        return self._resolve(session_id, record)
+
+    def _resolve(self, session_id: int, record: Optional[SessionRecord]) -> Optional[GameSession]:
+        """The local copy if it is still current, else one rebuilt from the record."""
+        if record is None:
+            with self._lock:
+                self._drop(session_id)
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._local.get(session_id)
+            if cached is not None and now - cached[1] <= self.idle_ttl and len(cached[0].board.move_stack) == len(record.moves):
+                self._local[session_id] = (cached[0], now, cached[2])
+                self._local.move_to_end(session_id)
+                self.hits += 1
+                return cached[0]
+
+        session = GameSession.from_record(record)
+        with self._lock:
+            self.rehydrations += 1
+            self._remember(session, now)
+        return session
+
+    def put(self, session: GameSession):
+        """Saves the session's current state. Call after every change."""
+        self.backend.save(session.to_record())
+        if self._saved(session):
+            self.backend.purge(self.retention)
+
+    async def put_async(self, session: GameSession, expected_ply: Optional[int] = None) -> bool:
+        """
+        With `expected_ply`, saves only if the backend record still has that
+        many moves, i.e. nobody played in the game since it was loaded, and
+        forgets the local copy otherwise. Returns whether it saved. The check
+        and the save are separate statements: this narrows the race with
+        another worker, it doesn't close it.
+        """
+        if expected_ply is not None:
+            record = await self.backend.load_async(session.session_id)
+            if record is None or len(record.moves) != expected_ply:
+                with self._lock:
+                    self._drop(session.session_id)
+                return False
+        await self.backend.save_async(session.to_record())
+        if self._saved(session):
+            await self.backend.purge_async(self.retention)
+        return True
+
+    def _saved(self, session: GameSession) -> bool:
+        """Keeps the saved session locally; True when expired records are due a purge."""
+        now = time.monotonic()
+        with self._lock:
+            self._remember(session, now)
+            purge = now - self._last_purge > 60
+            if purge:
+                self._last_purge = now
+        return purge
+
+    def delete(self, session_id: int):
+        self.backend.delete(session_id)
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id: int) -> bool:
+        """Caller holds the lock."""
+        entry = self._local.pop(session_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[2]
+        return True
+
+    def _remember(self, session: GameSession, now: float):
+        """Caller holds the lock. Evicts idle sessions, then the least recently used over budget."""
+        self._drop(session.session_id)
+        size = session_size(session)
+        self._local[session.session_id] = (session, now, size)
+        self._bytes += size
+        while len(self._local) > 1:
+            oldest_id, (_, last_used, _) = next(iter(self._local.items()))
+            if len(self._local) > self.max_local or self._bytes > self.max_bytes or now - last_used > self.idle_ttl:
+                self._drop(oldest_id)
+                self.evictions += 1
+            else:
+                break
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "local_sessions": len(self._local),
+                "max_local": self.max_local,
+                "local_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "rehydrations": self.rehydrations,
+                "evictions": self.evictions,
+            }
+
+def _default_backend():
+    if SESSION_STORE_BACKEND == "memory":
+        return MemorySessionBackend()
+    return SQLiteSessionBackend()
+
+# --- Global Store ---
+
+SESSION_STORE = SessionStore(_default_backend())
@@ -0,0 +1,321 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from . import chess_logic, database, metrics, models, tree_snapshot
+from .chess_logic import MoveRecord
+
+_log = metrics.get_logger("tree_loader")
+
+# --- Configuration ---
+
+TREE_LAZY_LOAD = os.environ.get("TREE_LAZY_LOAD", "1") == "1" # 0 loads the whole tree before serving
+TREE_WARMUP_BATCH = int(os.environ.get("TREE_WARMUP_BATCH", "16")) # Openings merged per tree version during warm-up
+TREE_LOAD_TIMEOUT = float(os.environ.get("TREE_LOAD_TIMEOUT", "30")) # seconds a request waits for its openings
+TREE_RETRY_INTERVAL = float(os.environ.get("TREE_RETRY_INTERVAL", "60")) # seconds before a request retries an opening that failed to load
+
+def parse_source(pgn_path: str) -> Optional[List[MoveRecord]]:
+    """parse_repertoire_file that returns None for an unreadable file, so one bad file doesn't stop a batch."""
+    try:
+        return chess_logic.parse_repertoire_file(pgn_path)
+    except Exception:
+        return None
+
+class TreeLoader:
+    """
+    Loads the opening tree while the server is already answering requests.
+
+    A valid snapshot is mapped in one step. Otherwise the openings are
+    merged in batches by a warm-up thread, each batch published as a new
+    tree version, with openings someone has learned first. A game only
+    reaches the positions of its learned openings of its color, so that is
+    all a request waits for (`ensure`): openings the warm-up hasn't got to
+    yet are loaded by the request itself, and one the warm-up is loading
+    is waited for. When every opening is in, the tree is written to the
+    snapshot for the next start.
+
+    An opening that fails to parse or merge is left out and the rest are
+    served; a request that needs it tries again once `retry_interval` has
+    passed. Only a failure to read the catalog fails the warm-up as a whole.
+    """
+
+    def __init__(self, session_factory: Callable = database.SessionLocal,
+                 snapshot_path: str = tree_snapshot.OPENING_SNAPSHOT_PATH,
+                 batch: int = TREE_WARMUP_BATCH, workers: int = chess_logic.PARSE_WORKERS,
+                 retry_interval: float = TREE_RETRY_INTERVAL):
+        self.session_factory = session_factory
+        self.snapshot_path = snapshot_path
+        self.batch = max(1, batch)
+        self.workers = workers
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._begun = False # Until then the tree is managed elsewhere (scripts, tests) and nothing waits
+        self._catalog_ready = threading.Event() # Set once the startup catalog is known
+        self._done = threading.Event() # Set once every opening is in the tree
+        self._sources: Dict[int, str] = {}
+        self._pending: Dict[int, None] = {} # Openings nobody has claimed, in warm-up order
+        self._loaded: Dict[int, threading.Event] = {}
+        self._failed: Dict[int, float] = {} # Opening -> when it last failed to load
+        self._last_tree = None # Last tree published here; an import since then skips the snapshot
+
+        # Progress
+        self.stage = "starting" # starting, catalog, snapshot, loading, ready, failed
+        self.source: Optional[str] = None # 'snapshot' or 'pgn'
+        self.error: Optional[str] = None
+        self.openings_total = 0
+        self.openings_loaded = 0
+        self.on_demand = 0 # Openings loaded by a request ahead of the warm-up
+        self.waits = 0 # Requests that had to wait for their openings
+        self.failed = 0 # Openings currently left out because they failed to load
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+
+    # --- Warm-up ---
+
+    def begin(self):
+        """Marks the tree as loading: from here on requests wait for `load`. Call before starting it."""
+        self._begun = True
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def load(self):
+        """Loads the whole tree; runs on the warm-up thread while requests call `ensure`."""
+        self.begin()
+        try:
+            self.stage = "catalog"
+            db = self.session_factory()
+            try:
+                openings = db.query(models.Opening).all()
+                learned = {opening_id for (opening_id,) in db.query(models.LearnedOpening.opening_id).distinct()}
+            finally:
+                db.close()
+            sources = sorted(((op.id, op.pgn_path) for op in openings if os.path.exists(op.pgn_path)),
+                             key=lambda source: (source[0] not in learned, source[0]))
+
+            # Shared snapshot first: mmap'd, so workers share it and only touched pages are read.
+            self.stage = "snapshot"
+            source_hash = tree_snapshot.hash_sources(sources)
+            snapshot = tree_snapshot.open_snapshot(self.snapshot_path, source_hash)
+            if snapshot is not None:
+                chess_logic.publish_tree(snapshot)
+                with self._lock:
+                    self.source = "snapshot"
+                    self.openings_total = self.openings_loaded = len(sources)
+                _log.info("Loaded %d openings from snapshot (%d positions).", len(sources), len(snapshot))
+                return
+
+            with self._lock:
+                self.source = "pgn"
+                self.stage = "loading"
+                self.openings_total = len(sources)
+                self._sources = dict(sources)
+                self._pending = dict.fromkeys(self._sources)
+                self._loaded = {opening_id: threading.Event() for opening_id in self._sources}
+            self._catalog_ready.set()
+
+            pool: Optional[Executor] = None
+            if self.workers > 1 and len(sources) >= chess_logic.PARALLEL_PARSE_MIN_FILES:
+                pool = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                while True:
+                    with self._lock:
+                        batch = list(itertools.islice(self._pending, self.batch))
+                        for opening_id in batch:
+                            del self._pending[opening_id]
+                    if not batch:
+                        break
+                    self._load(batch, pool)
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+
+            # Openings claimed by requests may still be merging
+            for event in self._loaded.values():
+                event.wait()
+            self._finish()
+            with self._lock:
+                failed = len(self._failed)
+            _log.info("Loaded %d openings into memory (%d failed).", len(sources) - failed, failed)
+            if not failed:
+                # A snapshot without them would hide them until their files change
+                self._write_snapshot(source_hash)
+        except Exception as e:
+            _log.error("Opening tree warm-up failed: %s", e)
+            with self._lock:
+                self.error = str(e)
+        finally:
+            self._finish()
+            # Nobody may wait on an opening that will never load
+            for event in self._loaded.values():
+                event.set()
+
+    def _finish(self):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.stage = "failed" if self.error else "ready"
+            self._finished = time.perf_counter()
+        self._catalog_ready.set()
+        self._done.set()
+
+    def _load(self, opening_ids: List[int], pool: Optional[Executor] = None, retry: bool = False):
+        """
+        Parses the openings (the caller has claimed them) and publishes a tree
+        with them in. Openings that fail are recorded and left out; the others
+        are published either way.
+        """
+        failed: Dict[int, str] = {}
+        try:
+            paths = [self._sources[opening_id] for opening_id in opening_ids]
+            parsed: Optional[List[Optional[List[MoveRecord]]]] = None
+            if pool is not None:
+                try:
+                    parsed = list(pool.map(parse_source, paths))
+                except Exception as e:
+                    _log.warning("Parse pool failed, parsing on this thread: %s", e)
+            if parsed is None:
+                parsed = [parse_source(path) for path in paths]
+
+            records_by_id = {}
+            for opening_id, records in zip(opening_ids, parsed):
+                if records is None:
+                    failed[opening_id] = "unreadable file"
+                else:
+                    records_by_id[opening_id] = records
+            try:
+                self._merge(records_by_id)
+            except Exception:
+                # One at a time, so only the opening that breaks the merge is left out
+                for opening_id, records in records_by_id.items():
+                    try:
+                        self._merge({opening_id: records})
+                    except Exception as e:
+                        failed[opening_id] = str(e)
+        except Exception as e:
+            failed.update(dict.fromkeys(opening_ids, str(e)))
+        finally:
+            now = time.monotonic()
+            with self._lock:
+                if not retry:
+                    self.openings_loaded += len(opening_ids)
+                for opening_id in opening_ids:
+                    if opening_id in failed:
+                        self._failed[opening_id] = now
+                    else:
+                        self._failed.pop(opening_id, None)
+                self.failed = len(self._failed)
+            for opening_id, reason in failed.items():
+                _log.warning("Could not load opening %d (%s): %s", opening_id, self._sources.get(opening_id), reason)
+            for opening_id in opening_ids:
+                self._loaded[opening_id].set()
+
+    def _merge(self, records_by_id: Dict[int, List[MoveRecord]]):
+        with chess_logic.TREE_WRITE_LOCK:
+            edit = chess_logic.begin_edit()
+            for opening_id, records in records_by_id.items():
+                if records:
+                    edit.add_records(opening_id, records)
+            tree = edit.commit()
+            chess_logic.publish_tree(tree)
+            self._last_tree = tree
+
+    def _claim_retries(self, opening_ids: List[int]) -> List[int]:
+        """Failed openings among `opening_ids` that are due another try. Caller holds the lock."""
+        now = time.monotonic()
+        retry = [i for i in opening_ids if i in self._failed and now - self._failed[i] >= self.retry_interval]
+        for opening_id in retry:
+            del self._failed[opening_id]
+            self._loaded[opening_id] = threading.Event() # Other requests wait for this attempt
+        return retry
+
+    def _write_snapshot(self, source_hash: str):
+        tree = chess_logic.GLOBAL_OPENING_TREE
+        if tree is not self._last_tree:
+            return # An import changed the tree during warm-up; the next start rebuilds
+        try:
+            tree_snapshot.write_snapshot(tree, self.snapshot_path, source_hash)
+            snapshot = tree_snapshot.open_snapshot(self.snapshot_path, source_hash)
+        except Exception as e:
+            # The tree is loaded either way; the next start just parses again
+            _log.warning("Could not write opening snapshot: %s", e)
+            return
+        # Switch to the mapped copy so this worker shares pages with the others too.
+        with chess_logic.TREE_WRITE_LOCK:
+            if snapshot is not None and chess_logic.GLOBAL_OPENING_TREE is tree:
+                chess_logic.publish_tree(snapshot)
+
+    # --- Requests ---
+
+    def is_loaded(self, opening_ids: Iterable[int]) -> bool:
+        if not self._begun or self._done.is_set():
+            return True
+        if not self._catalog_ready.is_set():
+            return False
+        return all(self._loaded[i].is_set() for i in opening_ids if i in self._loaded)
+
+    def ensure(self, opening_ids: Iterable[int], timeout: float = TREE_LOAD_TIMEOUT) -> bool:
+        """
+        Blocks until the openings are in the published tree, loading the ones
+        the warm-up hasn't claimed on this thread. False on timeout or if the
+        warm-up failed. Call without TREE_WRITE_LOCK held.
+        """
+        if not self._begun or (self._done.is_set() and not self._failed):
+            return self.error is None
+        opening_ids = list(opening_ids)
+        deadline = time.monotonic() + timeout
+        if not self._catalog_ready.wait(timeout):
+            return False
+
+        with self._lock:
+            mine = [i for i in opening_ids if i in self._pending]
+            for opening_id in mine:
+                del self._pending[opening_id]
+            retry = self._claim_retries(opening_ids)
+            waiting = [self._loaded[i] for i in opening_ids
+                       if i in self._loaded and i not in retry and not self._loaded[i].is_set()]
+            if waiting:
+                self.waits += 1
+            self.on_demand += len(mine)
+        if mine:
+            self._load(mine)
+        if retry:
+            self._load(retry, retry=True)
+        for event in waiting:
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                return False
+        return self.error is None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the whole tree (for the position index, tests and benchmarks)."""
+        return (not self._begun or self._done.wait(timeout)) and self.error is None
+
+    @property
+    def ready(self) -> bool:
+        """Requests can be served: the catalog is known, so `ensure` knows what to load."""
+        return (not self._begun or self._catalog_ready.is_set()) and self.error is None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            end = self._finished or time.perf_counter()
+            return {
+                "stage": self.stage,
+                "source": self.source,
+                "error": self.error,
+                "openings_total": self.openings_total,
+                "openings_loaded": self.openings_loaded,
+                "progress": round(self.openings_loaded / self.openings_total, 4) if self.openings_total else float(self._done.is_set()),
+                "positions": len(chess_logic.GLOBAL_OPENING_TREE),
+                "on_demand": self.on_demand,
+                "waits": self.waits,
+                "failed": self.failed,
+                "failed_openings": sorted(self._failed),
+                "elapsed_sec": round(end - self._started, 3) if self._started is not None else 0.0,
+            }
+
+# --- Global Loader ---
+
+TREE_LOADER = TreeLoader()
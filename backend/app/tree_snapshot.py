@@ -0,0 +1,420 @@
+import bisect
+import chess
+import hashlib
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .chess_logic import OpeningNode, OpeningTree, mask_to_ids, position_key
+
+_log = metrics.get_logger("snapshot")
+
+# --- Binary Opening Tree Snapshot ---
+#
+# The built tree is written as flat little-endian arrays and opened with mmap,
+# so loading costs only the pages that are touched and every worker process
+# shares one physical copy through the page cache. Nodes are stored sorted by
+# Zobrist key, which makes the key array itself the position index.
+#
+# Layout: fixed header, then the sections below, each 8-byte aligned.
+
+OPENING_SNAPSHOT_PATH = os.environ.get("OPENING_SNAPSHOT_PATH", "opening_tree.snapshot")
+SNAPSHOT_VERIFY = os.environ.get("SNAPSHOT_VERIFY", "0") == "1" # Check every stored index on open (reads the whole file)
+
+MAGIC = b"COTSNAP\0"
+VERSION = 1
+NO_INDEX = 0xFFFFFFFF
+
+_SECTIONS = [
+    # name, typecode
+    ("keys", "Q"),          # Zobrist key per node (sorted)
+    ("parent", "i"),        # First parent node index, -1 for the root
+    ("move", "I"),          # SAN index of the move that first reached the node
+    ("weight", "I"),
+    ("edge_start", "I"),    # CSR offsets into the edge arrays, n + 1 entries
+    ("edge_san", "I"),
+    ("edge_child", "I"),
+    ("mask_start", "Q"),    # Opening masks as little-endian byte strings, n + 1 entries
+    ("mask_shift", "I"),    # Bytes of trailing zeros stripped from each mask
+    ("mask_blob", "B"),
+    ("nag_start", "I"),
+    ("nag_blob", "B"),
+    ("comment_start", "Q"),
+    ("comment_blob", "B"),
+    ("san_start", "I"),
+    ("san_blob", "B"),
+]
+
+_HEADER = struct.Struct("<8sII32sI")
+_SECTION_ENTRY = struct.Struct("<QQ")
+_HEADER_SIZE = _HEADER.size + _SECTION_ENTRY.size * len(_SECTIONS)
+
+class SnapshotError(Exception):
+    pass
+
+def hash_sources(sources: Iterable[Tuple[int, str]]) -> str:
+    """
+    Hash of (opening id, PGN path, size, mtime) tuples. Any change to the
+    catalog or a rewritten PGN invalidates the snapshot, without reading
+    the PGNs at startup.
+    """
+    h = hashlib.sha256()
+    h.update(f"v{VERSION}".encode())
+    for opening_id, path in sorted(sources):
+        st = os.stat(path)
+        h.update(f"\0{opening_id}\0{path}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+# --- Writing ---
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+def write_snapshot(tree: OpeningTree, path: str, source_hash: str):
+    """Serializes `tree` to `path` atomically (write to a temp file, then rename)."""
+    nodes = sorted(tree.nodes_by_hash.values(), key=lambda n: n.key)
+    index_of = {node.key: i for i, node in enumerate(nodes)}
+
+    san_index: Dict[str, int] = {}
+    def san_id(san: str) -> int:
+        if san not in san_index:
+            san_index[san] = len(san_index)
+        return san_index[san]
+
+    data = {name: array(code) for name, code in _SECTIONS}
+    mask_blob = bytearray()
+    nag_blob = bytearray()
+    comment_blob = bytearray()
+    data["edge_start"].append(0)
+    data["mask_start"].append(0)
+    data["nag_start"].append(0)
+    data["comment_start"].append(0)
+
+    for node in nodes:
+        data["keys"].append(node.key)
+        data["parent"].append(index_of[node.parent.key] if node.parent is not None else -1)
+        data["move"].append(san_id(node.move_san) if node.move_san is not None else NO_INDEX)
+        data["weight"].append(node.weight)
+
+        for san, child in node.iter_children():
+            data["edge_san"].append(san_id(san))
+            data["edge_child"].append(index_of[child.key])
+        data["edge_start"].append(len(data["edge_san"]))
+
+        mask = node.opening_mask
+        shift = ((mask & -mask).bit_length() - 1) // 8 if mask else 0
+        mask >>= 8 * shift
+        mask_blob += mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+        data["mask_shift"].append(shift)
+        data["mask_start"].append(len(mask_blob))
+
+        nag_blob += bytes(sorted(node.nags))
+        data["nag_start"].append(len(nag_blob))
+        if node.comment:
+            comment_blob += node.comment.encode("utf-8")
+        data["comment_start"].append(len(comment_blob))
+
+    san_blob = bytearray()
+    data["san_start"].append(0)
+    for san in san_index:
+        san_blob += san.encode("utf-8")
+        data["san_start"].append(len(san_blob))
+
+    data["mask_blob"] = array("B", mask_blob)
+    data["nag_blob"] = array("B", nag_blob)
+    data["comment_blob"] = array("B", comment_blob)
+    data["san_blob"] = array("B", san_blob)
+
+    root_index = index_of[tree.root.key]
+    table = []
+    offset = _align(_HEADER_SIZE)
+    for name, _ in _SECTIONS:
+        table.append((offset, len(data[name])))
+        offset = _align(offset + data[name].itemsize * len(data[name]))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, root_index, bytes.fromhex(source_hash), len(nodes)))
+        for entry in table:
+            f.write(_SECTION_ENTRY.pack(*entry))
+        for (name, _), (section_offset, _) in zip(_SECTIONS, table):
+            f.write(b"\0" * (section_offset - f.tell()))
+            f.write(data[name].tobytes())
+        f.write(b"\0" * (offset - f.tell()))
+    os.replace(tmp_path, path)
+
+# --- Reading ---
+
+class SnapshotNode:
+    """Read-only view of one snapshot node; same read interface as OpeningNode."""
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: "SnapshotTree", index: int):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SnapshotNode) and other.tree is self.tree and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash(self.index)
+
+    @property
+    def key(self) -> int:
+        return self.tree._keys[self.index]
+
+    @property
+    def move_san(self) -> Optional[str]:
+        move = self.tree._move[self.index]
+        return self.tree._san(move) if move != NO_INDEX else None
+
+    @property
+    def parent(self) -> Optional["SnapshotNode"]:
+        parent = self.tree._parent[self.index]
+        return self.tree._node(parent) if parent != -1 else None
+
+    @property
+    def weight(self) -> int:
+        return self.tree._weight[self.index]
+
+    @property
+    def opening_mask(self) -> int:
+        t = self.tree
+        start, end = t._span(t._mask_start, self.index, t._mask_blob)
+        return int.from_bytes(t._mask_blob[start:end], "little") << (8 * t._mask_shift[self.index])
+
+    @property
+    def opening_ids(self):
+        return set(mask_to_ids(self.opening_mask))
+
+    @property
+    def nags(self) -> FrozenSet[int]:
+        t = self.tree
+        start, end = t._span(t._nag_start, self.index, t._nag_blob)
+        return frozenset(t._nag_blob[start:end])
+
+    @property
+    def comment(self) -> Optional[str]:
+        t = self.tree
+        start, end = t._span(t._comment_start, self.index, t._comment_blob)
+        return bytes(t._comment_blob[start:end]).decode("utf-8") if end > start else None
+
+    def iter_children(self) -> Iterator[Tuple[str, "SnapshotNode"]]:
+        t = self.tree
+        for e in range(*t._span(t._edge_start, self.index, t._edge_child)):
+            yield t._san(t._edge_san[e]), t._node(t._edge_child[e])
+
+    def child(self, move_san: str) -> Optional["SnapshotNode"]:
+        t = self.tree
+        for e in range(*t._span(t._edge_start, self.index, t._edge_child)):
+            if t._san(t._edge_san[e]) == move_san:
+                return t._node(t._edge_child[e])
+        return None
+
+    @property
+    def moves(self) -> Tuple[str, ...]:
+        return tuple(san for san, _ in self.iter_children())
+
+    @property
+    def nodes(self) -> Tuple["SnapshotNode", ...]:
+        return tuple(node for _, node in self.iter_children())
+
+    @property
+    def children(self) -> Dict[str, "SnapshotNode"]:
+        return dict(self.iter_children())
+
+    line = OpeningNode.line
+    fen = OpeningNode.fen
+
+class _SnapshotIndex(Mapping):
+    """Zobrist key -> node, by binary search over the sorted key array."""
+
+    def __init__(self, tree: "SnapshotTree"):
+        self.tree = tree
+
+    def __getitem__(self, key: int) -> SnapshotNode:
+        keys = self.tree._keys
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            raise KeyError(key)
+        return SnapshotNode(self.tree, i)
+
+    def __len__(self) -> int:
+        return len(self.tree._keys)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.tree._keys)
+
+class SnapshotTree:
+    """
+    Read-only opening tree backed by an mmap'd snapshot file.
+    Exposes the same read interface as OpeningTree (root, nodes_by_hash, get_node).
+    """
+
+    def __init__(self, path: str, expected_hash: Optional[str] = None, verify: bool = SNAPSHOT_VERIFY):
+        if sys.byteorder != "little":
+            raise SnapshotError("Snapshots are little-endian only.")
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self._buf = memoryview(self._mmap)
+        try:
+            if len(buf) < _HEADER_SIZE:
+                raise SnapshotError("File too short.")
+            magic, version, root_index, source_hash, num_nodes = _HEADER.unpack_from(buf, 0)
+            if magic != MAGIC or version != VERSION:
+                raise SnapshotError("Not a snapshot of this version.")
+            self.source_hash = source_hash.hex()
+            # Same sources, same version on every worker, so pinned sessions move between them
+            self.version = int(self.source_hash[:15], 16)
+            if expected_hash is not None and self.source_hash != expected_hash:
+                raise SnapshotError("Snapshot is stale.")
+
+            self._views = []
+            for i, (name, code) in enumerate(_SECTIONS):
+                offset, count = _SECTION_ENTRY.unpack_from(buf, _HEADER.size + i * _SECTION_ENTRY.size)
+                view = buf[offset:offset + count * array(code).itemsize]
+                if len(view) != count * array(code).itemsize:
+                    raise SnapshotError(f"Section '{name}' is truncated.")
+                view = view.cast(code)
+                self._views.append(view)
+                setattr(self, f"_{name}", view)
+
+            if len(self._keys) != num_nodes or len(self._edge_start) != num_nodes + 1 or root_index >= num_nodes:
+                raise SnapshotError("Section sizes don't match the header.")
+            self._check_sections(num_nodes)
+
+            # The SAN table is tiny (distinct moves); decode it once.
+            blob = bytes(self._san_blob)
+            starts = self._san_start
+            self.sans: List[str] = [
+                sys.intern(blob[slice(*self._span(starts, i, blob))].decode("utf-8")) for i in range(len(starts) - 1)
+            ]
+            if verify:
+                self.verify()
+        except Exception:
+            self.close()
+            raise
+
+        self.path = path
+        self.root = SnapshotNode(self, root_index)
+        self.nodes_by_hash = _SnapshotIndex(self)
+
+    def _check_sections(self, num_nodes: int):
+        """
+        Section lengths and the ends of the offset tables must match. This
+        reads a few words, not the body: the indices inside are checked as
+        they are read (see _node and _span), or all at once by verify().
+        """
+        for name in ("parent", "move", "weight", "mask_shift"):
+            if len(getattr(self, f"_{name}")) != num_nodes:
+                raise SnapshotError(f"Section '{name}' doesn't match the node count.")
+        for name in ("mask_start", "nag_start", "comment_start"):
+            if len(getattr(self, f"_{name}")) != num_nodes + 1:
+                raise SnapshotError(f"Section '{name}' doesn't match the node count.")
+        if len(self._edge_san) != len(self._edge_child):
+            raise SnapshotError("Edge sections differ in length.")
+        for starts, blob in self._offset_tables():
+            if not len(starts) or starts[0] != 0 or starts[-1] != len(blob):
+                raise SnapshotError("Offset table out of range.")
+
+    def _offset_tables(self):
+        return ((self._edge_start, self._edge_child), (self._mask_start, self._mask_blob),
+                (self._nag_start, self._nag_blob), (self._comment_start, self._comment_blob),
+                (self._san_start, self._san_blob))
+
+    def _node(self, index: int) -> SnapshotNode:
+        if not 0 <= index < len(self._keys):
+            raise SnapshotError(f"Node index {index} out of range.")
+        return SnapshotNode(self, index)
+
+    def _san(self, index: int) -> str:
+        if index >= len(self.sans):
+            raise SnapshotError(f"Move index {index} out of range.")
+        return self.sans[index]
+
+    def _span(self, starts, i: int, blob) -> Tuple[int, int]:
+        start, end = starts[i], starts[i + 1]
+        if not start <= end <= len(blob):
+            raise SnapshotError("Offset table out of range.")
+        return start, end
+
+    def verify(self):
+        """
+        Checks every index stored in the body, which reads the whole file.
+        Off by default (SNAPSHOT_VERIFY=1 runs it on open): a corrupt index
+        is otherwise reported by the read that hits it.
+        """
+        num_nodes = len(self._keys)
+        for starts, _ in self._offset_tables():
+            if not all(map(operator.le, starts[:-1], starts[1:])):
+                raise SnapshotError("Offset table out of range.")
+
+        num_sans = len(self.sans)
+        if num_nodes and (max(self._parent) >= num_nodes or min(self._parent) < -1):
+            raise SnapshotError("Parent index out of range.")
+        if len(self._edge_child) and (max(self._edge_child) >= num_nodes or max(self._edge_san) >= num_sans):
+            raise SnapshotError("Edge index out of range.")
+        if max((move for move in self._move if move != NO_INDEX), default=-1) >= num_sans:
+            raise SnapshotError("Move index out of range.")
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get_node(self, board: chess.Board) -> Optional[SnapshotNode]:
+        return self.nodes_by_hash.get(position_key(board))
+
+    def thaw(self) -> OpeningTree:
+        """Copies the snapshot into a mutable OpeningTree."""
+        tree = OpeningTree()
+        nodes: List[Optional[OpeningNode]] = [None] * len(self)
+        root_index = self.root.index
+        nodes[root_index] = tree.root
+        for i in range(len(self)):
+            if nodes[i] is None:
+                nodes[i] = OpeningNode(self._keys[i])
+        tree.nodes_by_hash = {node.key: node for node in nodes}
+
+        for i, node in enumerate(nodes):
+            view = SnapshotNode(self, i)
+            parent = view.parent
+            node.parent = nodes[parent.index] if parent is not None else None
+            node.move_san = view.move_san
+            node.opening_mask = view.opening_mask
+            node.weight = view.weight
+            if self._nag_start[i] != self._nag_start[i + 1]:
+                node.nags = view.nags
+            node.comment = view.comment
+            edges = []
+            for san, child in view.iter_children():
+                edges += (san, nodes[child.index])
+                if self._parent[child.index] != i:
+                    tree.extra_parents[child.key] = tree.extra_parents.get(child.key, ()) + (node.key,)
+            node.edges = tuple(edges)
+        return tree
+
+    def close(self):
+        for view in getattr(self, "_views", []) + [self._buf]:
+            view.release()
+        self._views = []
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Node views still reference the mapping; it's released with them.
+            pass
+
+def open_snapshot(path: str, expected_hash: str) -> Optional[SnapshotTree]:
+    """Opens a snapshot if it exists and matches `expected_hash`; None if missing, stale or corrupt."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return SnapshotTree(path, expected_hash)
+    except (SnapshotError, OSError, ValueError, struct.error) as e:
+        _log.warning("Ignoring opening snapshot %s: %s", path, e)
+        return None
@@ -0,0 +1,93 @@
+"""
+Memory benchmark: bytes per opening-tree node.
+
+Builds the same synthetic repertoire twice, once with the current slotted
+OpeningNode and once with the previous dict-based layout (full FEN string,
+children dict and id set per node), and reports tracemalloc bytes per node.
+
+Usage (from backend/): python -m benchmarks.bench_node_memory [num_openings]
+"""
+import gc
+import random
+import sys
+import tracemalloc
+
+import chess
+
+from app import chess_logic
+
+PLIES = 16
+
+class LegacyOpeningNode:
+    """Node layout before the compact representation, kept here for comparison."""
+
+    def __init__(self, fen, move_san=None, parent=None):
+        self.fen = fen
+        self.move_san = move_san
+        self.parent = parent
+        self.children = {}
+        self.opening_ids = set()
+
+def synthetic_lines(num_openings: int, seed: int = 1):
+    """Random repertoire lines as (san, key, fen) triples."""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(num_openings):
+        board = chess.Board()
+        line = []
+        for _ in range(PLIES):
+            move = rng.choice(sorted(board.legal_moves, key=lambda m: m.uci())[:5])
+            san = board.san(move)
+            board.push(move)
+            line.append((san, chess_logic.position_key(board), board.fen()))
+        lines.append(line)
+    return lines
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree, count = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, count
+
+def build_legacy(lines):
+    def build():
+        root = LegacyOpeningNode(chess.STARTING_FEN)
+        count = 1
+        for oid, line in enumerate(lines, 1):
+            node = root
+            node.opening_ids.add(oid)
+            for san, _, fen in line:
+                if san not in node.children:
+                    node.children[san] = LegacyOpeningNode(fen, san, node)
+                    count += 1
+                node = node.children[san]
+                node.opening_ids.add(oid)
+        return root, count
+    return build
+
+def build_compact(lines):
+    def build():
+        tree = chess_logic.OpeningTree()
+        for oid, line in enumerate(lines, 1):
+            records = [chess_logic.MoveRecord(i - 1, san, key, (), None) for i, (san, key, _) in enumerate(line)]
+            tree.add_records(oid, records)
+        return tree, len(tree)
+    return build
+
+if __name__ == "__main__":
+    num_openings = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lines = synthetic_lines(num_openings)
+    # Fresh copies of the SAN strings per build, as PGN parsing would produce.
+    legacy_lines = [[("%s" % san, key, fen) for san, key, fen in line] for line in lines]
+    compact_lines = [[("".join(san), key, None) for san, key, _ in line] for line in lines]
+
+    legacy_bytes, legacy_nodes = measure(build_legacy(legacy_lines))
+    compact_bytes, compact_nodes = measure(build_compact(compact_lines))
+
+    print(f"{'layout':<10} {'nodes':>8} {'bytes':>12} {'bytes/node':>12}")
+    print(f"{'before':<10} {legacy_nodes:>8} {legacy_bytes:>12} {legacy_bytes / legacy_nodes:>12.0f}")
+    print(f"{'after':<10} {compact_nodes:>8} {compact_bytes:>12} {compact_bytes / compact_nodes:>12.0f}")
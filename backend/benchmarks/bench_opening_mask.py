@@ -0,0 +1,84 @@
+"""
+Micro-benchmark: cost of the per-move theory membership test as the catalog grows.
+
+Compares the bitmask test used by GameSession (`node.opening_mask & learned_mask`)
+with the set intersection it replaced, over the same synthetic repertoire.
+
+Usage (from backend/): python -m benchmarks.bench_opening_mask [sizes...]
+"""
+import random
+import sys
+import time
+
+import chess
+
+from app import chess_logic
+
+PLIES = 12
+STEPS = 20000
+
+def build_tree(num_openings: int, seed: int = 1) -> chess_logic.OpeningTree:
+    """Random repertoire lines; a handful of first moves so prefixes are heavily shared."""
+    rng = random.Random(seed)
+    tree = chess_logic.OpeningTree()
+    first_moves = ["e4", "d4", "c4", "Nf3"]
+    for oid in range(1, num_openings + 1):
+        board = chess.Board()
+        records = []
+        for ply in range(PLIES):
+            if ply == 0:
+                move = board.parse_san(rng.choice(first_moves))
+            else:
+                move = rng.choice(sorted(board.legal_moves, key=lambda m: m.uci())[:4])
+            san = board.san(move)
+            board.push(move)
+            records.append(chess_logic.MoveRecord(ply - 1, san, chess_logic.position_key(board), (), None))
+        tree.add_records(oid, records)
+    return tree
+
+def walks(tree: chess_logic.OpeningTree, steps: int, seed: int = 2):
+    """Sequence of nodes visited by random walks from the root."""
+    rng = random.Random(seed)
+    visited = []
+    node = tree.root
+    while len(visited) < steps:
+        visited.append(node)
+        if node.nodes:
+            node = rng.choice(node.nodes)
+        else:
+            node = tree.root
+    return visited
+
+def bench(num_openings: int):
+    tree = build_tree(num_openings)
+    learned_ids = set(range(1, num_openings + 1, 2))
+    learned_mask = chess_logic.ids_to_mask(learned_ids)
+    nodes = walks(tree, STEPS)
+
+    # Reference: the old representation, one set per node.
+    id_sets = {id(n): n.opening_ids for n in tree.nodes_by_hash.values()}
+
+    start = time.perf_counter()
+    hits_mask = 0
+    for node in nodes:
+        for child in node.nodes:
+            if child.opening_mask & learned_mask:
+                hits_mask += 1
+    mask_ns = (time.perf_counter() - start) / len(nodes) * 1e9
+
+    start = time.perf_counter()
+    hits_set = 0
+    for node in nodes:
+        for child in node.nodes:
+            if id_sets[id(child)].intersection(learned_ids):
+                hits_set += 1
+    set_ns = (time.perf_counter() - start) / len(nodes) * 1e9
+
+    assert hits_mask == hits_set
+    print(f"{num_openings:>8} {len(tree.nodes_by_hash):>8} {mask_ns:>12.0f} {set_ns:>12.0f}")
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 10000]
+    print(f"{'openings':>8} {'nodes':>8} {'mask ns/ply':>12} {'set ns/ply':>12}")
+    for size in sizes:
+        bench(size)
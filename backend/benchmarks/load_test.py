@@ -0,0 +1,334 @@
+"""
+Load test: concurrent training games against the full FastAPI app.
+
+Seeds a throwaway working directory with synthetic openings (both colors),
+starts the app on it with a deterministic fake UCI engine, then plays M
+concurrent games through the HTTP endpoints. Each user move follows the
+repertoire with probability --theory-rate and is a random legal move
+otherwise, so games exercise both book replies and engine searches.
+
+Reports per-endpoint p50/p95/p99, throughput and peak RSS, plus three
+micro-benchmarks (`add_opening`, `process_user_move` in theory, and app
+startup). Results are compared with benchmarks/baselines.json; a metric
+more than --tolerance worse than its baseline fails the run (exit code 1).
+
+Usage (from backend/):
+    python -m benchmarks.load_test [--openings N] [--sessions M] [--engine-latency MS]
+    python -m benchmarks.load_test --save-baseline  # record this machine's numbers
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import chess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_ENGINE = os.path.join(BACKEND_DIR, "tests", "fake_uci_engine.py")
+BASELINE_PATH = os.path.join(BACKEND_DIR, "benchmarks", "baselines.json")
+
+MAX_PLIES = 40 # Per micro-benchmark game
+
+FIRST_MOVES = {"white": ["e4", "d4", "c4", "Nf3"], "black": ["e4", "d4", "c4"]}
+
+# --- Synthetic Repertoire ---
+
+def random_line(rng: random.Random, first: str, plies: int) -> List[str]:
+    board = chess.Board()
+    sans = []
+    for ply in range(plies):
+        move = board.parse_san(first) if ply == 0 else rng.choice(sorted(board.legal_moves, key=lambda m: m.uci())[:5])
+        if board.is_game_over():
+            break
+        sans.append(board.san(move))
+        board.push(move)
+    return sans
+
+def movetext(sans: List[str]) -> str:
+    parts = []
+    for i, san in enumerate(sans):
+        parts.append(f"{i // 2 + 1}. {san}" if i % 2 == 0 else san)
+    return " ".join(parts)
+
+def opening_pgn(rng: random.Random, index: int, color: str, games: int = 3, plies: int = 14) -> str:
+    first = rng.choice(FIRST_MOVES[color])
+    texts = []
+    for game in range(games):
+        line = random_line(rng, first, plies)
+        # One side variation per game, branching off the mainline
+        branch = rng.randrange(2, len(line) - 1)
+        board = chess.Board()
+        for san in line[:branch]:
+            board.push_san(san)
+        alternatives = [board.san(m) for m in sorted(board.legal_moves, key=lambda m: m.uci()) if board.san(m) != line[branch]]
+        main_part = movetext(line[:branch + 1])
+        variation = f"{branch // 2 + 1}{'.' if branch % 2 == 0 else '...'} {rng.choice(alternatives)}"
+        rest = movetext(line)[len(main_part):]
+        headers = f'[Event "Bench {index} game {game}"]\n'
+        if color == "black":
+            headers += '[Color "Black"]\n'
+        texts.append(f"{headers}\n{main_part} ({variation}){rest} *\n")
+    return "\n".join(texts)
+
+def seed_openings(directory: str, count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, "openings"), exist_ok=True)
+    contents = []
+    for i in range(count):
+        color = "white" if i % 2 == 0 else "black"
+        content = opening_pgn(rng, i, color)
+        with open(os.path.join(directory, "openings", f"bench_opening_{i:04d}.pgn"), "w") as f:
+            f.write(content)
+        contents.append(content)
+    return contents
+
+# --- Measurements ---
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024 # bytes on macOS, KiB elsewhere
+
+class Timings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+def bench_add_opening(contents: List[str]) -> float:
+    """Mean ms to add one opening to a growing tree."""
+    from app import chess_logic
+    tree = chess_logic.OpeningTree()
+    started = time.perf_counter()
+    for i, content in enumerate(contents, 1):
+        tree.add_opening(i, content)
+    return (time.perf_counter() - started) / len(contents) * 1000
+
+def bench_process_user_move(contents: List[str], games: int, seed: int) -> Tuple[float, float]:
+    """p50/p95 µs of process_user_move while the game stays in theory (book replies, no engine)."""
+    from app import chess_logic, event_log
+    rng = random.Random(seed)
+    tree = chess_logic.OpeningTree()
+    colors = {}
+    for i, content in enumerate(contents, 1):
+        tree.add_opening(i, content)
+        colors[i] = "black" if '[Color "Black"]' in content else "white"
+    previous_tree, previous_log = chess_logic.GLOBAL_OPENING_TREE, event_log.EVENT_LOG
+    chess_logic.GLOBAL_OPENING_TREE = tree
+    event_log.EVENT_LOG = event_log.MoveEventLog(session_factory=None)
+    samples = []
+    try:
+        for game in range(games):
+            color = "white" if game % 2 == 0 else "black"
+            session = chess_logic.GameSession(game, list(colors), color, colors)
+            mask = session.learned_mask
+            # Repeated positions make the repertoire cyclic, so games are capped
+            while session.in_theory and session.current_node is not None and session.board.ply() < MAX_PLIES:
+                # Only moves the bot can answer from the book, so no engine search is timed
+                replies = [san for san, child in session.current_node.iter_children()
+                           if child.opening_mask & mask and any(reply.opening_mask & mask for reply in child.nodes)]
+                if not replies:
+                    break
+                started = time.perf_counter()
+                session.process_user_move(rng.choice(replies))
+                samples.append(time.perf_counter() - started)
+    finally:
+        chess_logic.GLOBAL_OPENING_TREE, event_log.EVENT_LOG = previous_tree, previous_log
+    return percentile(samples, 0.5) * 1e6, percentile(samples, 0.95) * 1e6
+
+# --- Load Test ---
+
+def play_game(client, timings: Timings, color: str, moves: int, theory_rate: float, rng: random.Random, color_masks: Dict[str, int]):
+    from app import chess_logic
+
+    def call(name, method, url, **kwargs):
+        started = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        timings.add(name, time.perf_counter() - started)
+        response.raise_for_status()
+        return response
+
+    openings = call("GET /openings", "get", "/openings").json()
+    if openings:
+        call("GET /openings/{id}/lesson", "get", f"/openings/{rng.choice(openings)['id']}/lesson")
+
+    start = call("POST /game/start", "post", "/game/start", json={"user_id": 1, "color": color}).json()
+    board = chess.Board(start["initial_fen"])
+    for _ in range(moves):
+        if board.is_game_over():
+            break
+        san = None
+        node = chess_logic.GLOBAL_OPENING_TREE.get_node(board)
+        if node is not None and rng.random() < theory_rate:
+            book = [s for s, child in node.iter_children() if child.opening_mask & color_masks[color]]
+            san = rng.choice(book) if book else None
+        if san is None:
+            san = board.san(rng.choice(sorted(board.legal_moves, key=lambda m: m.uci())))
+
+        started = time.perf_counter()
+        response = client.post("/game/move", json={"session_id": start["session_id"], "move_san": san})
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        result = response.json()
+        timings.add("POST /game/move (engine)" if result["engine_mode"] else "POST /game/move (book)", elapsed)
+        timings.add("POST /game/move", elapsed)
+        board = chess.Board(result["fen"])
+
+def run(args) -> Dict[str, float]:
+    workdir = tempfile.mkdtemp(prefix="chess-load-")
+    contents = seed_openings(workdir, args.openings, args.seed)
+    os.chdir(workdir) # The app keeps its database, PGNs and snapshot in the working directory
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["PRECOMPUTE_ENABLED"] = "1" if args.precompute else "0"
+    os.environ["PONDER_ENABLED"] = "1" if args.ponder else "0"
+    # Read at import: the scheduler admits as many searches as the pool has engines, as in production
+    os.environ["ENGINE_POOL_SIZE"] = str(args.engine_workers)
+
+    from fastapi.testclient import TestClient
+    from app import catalog, chess_logic, engine_cache, engine_pool, precompute, scheduler, tree_loader
+    import main
+
+    results: Dict[str, float] = {}
+    results["add_opening_ms"] = bench_add_opening(contents)
+    results["process_user_move_p50_us"], results["process_user_move_p95_us"] = bench_process_user_move(contents, args.micro_games, args.seed)
+
+    # The fake engine stands in for Stockfish; its latency plays the part of movetime
+    engine_pool.ENGINE_POOL = engine_pool.EnginePool(
+        [sys.executable, FAKE_ENGINE, "--latency", str(args.engine_latency)], size=args.engine_workers, health_interval=0,
+    )
+    engine_pool.ENGINE_POOL.start()
+
+    client = TestClient(main.app)
+    started = time.perf_counter()
+    client.__enter__()
+    results["startup_s"] = time.perf_counter() - started
+    try:
+        # Games are timed against the full tree, as before lazy loading
+        tree_loader.TREE_LOADER.wait(timeout=600)
+        results["warmup_s"] = time.perf_counter() - started
+        for op in catalog.OPENING_CATALOG.openings():
+            client.post(f"/openings/{op.id}/toggle_learn", params={"user_id": 1}).raise_for_status()
+        if args.precompute:
+            started = time.perf_counter()
+            precompute.PRECOMPUTER.wait_idle(timeout=600)
+            results["precompute_s"] = time.perf_counter() - started
+        colors = catalog.OPENING_CATALOG.colors()
+        color_masks = {c: chess_logic.ids_to_mask(i for i, oc in colors.items() if oc == c) for c in ("white", "black")}
+
+        timings = Timings()
+        rng = random.Random(args.seed)
+        plans = [("white" if i % 2 == 0 else "black", random.Random(rng.random())) for i in range(args.sessions * args.games)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            futures = [pool.submit(play_game, client, timings, color, args.moves, args.theory_rate, game_rng, color_masks)
+                       for color, game_rng in plans]
+            for future in futures:
+                future.result()
+        wall = time.perf_counter() - started
+        engine_stats = {**scheduler.ENGINE_SCHEDULER.stats(), "cache_hit_rate": engine_cache.ENGINE_CACHE.stats()["hit_rate"]}
+    finally:
+        client.__exit__(None, None, None)
+        engine_pool.shutdown_engine_pool()
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'endpoint':<28} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, samples in sorted(timings.samples.items()):
+        p50, p95, p99 = (percentile(samples, q) * 1000 for q in (0.5, 0.95, 0.99))
+        print(f"{name:<28} {len(samples):>7} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f}")
+        key = re.sub(r"[^a-z0-9]+", "_", name.split(" ", 1)[1].lower()).strip("_") # "POST /game/move (book)" -> game_move_book
+        results[f"{key}_p50_ms"], results[f"{key}_p95_ms"], results[f"{key}_p99_ms"] = p50, p95, p99
+
+    print("engine: " + ", ".join(f"{k}={engine_stats[k]}" for k in ("requests", "completed", "shed", "shrunk", "avg_wait_ms", "cache_hit_rate")))
+    results["engine_shed_rate"] = engine_stats["shed"] / engine_stats["requests"] if engine_stats["requests"] else 0.0
+
+    requests = sum(len(samples) for name, samples in timings.samples.items() if "(" not in name) # Book/engine split counted once
+    results["throughput_rps"] = requests / wall
+    results["moves_per_s"] = len(timings.samples.get("POST /game/move", [])) / wall
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+# --- Baselines ---
+
+def higher_is_better(metric: str) -> bool:
+    return metric.startswith("throughput") or metric.endswith("_per_s")
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    print(f"\n{'metric':<36} {'value':>12} {'baseline':>12} {'change':>8}")
+    for metric, value in sorted(results.items()):
+        base = baseline.get(metric)
+        if not base:
+            print(f"{metric:<36} {value:>12.3f} {'-':>12} {'':>8}")
+            continue
+        change = value / base - 1
+        worse = -change if higher_is_better(metric) else change
+        flag = ""
+        if worse > tolerance:
+            regressions.append(metric)
+            flag = "  REGRESSION"
+        print(f"{metric:<36} {value:>12.3f} {base:>12.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--openings", type=int, default=60)
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent games")
+    parser.add_argument("--games", type=int, default=2, help="Games played by each concurrent slot")
+    parser.add_argument("--moves", type=int, default=20, help="User moves per game")
+    parser.add_argument("--theory-rate", type=float, default=0.85, help="Chance a user move follows the repertoire")
+    parser.add_argument("--engine-latency", type=float, default=20, help="Fake engine ms per search")
+    parser.add_argument("--engine-workers", type=int, default=2)
+    parser.add_argument("--micro-games", type=int, default=400, help="Games for the process_user_move benchmark")
+    parser.add_argument("--precompute", action="store_true",
+                        help="Precompute theory exits before playing (off by default, so baselines time the search path)")
+    parser.add_argument("--ponder", action="store_true", help="Ponder during the trainee's turn (off by default, like --precompute)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed relative slowdown before a metric fails")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("metrics", {})
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "recorded": {
+                    "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                    "args": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline")},
+                },
+                "metrics": {k: round(v, 3) for k, v in sorted(results.items())},
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
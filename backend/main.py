@@ -1,20 +1,30 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, UploadFile, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List
 import os
 import glob
 import shutil
+import threading
 
-from app import models, schemas, database, chess_logic
-from app.routers import debug
+from app import models, schemas, database, catalog, chess_logic, engine_cache, engine_pool, event_log, importer, lessons, metrics, polyglot, ponder, precompute, search_budget, session_store, tree_loader
+from app.routers import debug, game_ws, monitoring, positions, stats
+
+log = metrics.get_logger("startup")
 
 # --- App Initialization ---
 
 app = FastAPI(title="Chess Opening Trainer API")
 
 app.include_router(debug.router)
+app.include_router(game_ws.router)
+app.include_router(monitoring.router)
+app.include_router(positions.router)
+app.include_router(stats.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,70 +33,102 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Create Tables
 models.Base.metadata.create_all(bind=database.engine)
 
-# Load Openings on Startup
-def load_openings_to_memory(db: Session):
-    print("Loading openings...")
-    openings = db.query(models.Opening).all()
-    count = 0
-    for op in openings:
-        if os.path.exists(op.pgn_path):
-            with open(op.pgn_path, "r") as f:
-                content = f.read()
-                chess_logic.GLOBAL_OPENING_TREE.add_opening(op.id, content)
-                count += 1
-    print(f"Loaded {count} openings into memory.")
-
-@app.on_event("startup")
-def startup_event():
-    # For V1, we can trigger a load. 
-    # In a real app, we might do this more carefully.
-    db = database.SessionLocal()
-    
+# Seed the catalog from openings/ on a fresh database
+def seed_catalog(db: Session):
     # SEED DATA (If empty) - For Prototype Convenience
     if db.query(models.User).count() == 0:
-        print("Seeding default user...")
+        log.info("Seeding default user...")
         default_user = models.User(name="Player 1", email="player@example.com")
         db.add(default_user)
         db.commit()
         db.refresh(default_user)
         
         # Check for our sample PGN
-        pgn_files = glob.glob("openings/*.pgn")
+        pgn_files = sorted(glob.glob("openings/*.pgn") + glob.glob("openings/*.bin")) # PGNs and Polyglot books
+        existing_names = {name for (name,) in db.query(models.Opening.name).all()}
+        new_openings = []
         for pgn_path in pgn_files:
-            name = os.path.basename(pgn_path).replace(".pgn", "").replace("_", " ").title()
+            name = os.path.splitext(os.path.basename(pgn_path))[0].replace("_", " ").title()
             
             # Check if exists
-            if db.query(models.Opening).filter(models.Opening.name == name).first():
+            if name in existing_names:
                 continue
+            existing_names.add(name)
 
-            print(f"Seeding opening: {name}")
+            log.info("Seeding opening: %s", name)
             
             # Detect Color
-            color = "white"
+            color = "white" # Polyglot books have no headers; they default to white
             try:
-                with open(pgn_path, "r") as f:
-                    content = f.read()
-                    if '[Color "Black"]' in content or '[Color "black"]' in content:
-                        color = "black"
+                if not pgn_path.endswith(".bin"):
+                    with open(pgn_path, "r") as f:
+                        content = f.read()
+                        if '[Color "Black"]' in content or '[Color "black"]' in content:
+                            color = "black"
             except:
                 pass
 
-            op = models.Opening(name=name, pgn_path=pgn_path, color=color)
-            db.add(op)
-            db.commit()
-            db.refresh(op)
+            new_openings.append(models.Opening(name=name, pgn_path=pgn_path, color=color))
             
             # Learn it (optional, maybe just add to DB and let user learn)
             # learned = models.LearnedOpening(user_id=default_user.id, opening_id=op.id)
-            # db.add(learned)
-            # db.commit()
-            
-    load_openings_to_memory(db)
-    db.close()
+
+        # One bulk insert and commit for the whole catalog
+        db.add_all(new_openings)
+        db.commit()
+
+def warm_up():
+    db = database.SessionLocal()
+    try:
+        seed_catalog(db)
+    except Exception as e:
+        log.error("Seeding failed: %s", e)
+    finally:
+        db.close()
+
+    try:
+        # Requests that need openings not loaded yet load (or wait for) just those
+        tree_loader.TREE_LOADER.load()
+
+        # Start the engine workers now so the first bot move doesn't pay for process startup.
+        try:
+            engine_pool.get_engine_pool()
+        except Exception as e:
+            log.error("Engine pool failed to start: %s", e)
+
+        # Engine replies for the positions where games leave theory, searched while the engine is idle
+        if precompute.PRECOMPUTE_ENABLED:
+            precompute.PRECOMPUTER.start()
+
+        # Lesson payloads for openings added or edited while the server was down
+        built = lessons.ensure_lessons(op.pgn_path for op in catalog.OPENING_CATALOG.openings())
+        if built:
+            log.info("Built %d lesson payloads.", built)
+    except Exception as e:
+        log.error("Warm-up failed: %s", e)
+
+@app.on_event("startup")
+def startup_event():
+    # The server answers at once; /health/ready and /health/live report the warm-up
+    tree_loader.TREE_LOADER.begin()
+    if tree_loader.TREE_LAZY_LOAD:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        warm_up()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    importer.IMPORT_JOBS.shutdown()
+    precompute.PRECOMPUTER.shutdown()
+    ponder.PONDERER.shutdown()
+    engine_pool.shutdown_engine_pool()
+    engine_cache.ENGINE_CACHE.close()
+    event_log.EVENT_LOG.close()
 
 class OpeningResponse(BaseModel):
     id: int
@@ -98,154 +140,230 @@ class OpeningResponse(BaseModel):
         from_attributes = True
 
 @app.get("/openings", response_model=List[OpeningResponse])
-def get_openings(user_id: int = 1, db: Session = Depends(database.get_db)):
-    # Get all openings
-    openings = db.query(models.Opening).all()
-    # Get learned IDs for this user
-    learned = db.query(models.LearnedOpening).filter(models.LearnedOpening.user_id == user_id).all()
-    learned_ids = {l.opening_id for l in learned}
-    
-    result = []
-    for op in openings:
-        result.append(OpeningResponse(id=op.id, name=op.name, color=op.color, is_learned=(op.id in learned_ids)))
-    return result
+def get_openings(request: Request, user_id: int = 1):
+    # Served from the in-memory catalog, pre-serialized and tagged by content
+    view = catalog.OPENING_CATALOG.user_view(user_id)
+    headers = {"ETag": view.etag, "Cache-Control": "no-cache"}
+    if catalog.etag_matches(request.headers.get("if-none-match"), view.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=view.body, media_type="application/json", headers=headers)
 
 @app.post("/openings/{opening_id}/toggle_learn")
-def toggle_learning(opening_id: int, user_id: int = 1, db: Session = Depends(database.get_db)):
-    existing = db.query(models.LearnedOpening).filter(
+async def toggle_learning(opening_id: int, user_id: int = 1, db: AsyncSession = Depends(database.get_async_db)):
+    existing = await db.scalar(select(models.LearnedOpening).where(
         models.LearnedOpening.user_id == user_id,
         models.LearnedOpening.opening_id == opening_id
-    ).first()
+    ))
     
     if existing:
-        db.delete(existing)
-        db.commit()
+        await db.delete(existing)
+        await db.commit()
+        catalog.OPENING_CATALOG.invalidate_user(user_id)
         return {"status": "unlearned"}
     else:
         new_entry = models.LearnedOpening(user_id=user_id, opening_id=opening_id)
         db.add(new_entry)
-        db.commit()
+        await db.commit()
+        catalog.OPENING_CATALOG.invalidate_user(user_id)
         return {"status": "learned"}
 
-class OpeningDetailResponse(OpeningResponse):
-    pgn: str
-
-@app.get("/openings/{opening_id}", response_model=OpeningDetailResponse)
-def get_opening_detail(opening_id: int, user_id: int = 1, db: Session = Depends(database.get_db)):
-    op = db.query(models.Opening).filter(models.Opening.id == opening_id).first()
+@app.get("/openings/{opening_id}", response_model=OpeningResponse)
+def get_opening_detail(opening_id: int, user_id: int = 1):
+    op = catalog.OPENING_CATALOG.get(opening_id)
     if not op:
         raise HTTPException(status_code=404, detail="Opening not found")
     
     # Check if learned
-    learned = db.query(models.LearnedOpening).filter(
-        models.LearnedOpening.user_id == user_id, 
-        models.LearnedOpening.opening_id == opening_id
-    ).first()
-    
-    pgn_content = ""
-    if os.path.exists(op.pgn_path):
-        with open(op.pgn_path, "r") as f:
-            pgn_content = f.read()
+    learned = opening_id in catalog.OPENING_CATALOG.learned_ids(user_id)
 
-    return OpeningDetailResponse(
+    return OpeningResponse(
         id=op.id, 
         name=op.name, 
         color=op.color,
         is_learned=bool(learned), 
-        pgn=pgn_content
     )
 
+@app.get("/openings/{opening_id}/lesson")
+def get_opening_lesson(opening_id: int, request: Request):
+    # Precomputed move lines with the FEN after every ply, kept gzipped in memory
+    op = catalog.OPENING_CATALOG.get(opening_id)
+    lesson = lessons.LESSON_CACHE.get(op.id, op.pgn_path) if op else None
+    if lesson is None:
+        raise HTTPException(status_code=404, detail="Opening not found")
+
+    headers = {"ETag": lesson.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if catalog.etag_matches(request.headers.get("if-none-match"), lesson.etag):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(content=lesson.gzip_body, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(content=lesson.body(), media_type="application/json", headers=headers)
+
+@app.get("/openings/{opening_id}/book.bin")
+def export_opening_book(opening_id: int):
+    # The opening's lines as a Polyglot book, weighted by how many lines play each move
+    op = catalog.OPENING_CATALOG.get(opening_id)
+    if op is None:
+        raise HTTPException(status_code=404, detail="Opening not found")
+    if not tree_loader.TREE_LOADER.ensure([op.id]):
+        raise HTTPException(status_code=503, detail="Openings are still loading, try again shortly.")
+    data = polyglot.book_bytes(chess_logic.GLOBAL_OPENING_TREE, 1 << op.id)
+    filename = os.path.splitext(os.path.basename(op.pgn_path))[0] + ".bin"
+    return Response(content=data, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @app.post("/admin/upload")
 def upload_pgn(file: UploadFile = File(...), db: Session = Depends(database.get_db)):
-    if not file.filename.endswith(".pgn"):
-        raise HTTPException(status_code=400, detail="Only .pgn files allowed")
+    if not file.filename.endswith((".pgn", ".bin")):
+        raise HTTPException(status_code=400, detail="Only .pgn files and Polyglot .bin books allowed")
     
     file_location = f"openings/{file.filename}"
+    upload_location = f"{file_location}.upload"
     
-    # Save file
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-        
-    # Read content for tree
-    with open(file_location, "r") as f:
-        content = f.read()
+    # Save file (streamed to disk in chunks, never held in memory)
+    with open(upload_location, "wb+") as file_object:
+        shutil.copyfileobj(file.file, file_object, 1 << 20)
 
     # Create DB Record
-    name = file.filename.replace(".pgn", "").replace("_", " ").title()
+    name = os.path.splitext(file.filename)[0].replace("_", " ").title()
     # Check duplicate
     existing = db.query(models.Opening).filter(models.Opening.name == name).first()
+    if existing and os.path.splitext(existing.pgn_path)[1] != os.path.splitext(file.filename)[1]:
+         os.remove(upload_location)
+         raise HTTPException(status_code=400, detail=f"Opening '{name}' exists as a different file type")
     if existing:
-         return {"message": f"Opening '{name}' updated (file overwritten)."}
+         # The job swaps the old lines for the new file's in one tree update
+         job_id = importer.IMPORT_JOBS.submit(existing.id, existing.pgn_path, upload_path=upload_location)
+         return {"message": f"Opening '{name}' updated (file overwritten).", "job_id": job_id}
     
+    os.replace(upload_location, file_location)
     new_op = models.Opening(name=name, pgn_path=file_location)
     db.add(new_op)
     db.commit()
     db.refresh(new_op)
+    catalog.OPENING_CATALOG.invalidate()
     
-    # Update Memory Tree
-    chess_logic.GLOBAL_OPENING_TREE.add_opening(new_op.id, content)
+    # Parse and add to the memory tree in the background
+    job_id = importer.IMPORT_JOBS.submit(new_op.id, file_location)
     
-    return {"message": f"Successfully uploaded '{name}'."}
+    return {"message": f"Importing '{name}'.", "job_id": job_id}
+
+@app.delete("/admin/openings/{opening_id}")
+def delete_opening(opening_id: int, db: Session = Depends(database.get_db)):
+    op = db.get(models.Opening, opening_id)
+    if not op:
+        raise HTTPException(status_code=404, detail="Opening not found")
+
+    # Tree first, so the ID can't be reused while the old lines are still in it.
+    # Running games keep the version they started on.
+    importer.remove_opening(op.id, op.pgn_path)
+
+    db.query(models.LearnedOpening).filter(models.LearnedOpening.opening_id == op.id).delete()
+    db.delete(op)
+    db.commit()
+    catalog.OPENING_CATALOG.invalidate()
+    lessons.LESSON_CACHE.invalidate(opening_id)
+    for path in (op.pgn_path, lessons.lesson_path(op.pgn_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    return {"message": f"Deleted '{op.name}'."}
+
+@app.get("/admin/imports/{job_id}", response_model=schemas.ImportJobStatus)
+def get_import_job(job_id: str, db: Session = Depends(database.get_db)):
+    job = db.get(models.ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return importer.job_status(job)
 
 # --- Endpoints ---
 
+def json_response(model: BaseModel) -> Response:
+    # Already validated; returning a Response skips FastAPI's second validation pass
+    return Response(content=model.model_dump_json(), media_type="application/json")
+
 @app.get("/")
 def read_root():
     return {"message": "Chess Opening Trainer API is running."}
 
+# The game endpoints are async: DB round trips are awaited on the event loop
+# instead of holding a threadpool slot. Work that can block for long (engine
+# searches, catalog loads) still goes to the threadpool.
+
+def new_game(session_id: int, user_id: int, request: schemas.GameStartRequest) -> chess_logic.GameSession:
+    # Learned IDs and opening colors come from the in-memory catalog
+    learned_ids = catalog.OPENING_CATALOG.learned_ids(user_id)
+    opening_colors = catalog.OPENING_CATALOG.colors()
+    # The game can only reach its learned openings of its color; wait for those alone
+    if not tree_loader.TREE_LOADER.ensure(oid for oid in learned_ids if opening_colors.get(oid) == request.color):
+        raise HTTPException(status_code=503, detail="Openings are still loading, try again shortly.")
+    return chess_logic.GameSession(session_id, learned_ids, request.color, opening_colors, user_id=user_id,
+                                   engine_level=request.engine_level, start_moves=request.moves)
+
 @app.post("/game/start", response_model=schemas.GameStartResponse)
-def start_game(request: schemas.GameStartRequest, db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.id == request.user_id).first()
+async def start_game(request: schemas.GameStartRequest, db: AsyncSession = Depends(database.get_async_db)):
+    user = await db.get(models.User, request.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # Get learned opening IDs
-    learned_ids = [lo.opening_id for lo in user.learned_openings]
-    
-    # Get colors for all openings
-    all_openings = db.query(models.Opening).all()
-    opening_colors = {op.id: op.color for op in all_openings}
+    if request.engine_level is not None and request.engine_level not in search_budget.LEVELS:
+        raise HTTPException(status_code=400, detail=f"Unknown engine level. Use one of: {', '.join(search_budget.LEVELS)}")
+    if request.moves:
+        try:
+            chess_logic.board_from_moves(request.moves)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid start moves: {e}")
 
     # Create Session Record
     db_session = models.Session(user_id=user.id)
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
+    session_id, user_id = db_session.id, user.id
+    # Hand the connection back before the session store takes one, or concurrent starts drain the pool
+    await db.close()
     
-    # Initialize Game Logic
-    game_session = chess_logic.GameSession(db_session.id, learned_ids, request.color, opening_colors)
-    chess_logic.ACTIVE_SESSIONS[db_session.id] = game_session
+    # Initialize Game Logic (the bot may open with an engine move)
+    game_session = await run_in_threadpool(new_game, session_id, user_id, request)
+    with metrics.span("session_store"):
+        await session_store.SESSION_STORE.put_async(game_session)
     
-    return schemas.GameStartResponse(
-        session_id=db_session.id,
-        initial_fen=game_session.board.fen(),
-        message=f"Game started as {request.color.title()}.",
-        color=request.color
-    )
+    with metrics.span("serialize"):
+        return json_response(schemas.GameStartResponse(
+            session_id=session_id,
+            initial_fen=game_session.board.fen(),
+            message=f"Game started as {request.color.title()}.",
+            color=request.color
+        ))
 
 @app.post("/game/move", response_model=schemas.MoveResponse)
-def play_move(request: schemas.MoveRequest, db: Session = Depends(database.get_db)):
+async def play_move(request: schemas.MoveRequest):
     session_id = request.session_id
     
-    if session_id not in chess_logic.ACTIVE_SESSIONS:
-        # Try to reload from DB? Not implemented for V1 state persistence yet.
+    with metrics.span("session_store"):
+        game = await session_store.SESSION_STORE.get_async(session_id)
+    if game is None:
         raise HTTPException(status_code=404, detail="Active game session not found (restart required).")
     
-    game = chess_logic.ACTIVE_SESSIONS[session_id]
+    result = game.apply_user_move(request.move_san)
+    if result["legal"]:
+        # Theory replies are a dict lookup; only engine searches leave the event loop
+        if game.has_book_reply:
+            reply = game.play_bot_reply(result["mistake_made"])
+        else:
+            reply = await run_in_threadpool(game.play_bot_reply, result["mistake_made"])
+        result = {**reply, "mistake_made": result["mistake_made"]}
+        with metrics.span("session_store"):
+            await session_store.SESSION_STORE.put_async(game)
     
-    result = game.process_user_move(request.move_san)
-    
-    if not result["legal"]:
-        # Don't update DB or state if illegal
-        return schemas.MoveResponse(
-            legal=False, in_theory=game.in_theory, engine_mode=game.engine_mode, 
-            remaining_openings_count=len(game.current_candidates),
-            message=result["message"], fen=game.board.fen()
-        )
-    
-    return schemas.MoveResponse(**result)
+    with metrics.span("serialize"):
+        if not result["legal"]:
+            # Don't update DB or state if illegal
+            return json_response(schemas.MoveResponse(
+                legal=False, in_theory=game.in_theory, engine_mode=game.engine_mode, 
+                remaining_openings_count=len(game.current_candidates),
+                message=result["message"], fen=game.board.fen()
+            ))
+        
+        return json_response(schemas.MoveResponse(**result))
 
 @app.get("/users", response_model=List[str])
-def list_users(db: Session = Depends(database.get_db)):
-    users = db.query(models.User).all()
+async def list_users(db: AsyncSession = Depends(database.get_async_db)):
+    users = (await db.scalars(select(models.User))).all()
     return [f"{u.id}: {u.name}" for u in users]
@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import engine_cache, event_log, models
+
+@pytest.fixture(autouse=True)
+def memory_event_log(monkeypatch):
+    """Keeps the move events games record in memory instead of the real database."""
+    log = event_log.MoveEventLog(session_factory=None)
+    monkeypatch.setattr(event_log, "EVENT_LOG", log)
+    return log
+
+@pytest.fixture(autouse=True)
+def memory_engine_cache(monkeypatch):
+    """Keeps engine replies games cache in memory instead of the real database."""
+    cache = engine_cache.EngineCache(session_factory=None)
+    monkeypatch.setattr(engine_cache, "ENGINE_CACHE", cache)
+    return cache
+
+@pytest.fixture
+def session_factory():
+    """A sessionmaker on a fresh in-memory database with every table, shared by all threads."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def catalog_db(session_factory):
+    """session_factory with two openings in the catalog, the black one learned by user 1."""
+    db = session_factory()
+    db.add_all([
+        models.Opening(id=1, name="Italian Game", color="white", pgn_path="openings/italian.pgn"),
+        models.Opening(id=2, name="French Defense", color="black", pgn_path="openings/french.pgn"),
+        models.LearnedOpening(user_id=1, opening_id=2),
+    ])
+    db.commit()
+    db.close()
+    return session_factory
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Minimal UCI engine used by the tests.
+
+Plays the first legal move (sorted by UCI string) so results are deterministic.
+`--latency MS` makes every search take that long, like a real engine's movetime.
+Usage: python fake_uci_engine.py [--crash-after N] [--latency MS]
+"""
+import sys
+import time
+
+import chess
+
+
+def main():
+    crash_after = None
+    if "--crash-after" in sys.argv:
+        crash_after = int(sys.argv[sys.argv.index("--crash-after") + 1])
+    latency = 0.0
+    if "--latency" in sys.argv:
+        latency = float(sys.argv[sys.argv.index("--latency") + 1]) / 1000
+
+    board = chess.Board()
+    searches = 0
+
+    def send(line: str):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+
+        if command == "uci":
+            send("id name FakeEngine")
+            send("id author tests")
+            send("option name Hash type spin default 16 min 1 max 1024")
+            send("option name Threads type spin default 1 min 1 max 64")
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            if tokens[1] == "startpos":
+                board = chess.Board()
+                rest = tokens[2:]
+            else:
+                board = chess.Board(" ".join(tokens[2:8]))
+                rest = tokens[8:]
+            if rest and rest[0] == "moves":
+                for uci in rest[1:]:
+                    board.push_uci(uci)
+        elif command == "go":
+            searches += 1
+            if crash_after is not None and searches > crash_after:
+                sys.exit(1)
+            if latency:
+                time.sleep(latency)
+            moves = sorted(board.legal_moves, key=lambda m: m.uci())
+            if moves:
+                send(f"info depth 1 score cp 0 nodes 1 pv {moves[0].uci()}")
+                send(f"bestmove {moves[0].uci()}")
+            else:
+                send("bestmove (none)")
+        elif command == "quit":
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import json
+
+from app import catalog, models
+
+def test_views_are_cached_until_invalidated(catalog_db):
+    SessionLocal = catalog_db
+    cat = catalog.OpeningCatalog(session_factory=SessionLocal, ttl=60)
+    view = cat.user_view(1)
+    assert json.loads(view.body) == [
+        {"id": 1, "name": "Italian Game", "color": "white", "is_learned": False},
+        {"id": 2, "name": "French Defense", "color": "black", "is_learned": True},
+    ]
+    assert cat.user_view(1) is view
+    assert cat.colors() == {1: "white", 2: "black"}
+    assert cat.get(2).pgn_path == "openings/french.pgn"
+    assert cat.stats()["loads"] == 1
+
+    db = SessionLocal()
+    db.add(models.LearnedOpening(user_id=1, opening_id=1))
+    db.commit()
+    assert cat.learned_ids(1) == {2} # Not invalidated yet
+    cat.invalidate_user(1)
+    learned = cat.user_view(1)
+    assert learned.learned_ids == {1, 2}
+    assert learned.etag != view.etag
+
+    db.add(models.Opening(id=3, name="Scotch Game", color="white", pgn_path=""))
+    db.commit()
+    db.close()
+    cat.invalidate()
+    assert len(cat.openings()) == 3
+    assert cat.user_view(1).etag != learned.etag
+
+def test_etags_are_shared_between_workers_and_expire(catalog_db):
+    SessionLocal = catalog_db
+    worker_a = catalog.OpeningCatalog(session_factory=SessionLocal, ttl=0)
+    worker_b = catalog.OpeningCatalog(session_factory=SessionLocal, ttl=0)
+    etag = worker_a.user_view(1).etag
+    assert worker_b.user_view(1).etag == etag
+
+    # Another worker's change shows up once the TTL passes
+    db = SessionLocal()
+    db.query(models.LearnedOpening).delete()
+    db.commit()
+    db.close()
+    assert worker_a.user_view(1).learned_ids == frozenset()
+
+def test_etag_matches():
+    assert catalog.etag_matches('"abc"', '"abc"')
+    assert catalog.etag_matches('W/"abc", "def"', '"abc"')
+    assert catalog.etag_matches("*", '"abc"')
+    assert not catalog.etag_matches('"def"', '"abc"')
+    assert not catalog.etag_matches(None, '"abc"')
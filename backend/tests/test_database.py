@@ -0,0 +1,62 @@
+import asyncio
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import chess_logic, database, event_log, models, session_store
+
+def test_pragmas(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sync.db'}")
+    event.listen(engine, "connect", database.set_sqlite_pragmas)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1 # NORMAL
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -database.SQLITE_CACHE_MB * 1024
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+    engine.dispose()
+
+    async def async_pragmas():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'async.db'}")
+        event.listen(async_engine.sync_engine, "connect", database.set_sqlite_pragmas)
+        async with async_engine.connect() as conn:
+            mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        await async_engine.dispose()
+        return mode
+
+    assert asyncio.run(async_pragmas()) == "wal"
+
+def test_async_session_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_log, "EVENT_LOG", event_log.MoveEventLog(session_factory=None))
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    chess_logic.GLOBAL_OPENING_TREE.add_opening(1, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 *')
+
+    path = tmp_path / "store.db"
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", database.set_sqlite_pragmas)
+    models.Base.metadata.create_all(bind=engine)
+
+    async def play():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        event.listen(async_engine.sync_engine, "connect", database.set_sqlite_pragmas)
+        backend = session_store.SQLiteSessionBackend(sessionmaker(bind=engine), async_sessionmaker(async_engine))
+        worker_a = session_store.SessionStore(backend)
+        worker_b = session_store.SessionStore(backend)
+        try:
+            game = chess_logic.GameSession(7, [1], "white", {1: "white"})
+            assert game.process_user_move("e4")["bot_move"] == "e5"
+            await worker_a.put_async(game)
+
+            # Written async, read back on another worker both ways
+            other = await worker_b.get_async(7)
+            assert other.board.move_stack == game.board.move_stack
+            assert worker_b.get(7) is other and worker_b.stats()["hits"] == 1
+            assert await worker_a.get_async(404) is None
+
+            await backend.purge_async(older_than=-1)
+            return await worker_a.get_async(7)
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(play()) is None
+    engine.dispose()
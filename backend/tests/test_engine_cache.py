@@ -0,0 +1,87 @@
+import chess
+import chess.engine
+from sqlalchemy import event
+
+from app import engine_cache, models
+
+def test_limit_key_is_stable():
+    assert engine_cache.limit_key(chess.engine.Limit(time=0.5)) == "time=0.5"
+    assert engine_cache.limit_key(chess.engine.Limit(depth=12, nodes=1000)) == "depth=12,nodes=1000"
+
+def test_lru_tier_counts_and_evicts():
+    cache = engine_cache.EngineCache(max_entries=2, session_factory=None)
+    limit = chess.engine.Limit(time=0.5)
+    boards = []
+    for san in ["e4", "d4", "c4"]:
+        board = chess.Board()
+        board.push_san(san)
+        boards.append(board)
+        cache.put(board, limit, chess.Move.from_uci("g8f6"))
+
+    assert cache.get(boards[0], limit) is None # evicted
+    assert cache.get(boards[2], limit) == chess.Move.from_uci("g8f6")
+    # Different search limit is a different entry.
+    assert cache.get(boards[2], chess.engine.Limit(depth=5)) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["evictions"] == 1
+
+def test_entries_survive_restart(session_factory):
+    limit = chess.engine.Limit(time=0.5)
+    board = chess.Board()
+    board.push_san("e4")
+
+    cache = engine_cache.EngineCache(session_factory=session_factory)
+    cache.put(board, limit, chess.Move.from_uci("c7c5"))
+    cache.close()
+    assert cache.stats()["writes"] == 1
+
+    # Same position reached with different move counters.
+    restarted = engine_cache.EngineCache(session_factory=session_factory)
+    transposed = chess.Board(board.fen().replace(" 0 1", " 0 7"))
+    assert restarted.get(transposed, limit) == chess.Move.from_uci("c7c5")
+    assert restarted.stats()["db_hits"] == 1
+    assert restarted.get(transposed, limit) == chess.Move.from_uci("c7c5")
+    assert restarted.stats()["hits"] == 1
+
+def test_db_tier_is_pruned(session_factory):
+    cache = engine_cache.EngineCache(session_factory=session_factory, max_db_rows=2)
+    limit = chess.engine.Limit(time=0.5)
+    for san in ["e4", "d4", "c4", "Nf3"]:
+        board = chess.Board()
+        board.push_san(san)
+        cache.put(board, limit, chess.Move.from_uci("g8f6"))
+        cache.flush()
+    cache.close()
+
+    db = session_factory()
+    assert db.query(models.EngineCacheEntry).count() == 2
+    db.close()
+
+def test_db_rows_are_not_counted_on_every_flush(session_factory):
+    counts = []
+    engine = session_factory.kw["bind"]
+
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        if "count(" in statement.lower():
+            counts.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    cache = engine_cache.EngineCache(session_factory=session_factory, max_db_rows=10)
+    limit = chess.engine.Limit(time=0.5)
+    board = chess.Board()
+    for move in list(board.legal_moves)[:12]:
+        board.push(move)
+        cache.put(board, limit, chess.Move.from_uci("g8f6"))
+        board.pop()
+        cache.flush()
+    cache.close()
+    event.remove(engine, "before_cursor_execute", count_statements)
+
+    # Counted once at the start and once when the 11th row passed the cap (cut to 9), then the 12th added
+    assert len(counts) == 2
+    db = session_factory()
+    assert db.query(models.EngineCacheEntry).count() == 10
+    db.close()
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import chess
+import chess.engine
+import pytest
+
+from app import engine_pool
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+@pytest.fixture
+def pool():
+    p = engine_pool.EnginePool(FAKE_ENGINE, size=2, health_interval=0)
+    p.start()
+    yield p
+    p.shutdown()
+
+def test_pool_reuses_workers(pool):
+    board = chess.Board()
+    for _ in range(4):
+        result = pool.play(board, chess.engine.Limit(time=0.01), game=1)
+        assert result.move == chess.Move.from_uci("a2a3")
+
+    statuses = pool.health_check()
+    assert len(statuses) == 2
+    assert sum(s["searches"] for s in statuses) == 4
+    assert all(s["restarts"] == 0 for s in statuses)
+
+def test_crashed_worker_is_restarted():
+    p = engine_pool.EnginePool(FAKE_ENGINE + ["--crash-after", "1"], size=1, health_interval=0)
+    p.start()
+    try:
+        board = chess.Board()
+        p.play(board, chess.engine.Limit(time=0.01))
+        # Second search kills the process; the pool restarts it and retries once.
+        result = p.play(board, chess.engine.Limit(time=0.01))
+        assert result.move is not None
+        assert p.workers[0].restarts == 1
+    finally:
+        p.shutdown()
+
+def test_health_check_restarts_dead_worker(pool):
+    pool.workers[0].engine.close()
+    statuses = pool.health_check()
+    assert statuses[0]["alive"] is True
+    assert statuses[0]["restarts"] == 1
+
+def test_shutdown_closes_workers(pool):
+    pool.shutdown()
+    assert all(w.engine is None for w in pool.workers)
+    with pytest.raises(RuntimeError):
+        with pool.acquire():
+            pass
+
+def test_fake_engine_latency():
+    p = engine_pool.EnginePool(FAKE_ENGINE + ["--latency", "50"], size=1, health_interval=0)
+    p.start()
+    try:
+        started = time.perf_counter()
+        assert p.play(chess.Board(), chess.engine.Limit(time=0.01)).move == chess.Move.from_uci("a2a3")
+        assert time.perf_counter() - started >= 0.05
+    finally:
+        p.shutdown()
+
+def test_missing_engine_is_remembered(monkeypatch):
+    searches = []
+    monkeypatch.setattr(engine_pool, "ENGINE_POOL", None)
+    monkeypatch.setattr(engine_pool, "_pool_failed", False)
+    monkeypatch.setattr(engine_pool, "find_engine_path", lambda: searches.append(1))
+    assert engine_pool.get_engine_pool() is None
+    assert engine_pool.get_engine_pool() is None
+    assert len(searches) == 1 # Not searched (or logged) again on the next move
+
+    # Restarting the pool looks again
+    engine_pool.shutdown_engine_pool()
+    assert engine_pool.get_engine_pool() is None and len(searches) == 2
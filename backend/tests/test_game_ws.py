@@ -0,0 +1,86 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import chess_logic, event_log, session_store
+from app.routers import game_ws
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(event_log, "EVENT_LOG", event_log.MoveEventLog(session_factory=None))
+    monkeypatch.setattr(session_store, "SESSION_STORE", session_store.SessionStore(session_store.MemorySessionBackend()))
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    monkeypatch.setattr(chess_logic, "get_engine_move", lambda fen, game=None, level=None: "a6")
+    chess_logic.GLOBAL_OPENING_TREE.add_opening(1, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 *')
+    chess_logic.GLOBAL_OPENING_TREE.add_opening(2, '[Event "Scotch"]\n\n1. e4 e5 2. Nf3 Nc6 3. d4 *')
+
+    session_store.SESSION_STORE.put(chess_logic.GameSession(5, [1, 2], "white", {1: "white", 2: "white"}))
+
+    app = FastAPI()
+    app.include_router(game_ws.router)
+    return TestClient(app)
+
+def test_moves_are_acked_and_replies_pushed(client):
+    with client.websocket_connect("/game/ws/5") as ws:
+        state = ws.receive_json()
+        assert state["ply"] == 0
+        assert state["ids"] == [1, 2]
+
+        ws.send_json({"t": "move", "san": "e4"})
+        assert ws.receive_json() == {"t": "ack", "ply": 1, "ok": True, "uci": "e2e4", "theory": True}
+        bot = ws.receive_json()
+        assert bot["san"] == "e5"
+        assert bot["uci"] == "e7e5"
+        assert "drop" not in bot # Still both openings
+
+        ws.send_json({"t": "move", "san": "Nc4"})
+        assert ws.receive_json()["ok"] == False
+
+        ws.send_json({"t": "move", "san": "Nf3"})
+        ws.receive_json()
+        assert ws.receive_json()["san"] == "Nc6"
+        ws.send_json({"t": "move", "san": "Bc4"})
+        ack = ws.receive_json()
+        assert ack["theory"] == True
+        bot = ws.receive_json()
+        assert bot["drop"] == [2]
+        assert bot["engine"] == True
+        assert bot["san"] == "a6"
+
+    # The game was saved after each reply
+    game = session_store.SESSION_STORE.get(5)
+    assert game.board.ply() == 6
+
+def test_bad_messages_and_unknown_sessions(client):
+    with client.websocket_connect("/game/ws/5") as ws:
+        ws.receive_json()
+        ws.send_text("not json")
+        assert ws.receive_json()["t"] == "error"
+        ws.send_json({"t": "move", "san": "Ke2e4"})
+        assert ws.receive_json() == {"t": "ack", "ok": False, "msg": "Illegal move format."}
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/game/ws/99") as ws:
+            ws.receive_json()
+
+def test_move_played_elsewhere_is_not_overwritten(client):
+    with client.websocket_connect("/game/ws/5") as ws:
+        ws.receive_json()
+
+        # Meanwhile the HTTP API (or another worker) plays 1. e4 e5
+        other = chess_logic.GameSession.from_record(session_store.SESSION_STORE.get(5).to_record())
+        other.process_user_move("e4")
+        session_store.SESSION_STORE.put(other)
+
+        # The socket's move was meant for the starting position: rejected, then resynced
+        ws.send_json({"t": "move", "san": "d4"})
+        assert ws.receive_json()["ok"] == False
+        state = ws.receive_json()
+        assert state["t"] == "state" and state["ply"] == 2
+
+        ws.send_json({"t": "move", "san": "Nf3"})
+        assert ws.receive_json()["ply"] == 3
+        assert ws.receive_json()["san"] == "Nc6"
+
+    assert [move.uci() for move in session_store.SESSION_STORE.get(5).board.move_stack] == ["e2e4", "e7e5", "g1f3", "b8c6"]
@@ -0,0 +1,85 @@
+import io
+import os
+
+from app import chess_logic, importer, lessons, models
+
+GAMES = (
+    '[Event "Main"]\n\n1. e4 e5 {A comment\n[not a tag]} 2. Nf3 *\n\n'
+    '[Event "Side"]\n[Site "?"]\n\n1. e4 c5 (1... e6 2. d4) 2. Nf3\n*\n\n'
+    '[Event "Broken"]\n\n1. e4 e5 2. Ke3 *\n\n'
+    '[Event "Last"]\n\n1. d4 d5 *\n'
+)
+
+def test_iter_game_texts():
+    texts = list(importer.iter_game_texts(io.StringIO(GAMES)))
+    assert len(texts) == 4
+    assert texts[0].startswith('[Event "Main"]') and "[not a tag]" in texts[0]
+    assert texts[1].startswith('[Event "Side"]\n[Site "?"]')
+
+def test_import_job(tmp_path, monkeypatch, session_factory):
+    SessionLocal = session_factory
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+
+    pgn_path = str(tmp_path / "dump.pgn")
+    with open(pgn_path, "w") as f:
+        f.write(GAMES * 5)
+
+    jobs = importer.ImportJobs(session_factory=SessionLocal, batch_games=3, parse_workers=1)
+    job_id = jobs.submit(4, pgn_path)
+    jobs.wait(job_id, timeout=30)
+
+    db = SessionLocal()
+    status = importer.job_status(db.get(models.ImportJob, job_id))
+    db.close()
+    assert status["status"] == "done"
+    assert status["progress"] == 1.0
+    assert status["games"] == 20
+    assert status["errors"] == 5
+    assert status["positions"] == 9 # Distinct positions, however often the games repeat them
+
+    tree = chess_logic.GLOBAL_OPENING_TREE
+    assert tree.root.child("e4").child("e6").child("d4").opening_ids == {4}
+    assert tree.root.child("e4").child("e5").weight == 10
+    assert tree.root.child("d4").child("d5") is not None
+    assert os.path.exists(lessons.lesson_path(pgn_path))
+    jobs.shutdown()
+
+def test_reupload(tmp_path, monkeypatch, session_factory):
+    SessionLocal = session_factory
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    jobs = importer.ImportJobs(session_factory=SessionLocal, batch_games=3, parse_workers=1)
+
+    pgn_path = str(tmp_path / "dump.pgn")
+    with open(pgn_path, "w") as f:
+        f.write(GAMES)
+    jobs.wait(jobs.submit(4, pgn_path), timeout=30)
+
+    def upload(text):
+        upload_path = pgn_path + ".upload"
+        with open(upload_path, "w") as f:
+            f.write(text)
+        job_id = jobs.submit(4, pgn_path, upload_path=upload_path)
+        jobs.wait(job_id, timeout=30)
+        db = SessionLocal()
+        status = importer.job_status(db.get(models.ImportJob, job_id))
+        db.close()
+        assert not os.path.exists(upload_path)
+        return status
+
+    # The new lines replace the old ones
+    assert upload('[Event "English"]\n\n1. c4 e5 *\n')["status"] == "done"
+    tree = chess_logic.GLOBAL_OPENING_TREE
+    assert tree.root.child("c4").child("e5").opening_ids == {4}
+    assert tree.root.child("e4") is None
+    assert open(pgn_path).read().startswith('[Event "English"]')
+
+    # An upload that fails to parse leaves the file and the tree as they were
+    def broken_batch(text):
+        raise ValueError("unreadable upload")
+
+    monkeypatch.setattr(importer, "parse_batch", broken_batch)
+    status = upload('[Event "Broken"]\n\n1. d4 *\n')
+    assert status["status"] == "failed"
+    assert chess_logic.GLOBAL_OPENING_TREE is tree
+    assert open(pgn_path).read().startswith('[Event "English"]')
+    jobs.shutdown()
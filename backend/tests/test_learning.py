@@ -0,0 +1,54 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import catalog, database, models
+
+def test_toggle_learn_and_unlearn(tmp_path, monkeypatch):
+    path = tmp_path / "learning.db"
+    engine = create_engine(f"sqlite:///{path}")
+    monkeypatch.setattr(database, "engine", engine) # main creates its tables on import
+    import main
+
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.add(models.Opening(id=1, name="Italian Game", color="white", pgn_path="openings/italian.pgn"))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(catalog, "OPENING_CATALOG", catalog.OpeningCatalog(session_factory=SessionLocal))
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as session:
+            yield session
+
+    monkeypatch.setitem(main.app.dependency_overrides, database.get_async_db, get_async_db)
+    client = TestClient(main.app) # Not entered: no startup warm-up
+
+    def learned():
+        db = SessionLocal()
+        try:
+            return [(row.user_id, row.opening_id) for row in db.query(models.LearnedOpening)]
+        finally:
+            db.close()
+
+    assert client.get("/openings/1").json()["is_learned"] is False
+    response = client.post("/openings/1/toggle_learn", params={"user_id": 1})
+    assert response.status_code == 200 and response.json() == {"status": "learned"}
+    assert learned() == [(1, 1)]
+    # The cached view is invalidated, not served stale
+    assert client.get("/openings/1").json()["is_learned"] is True
+
+    response = client.post("/openings/1/toggle_learn", params={"user_id": 1})
+    assert response.status_code == 200 and response.json() == {"status": "unlearned"}
+    assert learned() == []
+    assert client.get("/openings/1").json()["is_learned"] is False
+
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
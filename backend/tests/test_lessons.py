@@ -0,0 +1,66 @@
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+
+from app import lessons
+
+PGN = '[Event "Sicilian"]\n\n1. e4 (1. d4 d5) 1... c5 2. Nf3 (2. Nc3 Nc6 (2... e6)) 2... d6 *\n\n[Event "English"]\n\n1. c4 *'
+
+def test_build_lesson_lines():
+    lines = lessons.build_lesson(PGN)["lines"]
+    assert [(l["parent"], l["ply"], l["san"]) for l in lines] == [
+        (-1, 0, ["e4", "c5", "Nf3", "d6"]),
+        (0, 2, ["Nc3", "Nc6"]),
+        (1, 3, ["e6"]),
+        (0, 0, ["d4", "d5"]),
+        (-1, 0, ["c4"]),
+    ]
+    board = chess.Board()
+    for san, fen in zip(lines[0]["san"], lines[0]["fen"]):
+        board.push_san(san)
+        assert board.fen() == fen
+    assert lines[2]["fen"][0] == "rnbqkbnr/pp1p1ppp/4p3/2p5/4P3/2N5/PPPP1PPP/R1BQKBNR w KQkq - 0 3"
+
+def test_lesson_cache(tmp_path):
+    pgn_path = str(tmp_path / "sicilian.pgn")
+    with open(pgn_path, "w") as f:
+        f.write(PGN)
+    assert lessons.ensure_lessons([pgn_path, str(tmp_path / "missing.pgn")]) == 1
+    assert lessons.ensure_lessons([pgn_path]) == 0
+
+    cache = lessons.LessonCache()
+    lesson = cache.get(1, pgn_path)
+    assert json.loads(gzip.decompress(lesson.gzip_body)) == lessons.build_lesson(PGN)
+    assert cache.get(1, pgn_path) is lesson
+    assert cache.hits == 1
+
+    # Rewritten PGN: the stale lesson is rebuilt and gets a new ETag
+    with open(pgn_path, "w") as f:
+        f.write('[Event "French"]\n\n1. e4 e6 *')
+    stat = os.stat(lessons.lesson_path(pgn_path))
+    os.utime(pgn_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    os.utime(lessons.lesson_path(pgn_path), ns=(stat.st_atime_ns, stat.st_mtime_ns - 1))
+    updated = cache.get(1, pgn_path)
+    assert updated.etag != lesson.etag
+    assert json.loads(updated.body())["lines"][0]["san"] == ["e4", "e6"]
+
+    assert cache.get(2, str(tmp_path / "missing.pgn")) is None
+
+def test_concurrent_rebuilds(tmp_path):
+    # A request and the warm-up can rebuild one lesson at once; neither may fail
+    pgn_path = str(tmp_path / "sicilian.pgn")
+    with open(pgn_path, "w") as f:
+        f.write(PGN)
+
+    def rebuild():
+        for _ in range(20):
+            lessons.write_lesson(pgn_path)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for future in [pool.submit(rebuild) for _ in range(4)]:
+            future.result()
+    # No temp files left behind
+    assert sorted(os.listdir(tmp_path)) == sorted(["sicilian.pgn", os.path.basename(lessons.lesson_path(pgn_path))])
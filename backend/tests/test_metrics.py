@@ -0,0 +1,55 @@
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import chess_logic, event_log, metrics
+from app.routers import monitoring
+
+def test_histogram_render():
+    registry = metrics.MetricsRegistry()
+    histogram = registry.histogram("t_seconds", "Test.", buckets=(0.001, 0.01), span="x")
+    for value in (0.0005, 0.005, 0.005, 1.0):
+        histogram.observe(value)
+    assert registry.histogram("t_seconds", span="x") is histogram
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.99) == float("inf")
+    registry.counter("t_total", "Test.").inc(3)
+    registry.register_collector("t_cache", lambda: {"hits": 2, "hit_rate": 0.5, "name": "lru", "full": False})
+
+    text = registry.render()
+    assert '# TYPE t_seconds histogram' in text
+    assert 't_seconds_bucket{span="x",le="0.001"} 1' in text
+    assert 't_seconds_bucket{span="x",le="0.01"} 3' in text
+    assert 't_seconds_bucket{span="x",le="+Inf"} 4' in text
+    assert 't_seconds_count{span="x"} 4' in text
+    assert 't_total 3' in text
+    assert 't_cache_hits 2' in text and 't_cache_hit_rate 0.5' in text
+    assert "t_cache_name" not in text and "t_cache_full" not in text
+
+def test_sample_filter():
+    record = lambda level: logging.LogRecord("chess_trainer.game", level, __file__, 1, "msg", (), None)
+    assert not metrics.SampleFilter(0.0).filter(record(logging.DEBUG))
+    assert metrics.SampleFilter(0.0).filter(record(logging.WARNING))
+    assert metrics.SampleFilter(1.0).filter(record(logging.INFO))
+
+def test_move_spans_reach_the_endpoint(monkeypatch):
+    monkeypatch.setattr(event_log, "EVENT_LOG", event_log.MoveEventLog(session_factory=None))
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    chess_logic.GLOBAL_OPENING_TREE.add_opening(1, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 *')
+    before = metrics.span_histogram("candidate_update").count
+
+    session = chess_logic.GameSession(1, [1], "white", {1: "white"})
+    assert session.process_user_move("e4")["bot_move"] == "e5"
+    assert metrics.span_histogram("candidate_update").count == before + 1
+
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(monitoring.router)
+    client = TestClient(app)
+    client.get("/metrics")
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'chess_span_seconds_count{span="theory_lookup"}' in response.text
+    assert 'chess_http_request_seconds_count{method="GET",route="/metrics",status="200"}' in response.text
+    assert "chess_engine_scheduler_queue_depth" in response.text
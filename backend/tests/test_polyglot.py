@@ -0,0 +1,60 @@
+import chess
+import chess.polyglot
+
+from app import chess_logic, importer, lessons, polyglot
+
+REPERTOIRE = (
+    '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 *\n\n'
+    '[Event "Two Knights"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 *\n\n'
+    '[Event "Sicilian"]\n\n1. e4 c5 2. Nf3 d6 3. d4 cxd4 4. Nxd4 Nf6 5. Nc3 a6 6. f4 e5 7. Nf3 Nbd7 8. a4 Be7 9. Bd3 O-O *\n\n'
+    '[Event "Promotion"]\n\n1. a4 h5 2. a5 h4 3. a6 h3 4. axb7 hxg2 5. bxa8=Q gxh1=N *\n'
+)
+
+def test_book_round_trip(tmp_path):
+    tree = chess_logic.OpeningTree()
+    tree.add_opening(1, REPERTOIRE)
+    tree.add_opening(2, '[Event "Queen"]\n\n1. d4 d5 *')
+    path = str(tmp_path / "italian.bin")
+    polyglot.write_book(tree, path, mask=1 << 1)
+
+    # Any Polyglot reader can use the book; it only has the masked opening
+    with chess.polyglot.open_reader(path) as reader:
+        entries = list(reader.find_all(chess.Board()))
+        assert [(e.move.uci(), e.weight) for e in entries] == [("e2e4", 3), ("a2a4", 1)]
+        board = chess.Board()
+        for san in ["e4", "c5", "Nf3", "d6", "d4", "cxd4", "Nxd4", "Nf6", "Nc3", "a6", "f4", "e5", "Nf3", "Nbd7", "a4", "Be7", "Bd3"]:
+            board.push_san(san)
+        assert reader.find(board).move == board.parse_san("O-O")
+        for san in ["a4", "h5", "a5", "h4", "a6", "h3", "axb7", "hxg2"]:
+            board = chess.Board() if san == "a4" else board
+            board.push_san(san)
+        assert reader.find(board).move == board.parse_san("bxa8=Q")
+
+    # Reading it back gives the same lines and weights
+    records = polyglot.read_records(path)
+    rebuilt = chess_logic.OpeningTree()
+    rebuilt.add_records(5, records)
+    assert len(rebuilt) == len(tree) - 2 # Without 1. d4 d5
+    assert {san: node.weight for san, node in rebuilt.root.iter_children()} == {"e4": 3, "a4": 1}
+    italian = rebuilt.get_node(chess.Board("r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3"))
+    assert set(italian.moves) == {"Bc5", "Nf6"}
+
+    # Books are accepted wherever PGNs are
+    assert len(chess_logic.parse_repertoire_file(path)) == len(records)
+    [(batch, offset)] = list(importer.parse_file(path))
+    assert batch.records == records
+    lesson = lessons.build_lesson(polyglot.book_to_pgn(path))
+    assert lesson["lines"][0]["san"][:3] == ["e4", "e5", "Nf3"]
+
+def test_replies_follow_weights(monkeypatch):
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    chess_logic.GLOBAL_OPENING_TREE.add_records(1, [
+        chess_logic.MoveRecord(-1, "e4", chess_logic.position_key(chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")), (), None),
+        chess_logic.MoveRecord(0, "c5", 11, (), None, 99),
+        chess_logic.MoveRecord(0, "e5", 12, (), None, 1),
+    ])
+    replies = []
+    for _ in range(50):
+        session = chess_logic.GameSession(1, [1], "white", {1: "white"})
+        replies.append(session.process_user_move("e4")["bot_move"])
+    assert replies.count("c5") > 40
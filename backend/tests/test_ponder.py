@@ -0,0 +1,67 @@
+import os
+import sys
+
+import chess
+import pytest
+
+from app import chess_logic, engine_cache, engine_pool, ponder
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+@pytest.fixture
+def fake_engine(monkeypatch):
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    monkeypatch.setattr(engine_cache, "ENGINE_CACHE", engine_cache.EngineCache(session_factory=None))
+    pool = engine_pool.EnginePool(FAKE_ENGINE, size=1, health_interval=0)
+    pool.start()
+    monkeypatch.setattr(engine_pool, "ENGINE_POOL", pool)
+    yield pool
+    pool.shutdown()
+
+def engine_game(ponderer: ponder.Ponderer, session_id: int) -> chess_logic.GameSession:
+    # No learned openings: the first move leaves theory and the engine answers (the fake plays a7a5)
+    session = chess_logic.GameSession(session_id, [], "white", {})
+    assert session.process_user_move("e4")["bot_move"] == "a5"
+    job = ponderer._jobs.get(session_id)
+    assert job is not None and job.done.wait(10)
+    return session
+
+def test_predicted_move_is_a_cache_hit(fake_engine, monkeypatch):
+    ponderer = ponder.Ponderer(enabled=True)
+    monkeypatch.setattr(ponder, "PONDERER", ponderer)
+    session = engine_game(ponderer, 1)
+
+    # The fake engine's choice for white (a3) is the prediction; its reply is already cached
+    hits = engine_cache.ENGINE_CACHE.stats()["hits"]
+    assert session.process_user_move("a3")["bot_move"]
+    assert engine_cache.ENGINE_CACHE.stats()["hits"] == hits + 1
+    assert ponderer.stats()["hits"] == 1
+
+    # Anything else is a miss and searches as usual
+    ponderer._jobs[1].done.wait(10)
+    session.process_user_move("Nf3")
+    stats = ponderer.stats()
+    assert stats["misses"] == 1 and stats["started"] == 3
+    ponderer.shutdown()
+
+def test_caps(fake_engine, monkeypatch):
+    # Out of per-game time: no pondering at all
+    ponderer = ponder.Ponderer(enabled=True, session_seconds=0)
+    monkeypatch.setattr(ponder, "PONDERER", ponderer)
+    session = chess_logic.GameSession(2, [], "white", {})
+    session.process_user_move("e4")
+    assert ponderer.stats()["started"] == 0 and ponderer.stats()["skipped"] == 1
+
+    # Server-wide cap: a second game can't start while one is pondering
+    ponderer = ponder.Ponderer(enabled=True, max_searches=1)
+    ponderer._active = 1
+    ponderer.start(3, chess.Board())
+    assert ponderer.stats()["skipped"] == 1
+
+    # A new turn cancels the unfinished job of the last one
+    ponderer._active = 0
+    job = ponder._PonderJob(4)
+    ponderer._jobs[4] = job
+    ponderer.cancel(4)
+    assert job.cancelled.is_set() and ponderer.stats()["cancelled"] == 1
+    ponderer.shutdown()
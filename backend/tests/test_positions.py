@@ -0,0 +1,57 @@
+import chess
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import catalog, chess_logic
+from app.routers import positions
+
+def make_client(monkeypatch, session_factory) -> TestClient:
+    tree = chess_logic.OpeningTree()
+    tree.add_opening(1, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 *\n\n[Event "Italian 2"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *')
+    tree.add_opening(2, '[Event "French"]\n\n1. e4 e6 2. d4 d5 *')
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", tree)
+    monkeypatch.setattr(catalog, "OPENING_CATALOG", catalog.OpeningCatalog(session_factory=session_factory))
+    app = FastAPI()
+    app.include_router(positions.router)
+    return TestClient(app)
+
+def test_lookup_by_moves_and_fen(monkeypatch, catalog_db):
+    client = make_client(monkeypatch, catalog_db)
+
+    by_moves = client.get("/positions", params={"moves": "e4 e5 g1f3", "user_id": 1}).json()
+    assert by_moves["in_repertoire"] and by_moves["ply"] == 3
+    assert by_moves["line"] == ["e4", "e5", "Nf3"]
+    assert [o["name"] for o in by_moves["openings"]] == ["Italian Game"]
+    assert by_moves["next_moves"] == [{"san": "Nc6", "uci": "b8c6", "weight": 2, "opening_ids": [1]}]
+    assert by_moves["resume"] == {"color": "white", "moves": ["e4", "e5", "g1f3"], "trainee_to_move": False}
+
+    # Same position by FEN; the resume line comes from the tree
+    by_fen = client.get("/positions", params={"fen": by_moves["fen"]}).json()
+    assert by_fen["resume"]["moves"] == ["e4", "e5", "Nf3"]
+
+    # After 1. e4 both openings match; the learned one (French, black) picks the color
+    after_e4 = client.get("/positions", params={"moves": "e4", "user_id": 1}).json()
+    assert {o["id"]: o["is_learned"] for o in after_e4["openings"]} == {1: False, 2: True}
+    assert after_e4["resume"]["color"] == "black" and after_e4["resume"]["trainee_to_move"]
+
+    assert client.get("/positions", params={"moves": "d4"}).json() == {
+        "fen": "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR b KQkq - 0 1", "in_repertoire": False,
+        "ply": None, "line": [], "openings": [], "next_moves": [], "resume": None,
+    }
+    assert client.get("/positions", params={"moves": "e5"}).status_code == 400
+    assert client.get("/positions").status_code == 400
+
+def test_resume_a_drill(monkeypatch, catalog_db):
+    make_client(monkeypatch, catalog_db)
+    # White to move after 1. e4 e5 as white: the trainee plays Nf3 and the bot answers from theory
+    session = chess_logic.GameSession(1, [1], "white", {1: "white"}, start_moves=["e4", "e5"])
+    assert session.in_theory and session.board.ply() == 2
+    assert session.process_user_move("Nf3")["bot_move"] == "Nc6"
+
+    # Resumed on the bot's turn: it replies first
+    session = chess_logic.GameSession(2, [2], "black", {2: "black"}, start_moves=["e4", "e6"])
+    assert session.board.move_stack[-1] == chess.Move.from_uci("d2d4")
+
+    # Outside the repertoire the engine takes over straight away
+    session = chess_logic.GameSession(3, [1], "white", {1: "white"}, start_moves=["d4", "d5"])
+    assert not session.in_theory and session.engine_mode
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import chess
+
+from app import catalog, chess_logic, engine_cache, engine_pool, precompute, search_budget
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+def italian_tree() -> chess_logic.OpeningTree:
+    tree = chess_logic.OpeningTree()
+    tree.add_opening(1, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 *')
+    return tree
+
+def test_exit_positions():
+    tree = italian_tree()
+    exits = list(precompute.exit_positions(tree, {1: "white"}))
+    first_moves = [board.peek().uci() for board in exits[:19]]
+    assert len(first_moves) == 19 and "e2e4" not in first_moves # Every deviation from 1. e4
+    after_e5 = chess.Board()
+    for san in ("e4", "e5"):
+        after_e5.push_san(san)
+    assert len(exits) == 19 + after_e5.legal_moves.count() - 1 + 1 # ... from 2. Nf3, and the leaf itself
+    assert exits[-1].board_fen() == "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R"
+
+    # Played as black, the trainee's deviations come after the bot's moves instead
+    as_black = list(precompute.exit_positions(tree, {1: "black"}))
+    assert all(board.turn == chess.WHITE for board in as_black)
+    assert len(list(precompute.exit_positions(tree, {1: "white"}, max_positions=5))) == 5
+
+def test_precomputed_replies_are_cache_hits(monkeypatch):
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", italian_tree())
+    monkeypatch.setattr(engine_cache, "ENGINE_CACHE", engine_cache.EngineCache(session_factory=None))
+    monkeypatch.setattr(catalog.OPENING_CATALOG, "colors", lambda: {1: "white"})
+    pool = engine_pool.EnginePool(FAKE_ENGINE, size=1, health_interval=0)
+    pool.start()
+    monkeypatch.setattr(engine_pool, "ENGINE_POOL", pool)
+    job = precompute.Precomputer(max_positions=25, levels=[search_budget.ENGINE_LEVEL])
+    try:
+        job.start()
+        assert job.wait_idle()
+        stats = job.stats()
+        assert stats["runs"] == 1 and stats["positions"] == 25
+        assert stats["searched"] + stats["cached"] == 25
+
+        # Leaving theory on move one is answered from the cache
+        hits = engine_cache.ENGINE_CACHE.stats()["hits"]
+        session = chess_logic.GameSession(1, [1], "white", {1: "white"})
+        result = session.process_user_move("d4")
+        assert result["mistake_made"] and result["bot_move"]
+        assert engine_cache.ENGINE_CACHE.stats()["hits"] == hits + 1
+
+        # A newly published tree starts another run
+        chess_logic.publish_tree(italian_tree())
+        assert job.wait_idle()
+        assert job.stats()["runs"] == 2 and job.stats()["cached"] >= 25
+    finally:
+        job.shutdown()
+        pool.shutdown()
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from app import scheduler
+
+def test_round_robin_across_sessions():
+    sched = scheduler.EngineScheduler(max_concurrency=1, shrink_depth=100, max_queue_depth=100)
+    order = []
+    gate = threading.Event()
+
+    def blocker(budget):
+        gate.wait()
+
+    holder = threading.Thread(target=sched.run, args=("hold", blocker, 0.5, 5000))
+    holder.start()
+    time.sleep(0.05)
+
+    # Session "a" floods the queue before "b" asks once.
+    threads = []
+    for key in ["a", "a", "a", "b"]:
+        t = threading.Thread(target=sched.run, args=(key, lambda budget, k=key: order.append(k), 0.5, 5000))
+        t.start()
+        threads.append(t)
+        time.sleep(0.02)
+
+    assert sched.stats()["queue_depth"] == 4
+    gate.set()
+    for t in threads + [holder]:
+        t.join()
+
+    assert order[:2] == ["a", "b"]
+    assert sched.stats()["completed"] == 5
+
+def test_request_shed_after_deadline():
+    sched = scheduler.EngineScheduler(max_concurrency=1)
+    gate = threading.Event()
+    holder = threading.Thread(target=sched.run, args=("hold", lambda budget: gate.wait(), 0.5, 5000))
+    holder.start()
+    time.sleep(0.05)
+
+    assert sched.run("late", lambda budget: "move", 0.5, deadline_ms=50) is None
+    gate.set()
+    holder.join()
+    assert sched.stats()["shed"] == 1
+    assert sched.stats()["queue_depth"] == 0
+
+def test_budget_shrinks_before_shedding():
+    sched = scheduler.EngineScheduler(max_concurrency=1, shrink_depth=1, max_queue_depth=100, min_movetime=0.01)
+    budgets = []
+    gate = threading.Event()
+    holder = threading.Thread(target=sched.run, args=("hold", lambda budget: gate.wait(), 0.5, 5000))
+    holder.start()
+    time.sleep(0.05)
+
+    threads = [threading.Thread(target=sched.run, args=(i, budgets.append, 0.5, 5000)) for i in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads + [holder]:
+        t.join()
+
+    assert len(budgets) == 3
+    assert min(budgets) < 0.5
+    assert sched.stats()["shrunk"] >= 1
+    assert sched.stats()["shed"] == 0
+
+def test_short_budgets_are_not_shed_under_load():
+    sched = scheduler.EngineScheduler(max_concurrency=1, shrink_depth=1, max_queue_depth=100, min_movetime=0.05)
+    budgets = []
+    gate = threading.Event()
+    holder = threading.Thread(target=sched.run, args=("hold", lambda budget: gate.wait(), 0.1, 5000))
+    holder.start()
+    time.sleep(0.05)
+
+    threads = [threading.Thread(target=sched.run, args=(i, budgets.append, 0.1, 5000)) for i in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads + [holder]:
+        t.join()
+
+    # Shrunk to the floor, never below it and never shed
+    assert sorted(budgets)[0] == 0.05
+    assert sched.stats()["shed"] == 0
+
+def test_slots_follow_the_engine_pool():
+    pool_size = [None]
+    sched = scheduler.EngineScheduler(max_concurrency=4, pool_size=lambda: pool_size[0])
+    assert sched.stats()["max_concurrency"] == 4 # No pool yet
+
+    pool_size[0] = 2
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def search(budget):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    threads = [threading.Thread(target=sched.run, args=(key, search, 0.5, 5000)) for key in "abcd"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2 # Not four searches queueing for two engines
+    assert sched.stats()["max_concurrency"] == 2 and sched.stats()["completed"] == 4
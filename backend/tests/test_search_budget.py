@@ -0,0 +1,51 @@
+import os
+import sys
+
+import chess
+import chess.engine
+
+from app import chess_logic, engine_pool, search_budget
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+def test_levels_and_scaling():
+    club = search_budget.LEVELS["club"]
+    assert search_budget.budget_for("club") == search_budget.DEFAULT_BUDGET
+    assert search_budget.budget_for("master").limit() == chess.engine.Limit(time=0.5)
+    assert search_budget.budget_for("nonsense") == search_budget.DEFAULT_BUDGET
+
+    half = club.limit(0.5)
+    assert half.time == club.movetime / 2
+    assert half.nodes == club.nodes // 2
+    assert half.depth == club.depth
+
+def test_early_exits(monkeypatch):
+    # One legal move: played without asking the engine
+    monkeypatch.setattr(engine_pool, "get_engine_pool", lambda: None)
+    board = chess.Board("7k/8/8/8/8/8/6q1/7K w - - 0 1")
+    assert chess_logic.get_engine_move(board.fen()) == "Kxg2"
+
+    score = lambda cp, depth: {"score": chess.engine.PovScore(chess.engine.Cp(cp), chess.WHITE), "depth": depth}
+    assert not search_budget.is_decisive(score(900, 2)) # Too shallow to trust
+    assert search_budget.is_decisive(score(-900, 8))
+    assert not search_budget.is_decisive(score(100, 20))
+    assert search_budget.is_decisive({"score": chess.engine.PovScore(chess.engine.Mate(3), chess.BLACK), "depth": 1})
+    # Only long searches are watched for an early stop
+    assert search_budget.stop_condition(search_budget.LEVELS["master"].movetime) is search_budget.is_decisive
+    assert search_budget.stop_condition(search_budget.LEVELS["beginner"].movetime) is None
+
+def test_pool_stops_on_condition():
+    pool = engine_pool.EnginePool(FAKE_ENGINE, size=1, health_interval=0)
+    pool.start()
+    try:
+        seen = []
+        def stop_when(info):
+            seen.append(info.get("depth"))
+            return True
+        result = pool.play(chess.Board(), search_budget.LEVELS["club"].limit(), game=1, stop_when=stop_when)
+        assert result.move == chess.Move.from_uci("a2a3")
+        assert seen == [1]
+        # The worker is still usable after a stopped search
+        assert pool.play(chess.Board(), chess.engine.Limit(time=0.01)).move is not None
+    finally:
+        pool.shutdown()
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+
+from app import chess_logic, event_log, session_store
+
+@pytest.fixture
+def backend(monkeypatch, session_factory):
+    monkeypatch.setattr(event_log, "EVENT_LOG", event_log.MoveEventLog(session_factory=None))
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    chess_logic.GLOBAL_OPENING_TREE.add_opening(1, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 *')
+    return session_store.SQLiteSessionBackend(session_factory)
+
+def test_session_moves_between_workers(backend):
+    worker_a = session_store.SessionStore(backend)
+    worker_b = session_store.SessionStore(backend)
+
+    game = chess_logic.GameSession(7, [1], "white", {1: "white"}, user_id=3)
+    worker_a.put(game)
+    assert game.process_user_move("e4")["bot_move"] == "e5"
+    worker_a.put(game)
+
+    # The next request lands on another worker
+    other = worker_b.get(7)
+    assert other is not game
+    assert other.board.fen() == game.board.fen()
+    assert other.in_theory and other.current_node is game.current_node
+    assert other.learned_opening_ids == {1}
+    assert other.process_user_move("Nf3")["bot_move"] == "Nc6"
+    worker_b.put(other)
+    assert worker_b.get(7) is other
+    assert worker_b.stats()["hits"] == 1
+
+    # Worker A's local copy is stale and gets rebuilt from the shared record
+    again = worker_a.get(7)
+    assert again is not game
+    assert again.board.move_stack == other.board.move_stack
+    assert worker_a.get(404) is None
+
+def test_local_tier_is_bounded(backend):
+    store = session_store.SessionStore(backend, max_local=2)
+    for session_id in range(5):
+        store.put(chess_logic.GameSession(session_id, [1], "white", {1: "white"}))
+    assert store.stats()["local_sessions"] == 2
+    assert store.stats()["evictions"] == 3
+
+    # Evicted sessions are still playable
+    assert store.get(0).board.fen() == chess_logic.chess.STARTING_FEN
+    store.delete(0)
+    assert store.get(0) is None
+
+def test_local_tier_memory_budget(backend):
+    # Room for three new games
+    budget = 3 * session_store.session_size(chess_logic.GameSession(0, [1], "white", {1: "white"}))
+    store = session_store.SessionStore(backend, max_bytes=budget)
+    for session_id in range(3):
+        store.put(chess_logic.GameSession(session_id, [1], "white", {1: "white"}))
+    assert store.stats()["local_sessions"] == 3 and store.stats()["local_bytes"] == budget
+
+    game = store.get(2)
+    assert game.process_user_move("e4")["bot_move"] == "e5"
+    store.put(game)
+    # The longer game pushed out the least recently used one
+    assert store.stats()["local_sessions"] == 2 and store.stats()["evictions"] == 1
+    assert store.stats()["local_bytes"] <= budget
+
+def test_stale_save_is_refused(backend):
+    store = session_store.SessionStore(session_store.MemorySessionBackend())
+    store.put(chess_logic.GameSession(8, [1], "white", {1: "white"}))
+    game = store.get(8)
+    other = chess_logic.GameSession.from_record(game.to_record())
+    other.process_user_move("e4")
+    store.put(other)
+
+    game.process_user_move("d4")
+    assert asyncio.run(store.put_async(game, expected_ply=0)) is False
+    assert store.get(8).board.ply() == 2
+    assert store.get(8) is not game
+    assert asyncio.run(store.put_async(store.get(8), expected_ply=2)) is True
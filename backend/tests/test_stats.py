@@ -0,0 +1,58 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import chess_logic, database, event_log, models
+from app.routers import stats
+
+@pytest.fixture
+def client(monkeypatch, session_factory):
+    SessionLocal = session_factory
+
+    db = SessionLocal()
+    db.add(models.Opening(id=10, name="Italian Game", color="white", pgn_path=""))
+    db.commit()
+    db.close()
+
+    monkeypatch.setattr(event_log, "EVENT_LOG", event_log.MoveEventLog(session_factory=SessionLocal, flush_interval=60))
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    chess_logic.GLOBAL_OPENING_TREE.add_opening(10, '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 *')
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(stats.router)
+    app.dependency_overrides[database.get_db] = get_db
+    return TestClient(app)
+
+def play(moves, session_id):
+    session = chess_logic.GameSession(session_id, [10], "white", {10: "white"}, user_id=1)
+    for move in moves:
+        session.process_user_move(move)
+
+def test_events_are_buffered_and_aggregated(client):
+    play(["e4", "Nf3", "Bc4"], 1)
+    play(["e4", "d4"], 2) # Mistake at ply 2
+    play(["e4", "Bc4"], 3) # Mistake at ply 2
+    assert event_log.EVENT_LOG.written == 0 # Still in memory
+
+    heatmap = client.get("/stats/mistakes").json()
+    assert event_log.EVENT_LOG.written == 7
+    assert heatmap[0]["name"] == "Italian Game"
+    by_ply = {p["ply"]: p for p in heatmap[0]["plies"]}
+    assert by_ply[0] == {"ply": 0, "attempts": 3, "mistakes": 0, "mistake_rate": 0.0}
+    assert by_ply[2]["mistakes"] == 2
+    assert by_ply[2]["attempts"] == 3
+
+    hardest = client.get("/stats/hardest_positions", params={"min_attempts": 2}).json()
+    assert hardest[0]["expected_moves"] == ["Nf3"]
+    assert hardest[0]["mistake_rate"] == round(2 / 3, 4)
+
+    accuracy = client.get("/stats/accuracy").json()
+    assert accuracy[0]["theory_moves"] == 5
+    assert accuracy[0]["mistakes"] == 2
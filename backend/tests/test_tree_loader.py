@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import chess_logic, models, tree_loader, tree_snapshot
+from app.routers import monitoring
+
+LINES = {
+    1: '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 *',
+    2: '[Event "Queens Gambit"]\n\n1. d4 d5 2. c4 *',
+    3: '[Event "English"]\n\n1. c4 e5 2. Nc3 *',
+}
+
+@pytest.fixture
+def openings_db(tmp_path, session_factory):
+    db = session_factory()
+    for opening_id, pgn in LINES.items():
+        path = tmp_path / f"opening_{opening_id}.pgn"
+        path.write_text(pgn)
+        db.add(models.Opening(id=opening_id, name=f"Opening {opening_id}", color="white", pgn_path=str(path)))
+    db.add(models.LearnedOpening(user_id=1, opening_id=3)) # Learned openings are warmed up first
+    db.commit()
+    db.close()
+    return session_factory
+
+def make_loader(tmp_path, monkeypatch, session_factory) -> tree_loader.TreeLoader:
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.OpeningTree())
+    return tree_loader.TreeLoader(session_factory=session_factory, snapshot_path=str(tmp_path / "tree.snapshot"),
+                                  batch=1, workers=1)
+
+def in_tree(moves: str) -> bool:
+    return chess_logic.GLOBAL_OPENING_TREE.get_node(chess_logic.board_from_moves(moves.split())) is not None
+
+def test_requests_load_their_openings_first(tmp_path, monkeypatch, openings_db):
+    loader = make_loader(tmp_path, monkeypatch, openings_db)
+
+    # Hold the warm-up inside its first opening (the learned one)
+    entered, gate = threading.Event(), threading.Event()
+    parse = tree_loader.parse_source
+
+    def gated_parse(path):
+        if path.endswith("opening_3.pgn"):
+            entered.set()
+            gate.wait(10)
+        return parse(path)
+
+    monkeypatch.setattr(tree_loader, "parse_source", gated_parse)
+    loader.begin()
+    assert not loader.ready and not loader.is_loaded([2])
+    warm_up = threading.Thread(target=loader.load)
+    warm_up.start()
+    assert entered.wait(10)
+
+    # Not claimed by the warm-up yet: loaded on this thread, without waiting for the rest
+    assert loader.ensure([2])
+    assert in_tree("d4 d5 c4") and not in_tree("c4 e5")
+    # Being loaded by the warm-up: waited for
+    assert not loader.ensure([3], timeout=0.05)
+    assert loader.stats()["on_demand"] == 1 and loader.stats()["stage"] == "loading"
+
+    gate.set()
+    assert loader.wait(10)
+    warm_up.join(10)
+    stats = loader.stats()
+    assert stats["stage"] == "ready" and stats["source"] == "pgn"
+    assert stats["openings_loaded"] == stats["openings_total"] == 3 and stats["progress"] == 1.0
+    assert in_tree("e4 e5 Nf3 Nc6 Bc4") and in_tree("c4 e5 Nc3")
+
+    # The finished tree was written to the snapshot, which the next start maps in one step
+    assert isinstance(chess_logic.GLOBAL_OPENING_TREE, tree_snapshot.SnapshotTree)
+    restarted = make_loader(tmp_path, monkeypatch, openings_db)
+    restarted.load()
+    assert restarted.stats()["source"] == "snapshot" and in_tree("d4 d5 c4")
+
+    # A loader that was never started (scripts, tests) doesn't hold anyone up
+    assert tree_loader.TreeLoader().ensure([1]) and tree_loader.TreeLoader().wait(0)
+
+def test_health(tmp_path, monkeypatch, openings_db):
+    loader = make_loader(tmp_path, monkeypatch, openings_db)
+    monkeypatch.setattr(tree_loader, "TREE_LOADER", loader)
+    app = FastAPI()
+    app.include_router(monitoring.router)
+    client = TestClient(app)
+
+    loader.begin()
+    assert client.get("/health/live").status_code == 200
+    response = client.get("/health/ready")
+    assert response.status_code == 503 and response.json()["stage"] == "starting"
+
+    loader.load()
+    response = client.get("/health/ready")
+    assert response.status_code == 200 and response.json()["positions"] == len(chess_logic.GLOBAL_OPENING_TREE)
+
+    # A failed warm-up fails liveness, so the process is restarted
+    def broken_session():
+        raise RuntimeError("database is locked")
+
+    failed = tree_loader.TreeLoader(session_factory=broken_session)
+    monkeypatch.setattr(tree_loader, "TREE_LOADER", failed)
+    failed.load()
+    assert client.get("/health/live").status_code == 503
+    assert client.get("/health/ready").json()["error"] == "database is locked"
+    assert not failed.ensure([1])
+
+def test_a_failed_opening_is_left_out_and_retried(tmp_path, monkeypatch, openings_db):
+    loader = make_loader(tmp_path, monkeypatch, openings_db)
+    loader.retry_interval = 0
+    add_records = chess_logic.TreeEdit.add_records
+
+    def broken_add(edit, opening_id, records):
+        if opening_id == 1:
+            raise ValueError("bad line")
+        add_records(edit, opening_id, records)
+
+    monkeypatch.setattr(chess_logic.TreeEdit, "add_records", broken_add)
+    loader.load()
+    stats = loader.stats()
+    assert stats["stage"] == "ready" and stats["error"] is None
+    assert stats["failed"] == 1 and stats["failed_openings"] == [1]
+    assert in_tree("d4 d5 c4") and in_tree("c4 e5 Nc3") and not in_tree("e4 e5")
+    assert loader.ensure([2]) and loader.wait(0)
+    # Not written to the snapshot, which would hide the opening until its file changes
+    assert not (tmp_path / "tree.snapshot").exists()
+
+    # The next request that needs it tries again
+    monkeypatch.setattr(chess_logic.TreeEdit, "add_records", add_records)
+    assert loader.ensure([1])
+    assert in_tree("e4 e5 Nf3 Nc6 Bc4") and in_tree("d4 d5 c4")
+    assert loader.stats()["failed_openings"] == [] and loader.stats()["openings_loaded"] == 3
@@ -0,0 +1,99 @@
+import pytest
+
+from app import chess_logic, tree_snapshot
+
+PGN = (
+    '[Event "Sicilian"]\n\n1. e4 c5 2. Nf3 (2. Nc3 {Closed} Nc6) 2... d6 $1 *\n\n'
+    '[Event "Transposed"]\n\n1. Nf3 c5 2. e4 d6 3. d4 *'
+)
+
+@pytest.fixture
+def tree():
+    t = chess_logic.OpeningTree()
+    t.add_opening(3, PGN)
+    t.add_opening(200, '[Event "French"]\n\n1. e4 e6 *')
+    return t
+
+def test_snapshot_round_trip(tree, tmp_path):
+    path = str(tmp_path / "tree.snapshot")
+    tree_snapshot.write_snapshot(tree, path, "ab" * 32)
+    snap = tree_snapshot.open_snapshot(path, "ab" * 32)
+
+    assert len(snap) == len(tree)
+    for key, node in tree.nodes_by_hash.items():
+        view = snap.nodes_by_hash[key]
+        assert view.opening_mask == node.opening_mask
+        assert view.moves == node.moves
+        assert view.weight == node.weight
+        assert view.nags == node.nags
+        assert view.comment == node.comment
+        assert view.fen == node.fen
+
+    closed = snap.root.child("e4").child("c5").child("Nc3")
+    assert closed.comment == "Closed"
+    assert snap.root.opening_ids == {3, 200}
+    assert snap.nodes_by_hash.get(12345) is None
+
+    thawed = snap.thaw()
+    assert thawed.root.child("e4").child("c5").child("Nf3").child("d6").nags == {1}
+    assert len(thawed) == len(tree)
+    snap.close()
+
+def test_stale_or_corrupt_snapshot_is_ignored(tree, tmp_path):
+    path = str(tmp_path / "tree.snapshot")
+    tree_snapshot.write_snapshot(tree, path, "ab" * 32)
+    assert tree_snapshot.open_snapshot(path, "cd" * 32) is None
+
+    with open(path, "r+b") as f:
+        f.truncate(200)
+    assert tree_snapshot.open_snapshot(path, "ab" * 32) is None
+    assert tree_snapshot.open_snapshot(str(tmp_path / "missing"), "ab" * 32) is None
+
+def test_corrupt_body_is_caught_on_read(tree, tmp_path):
+    # Header and source hash intact, but an edge points past the last node
+    path = str(tmp_path / "tree.snapshot")
+    tree_snapshot.write_snapshot(tree, path, "ab" * 32)
+    snap = tree_snapshot.open_snapshot(path, "ab" * 32)
+    edge_child = tree_snapshot._HEADER.size + tree_snapshot._SECTION_ENTRY.size * [name for name, _ in tree_snapshot._SECTIONS].index("edge_child")
+    offset, count = tree_snapshot._SECTION_ENTRY.unpack_from(snap._buf, edge_child)
+    snap.close()
+    assert count > 0
+
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write((999999).to_bytes(4, "little"))
+
+    # Opening doesn't scan the body; the read that follows the bad edge fails
+    snap = tree_snapshot.open_snapshot(path, "ab" * 32)
+    with pytest.raises(tree_snapshot.SnapshotError):
+        for node in list(snap.nodes_by_hash.values()):
+            node.nodes
+    with pytest.raises(tree_snapshot.SnapshotError):
+        snap.verify()
+    snap.close()
+
+    with pytest.raises(tree_snapshot.SnapshotError):
+        tree_snapshot.SnapshotTree(path, verify=True)
+
+def test_source_hash_follows_file_metadata(tmp_path):
+    pgn = tmp_path / "italian.pgn"
+    pgn.write_text('[Event "Italian"]\n\n1. e4 e5 *')
+    first = tree_snapshot.hash_sources([(1, str(pgn))])
+    assert tree_snapshot.hash_sources([(1, str(pgn))]) == first
+    assert tree_snapshot.hash_sources([(2, str(pgn))]) != first
+
+    pgn.write_text('[Event "Italian"]\n\n1. e4 e5 2. Nf3 *')
+    assert tree_snapshot.hash_sources([(1, str(pgn))]) != first
+
+def test_game_session_on_snapshot(tree, tmp_path, monkeypatch):
+    path = str(tmp_path / "tree.snapshot")
+    tree_snapshot.write_snapshot(tree, path, "ab" * 32)
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", tree_snapshot.open_snapshot(path, "ab" * 32))
+
+    session = chess_logic.GameSession(1, [3], "white", {3: "white"})
+    result = session.process_user_move("Nf3")
+    assert result["bot_move"] == "c5"
+    # Transposes into the mainline via 2. e4
+    result = session.process_user_move("e4")
+    assert result["in_theory"] == True
+    assert result["bot_move"] == "d6"
@@ -0,0 +1,167 @@
+import chess
+
+from app import chess_logic
+from app.chess_logic import OpeningTree, TreeEdit, parse_repertoire
+
+OPENINGS = {
+    1: '[Event "Queen\'s Gambit"]\n\n1. d4 d5 2. c4 e6 3. Nc3 Nf6 *',
+    2: '[Event "English"]\n\n1. c4 e6 2. Nc3 d5 3. d4 c6 *', # Transposes into 1 after 3. d4
+    3: '[Event "Italian"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 (3. Bb5 a6) *',
+    4: '[Event "Scotch"]\n\n1. e4 e5 2. Nf3 Nc6 3. d4 *',
+}
+
+def build(ids):
+    tree = OpeningTree()
+    for opening_id in ids:
+        tree.add_opening(opening_id, OPENINGS[opening_id])
+    return tree
+
+def shape(tree):
+    """Everything observable about a version, by position key; also checks it is self-consistent."""
+    result = {}
+    for key, node in tree.nodes_by_hash.items():
+        for _, child in node.iter_children():
+            assert tree.nodes_by_hash[child.key] is child
+        result[key] = (node.opening_mask, node.weight, sorted((san, child.key) for san, child in node.iter_children()))
+    assert tree.nodes_by_hash[tree.root.key] is tree.root
+    return result
+
+def test_add_and_remove_match_a_fresh_build():
+    base = build([1, 3])
+    before = shape(base)
+
+    edit = TreeEdit(base)
+    edit.add_records(2, parse_repertoire(OPENINGS[2]))
+    edit.add_records(4, parse_repertoire(OPENINGS[4]))
+    added = edit.commit()
+    assert shape(added) == shape(build([1, 3, 2, 4]))
+    assert shape(base) == before # The published version never changes
+    # Untouched subtrees are shared, not copied
+    line = ["d4", "d5", "c4", "e6", "Nc3", "Nf6"]
+    old_node, new_node = base.root, added.root
+    for san in line:
+        old_node, new_node = old_node.child(san), new_node.child(san)
+    assert new_node is old_node
+
+    edit = TreeEdit(added)
+    edit.subtract_records(parse_repertoire(OPENINGS[1]))
+    edit.remove_opening(1)
+    edit.subtract_records(parse_repertoire(OPENINGS[3]))
+    edit.remove_opening(3)
+    removed = edit.commit()
+    assert shape(removed) == shape(build([2, 4]))
+    assert removed.root.child("d4") is None
+    # The transposed position now hangs off the English move order only
+    node = removed.root.child("c4").child("e6").child("Nc3").child("d5").child("d4")
+    assert node.fen == "rnbqkbnr/ppp2ppp/4p3/3p4/2PP4/2N5/PP2PPPP/R1BQKBNR b KQkq - 0 3"
+    assert len(shape(added)) == len(added)
+
+def wide_tree():
+    """Openings 1-3, plus every first move and reply (about 400 positions) as opening 5."""
+    tree = build([1, 2, 3])
+    board = chess.Board()
+    games = []
+    for move in list(board.legal_moves):
+        first = board.san(move)
+        board.push(move)
+        games += [f'[Event "Wide"]\n\n1. {first} {board.san(reply)} *' for reply in board.legal_moves]
+        board.pop()
+    tree.add_opening(5, "\n\n".join(games))
+    return tree
+
+def test_edits_share_the_position_index():
+    base = wide_tree()
+    edit = TreeEdit(base)
+    edit.add_records(4, parse_repertoire(OPENINGS[4]))
+    added = edit.commit()
+    # Only the changed paths are stored; the rest is looked up in the base version's dict
+    assert isinstance(added.nodes_by_hash, chess_logic.LayeredIndex)
+    assert added.nodes_by_hash.base is base.nodes_by_hash
+    assert len(added.nodes_by_hash.changes) < len(base)
+
+    # Many small edits keep a short chain of layers and the same contents as a rebuild
+    tree = added
+    for i in range(40):
+        opening_id = 10 + i
+        edit = TreeEdit(tree)
+        edit.add_records(opening_id, parse_repertoire(OPENINGS[1 + i % 4]))
+        if i % 3 == 2:
+            edit.remove_opening(opening_id - 1)
+        tree = edit.commit()
+        layers, _ = tree.nodes_by_hash._layers() if isinstance(tree.nodes_by_hash, chess_logic.LayeredIndex) else ([], None)
+        assert len(layers) <= 8
+    assert set(tree.nodes_by_hash) == set(tree.nodes_by_hash.keys())
+    assert len(list(tree.nodes_by_hash)) == len(tree)
+    shape(tree)
+
+def test_records_round_trip():
+    tree = build([1, 2, 3])
+    copy = OpeningTree()
+    copy.add_records(0, tree.to_records())
+    # One record per move, and a transposed position's weight counted once
+    assert len(tree.to_records()) == sum(len(node.nodes) for node in tree.nodes_by_hash.values())
+    assert {key: (node.weight, node.nags, node.comment, sorted(node.moves)) for key, node in copy.nodes_by_hash.items()} == \
+        {key: (node.weight, node.nags, node.comment, sorted(node.moves)) for key, node in tree.nodes_by_hash.items()}
+
+def test_layered_index():
+    bottom = {1: "a", 2: "b"}
+    index = chess_logic.LayeredIndex(bottom)
+    index[3] = "c"
+    del index[1]
+    index[2] = "B"
+    assert bottom == {1: "a", 2: "b"}
+    assert len(index) == 2 and 1 not in index and index.get(1) is None
+    assert dict(index) == {2: "B", 3: "c"}
+    top = chess_logic.LayeredIndex(index)
+    top[1] = "A"
+    assert dict(top) == {1: "A", 2: "B", 3: "c"} and len(top) == 3
+    assert top.compacted() == {1: "A", 2: "B", 3: "c"}
+
+def test_remove_a_line_that_transposes_into_another():
+    lines = {
+        1: '[Event "English"]\n\n1. c4 d5 2. Nf3 e5 3. g3 *',
+        3: '[Event "English, d4"]\n\n1. c4 d5 2. d4 *',
+        5: '[Event "Reti"]\n\n1. Nf3 d5 2. c4 Nf6 3. g3 e5 *', # Reaches 1's position after 2. Nf3
+    }
+    tree = OpeningTree()
+    for opening_id, pgn in lines.items():
+        tree.add_opening(opening_id, pgn)
+    assert tree.root.child("c4").child("d5").moves == ("Nf3", "d4")
+
+    edit = TreeEdit(tree)
+    edit.subtract_records(parse_repertoire(lines[1]))
+    edit.remove_opening(1)
+    removed = edit.commit()
+
+    fresh = OpeningTree()
+    for opening_id in (3, 5):
+        fresh.add_opening(opening_id, lines[opening_id])
+    assert shape(removed) == shape(fresh)
+    # Both positions survive, but no remaining opening plays 2. Nf3 after 1. c4 d5
+    assert removed.root.child("c4").child("d5").moves == ("d4",)
+    node = removed.root.child("Nf3").child("d5").child("c4")
+    assert node.line == ["Nf3", "d5", "c4"] and node.opening_ids == {5}
+    assert node.child("Nf6").child("g3").line == ["Nf3", "d5", "c4", "Nf6", "g3"]
+    assert removed.extra_parents == fresh.extra_parents == {}
+
+def test_sessions_stay_on_their_version(monkeypatch):
+    monkeypatch.setattr(chess_logic, "GLOBAL_OPENING_TREE", chess_logic.GLOBAL_OPENING_TREE)
+    chess_logic.publish_tree(build([3]))
+    session = chess_logic.GameSession(1, [3], "white", {3: "white"})
+    record = session.to_record()
+
+    with chess_logic.TREE_WRITE_LOCK:
+        edit = chess_logic.begin_edit()
+        edit.remove_opening(3)
+        chess_logic.publish_tree(edit.commit())
+    assert chess_logic.GLOBAL_OPENING_TREE.root.child("e4") is None
+
+    assert session.process_user_move("e4")["bot_move"] == "e5"
+    rehydrated = chess_logic.GameSession.from_record(session.to_record())
+    assert rehydrated.tree is session.tree
+    assert rehydrated.process_user_move("Nf3")["bot_move"] == "Nc6"
+
+    # A new game sees the new version
+    fresh = chess_logic.GameSession(2, [3], "white", {3: "white"})
+    assert fresh.tree.version != record.tree_version
+    assert fresh.process_user_move("e4")["in_theory"] == False
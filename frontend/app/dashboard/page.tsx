@@ -69,7 +69,7 @@ export default function Dashboard() {
                 <div>
                     <input 
                         type="file" 
-                        accept=".pgn" 
+                        accept=".pgn,.bin" 
                         ref={fileInputRef} 
                         className="hidden" 
                         onChange={handleFileUpload}
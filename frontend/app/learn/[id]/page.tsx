@@ -2,9 +2,8 @@
 
 import { useEffect, useState } from "react";
 import { useParams } from "next/navigation";
-import { getOpeningDetail, toggleLearning } from "../../../lib/api";
+import { getOpeningDetail, getOpeningLesson, toggleLearning } from "../../../lib/api";
 import Board from "../../../components/Board";
-import { Chess } from "chess.js";
 import Link from "next/link";
 import { ArrowLeft, ChevronLeft, ChevronRight, CheckCircle, Circle } from "lucide-react";
 
@@ -13,11 +12,12 @@ export default function LessonPage() {
   const id = Number(params?.id);
   
   const [name, setName] = useState<string>("");
-  const [pgn, setPgn] = useState<string>("");
+  const [found, setFound] = useState<boolean>(false);
   const [isLearned, setIsLearned] = useState<boolean>(false);
   const [orientation, setOrientation] = useState<"white" | "black">("white");
   
   const [moves, setMoves] = useState<string[]>([]);
+  const [fens, setFens] = useState<string[]>([]);
   const [currentFen, setCurrentFen] = useState<string>("start");
   const [currentMoveIndex, setCurrentMoveIndex] = useState(-1);
   const [loading, setLoading] = useState(true);
@@ -29,21 +29,17 @@ export default function LessonPage() {
   }, [id]);
 
   const fetchDetail = () => {
-    getOpeningDetail(id)
-        .then(data => {
+    Promise.all([getOpeningDetail(id), getOpeningLesson(id)])
+        .then(([data, lesson]) => {
             setName(data.name);
-            setPgn(data.pgn);
             setIsLearned(data.is_learned);
             setOrientation(data.color);
             
-            const tempGame = new Chess();
-            try {
-                tempGame.loadPgn(data.pgn);
-                const history = tempGame.history();
-                setMoves(history);
-            } catch (e) {
-                console.error("PGN Parse Error:", e);
-            }
+            // The server sends the moves with the position after each one; no PGN parsing here
+            const mainline = lesson.lines[0];
+            setMoves(mainline ? mainline.san : []);
+            setFens(mainline ? mainline.fen : []);
+            setFound(true);
             setLoading(false);
         })
         .catch(err => {
@@ -59,11 +55,7 @@ export default function LessonPage() {
   };
 
   const goToMove = (index: number) => {
-    const tempGame = new Chess();
-    for (let i = 0; i <= index; i++) {
-        tempGame.move(moves[i]);
-    }
-    setCurrentFen(tempGame.fen());
+    setCurrentFen(index >= 0 ? fens[index] : "start");
     setCurrentMoveIndex(index);
   };
 
@@ -83,7 +75,7 @@ export default function LessonPage() {
   };
 
   if (loading) return <div className="min-h-screen flex items-center justify-center text-slate-400">Loading lesson...</div>;
-  if (!pgn) return <div className="p-8">Opening not found.</div>;
+  if (!found) return <div className="p-8">Opening not found.</div>;
 
   return (
     <main className="min-h-screen bg-slate-50 flex flex-col">
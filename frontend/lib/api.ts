@@ -43,26 +43,88 @@ export const toggleLearning = async (openingId: number): Promise<void> => {
   await api.post(`/openings/${openingId}/toggle_learn`);
 };
 
-export interface OpeningDetail extends Opening {
-  pgn: string;
+export const getOpeningDetail = async (openingId: number): Promise<Opening> => {
+  const response = await api.get<Opening>(`/openings/${openingId}`);
+  return response.data;
+};
+
+// One entry per mainline or variation; lines[0] is the mainline of the first game.
+export interface LessonLine {
+  parent: number; // Index of the line this one branches from, -1 for a game's mainline
+  ply: number;    // Half-moves played before the line's first move
+  san: string[];
+  fen: string[];  // Position after each move
 }
 
-export const getOpeningDetail = async (openingId: number): Promise<OpeningDetail> => {
-  const response = await api.get<OpeningDetail>(`/openings/${openingId}`);
+export interface Lesson {
+  lines: LessonLine[];
+}
+
+export const getOpeningLesson = async (openingId: number): Promise<Lesson> => {
+  const response = await api.get<Lesson>(`/openings/${openingId}/lesson`);
   return response.data;
 };
 
-export const uploadPgn = async (file: File): Promise<{ message: string }> => {
+// Polyglot book of the opening's lines, for use in other chess GUIs
+export const openingBookUrl = (openingId: number): string =>
+  `${API_BASE_URL}/openings/${openingId}/book.bin`;
+
+export const uploadPgn = async (file: File): Promise<{ message: string; job_id?: string }> => {
   const formData = new FormData();
   formData.append("file", file);
-  const response = await api.post<{ message: string }>('/admin/upload', formData, {
+  const response = await api.post<{ message: string; job_id?: string }>('/admin/upload', formData, {
       headers: { 'Content-Type': 'multipart/form-data' }
   });
   return response.data;
 };
 
-export const startGame = async (userId: number, color: "white" | "black" = "white"): Promise<GameStartResponse> => {
-  const response = await api.post<GameStartResponse>('/game/start', { user_id: userId, color });
+export const deleteOpening = async (openingId: number): Promise<void> => {
+  await api.delete(`/admin/openings/${openingId}`);
+};
+
+export interface ImportJobStatus {
+  job_id: string;
+  opening_id: number | null;
+  filename: string | null;
+  status: "queued" | "running" | "done" | "failed";
+  progress: number;
+  bytes_read: number;
+  bytes_total: number;
+  games: number;
+  errors: number;
+  positions: number;
+  games_per_sec: number;
+  elapsed_sec: number;
+  message: string | null;
+}
+
+export const getImportJob = async (jobId: string): Promise<ImportJobStatus> => {
+  const response = await api.get<ImportJobStatus>(`/admin/imports/${jobId}`);
+  return response.data;
+};
+
+export type EngineLevel = "beginner" | "club" | "advanced" | "master";
+
+// `moves` (SAN from the start position) resumes a drill there, e.g. PositionLookup.resume.moves
+export const startGame = async (userId: number, color: "white" | "black" = "white", engineLevel?: EngineLevel, moves?: string[]): Promise<GameStartResponse> => {
+  const response = await api.post<GameStartResponse>('/game/start', { user_id: userId, color, engine_level: engineLevel, moves });
+  return response.data;
+};
+
+export interface PositionLookup {
+  fen: string;
+  in_repertoire: boolean;
+  ply: number | null;
+  line: string[];
+  openings: { id: number; name: string; color: "white" | "black"; is_learned: boolean }[];
+  next_moves: { san: string; uci: string; weight: number; opening_ids: number[] }[];
+  resume: { color: "white" | "black"; moves: string[]; trainee_to_move: boolean } | null;
+}
+
+// Which openings reach a position, given a FEN or moves from the start
+export const lookupPosition = async (query: { fen: string } | { moves: string[] }, userId?: number): Promise<PositionLookup> => {
+  const params = "fen" in query ? { fen: query.fen } : { moves: query.moves.join(" ") };
+  const response = await api.get<PositionLookup>('/positions', { params: { ...params, user_id: userId } });
   return response.data;
 };
 
@@ -71,4 +133,66 @@ export const playMove = async (sessionId: number, moveSan: string): Promise<Move
   return response.data;
 };
 
+// Live game channel: the move is acknowledged at once and the bot's reply is pushed when ready.
+// Boolean fields and empty lists are omitted from the payloads when false/empty.
+export type GameChannelMessage =
+  | { t: 'state'; fen: string; ply: number; theory: boolean; engine: boolean; ids: number[] }
+  | { t: 'ack'; ok?: boolean; ply?: number; uci?: string; theory?: boolean; mistake?: boolean; msg?: string }
+  | { t: 'bot'; ply: number; san?: string; uci?: string; theory?: boolean; engine?: boolean; drop?: number[]; msg?: string; over?: boolean }
+  | { t: 'error'; msg: string };
+
+export const openGameChannel = (sessionId: number, onMessage: (message: GameChannelMessage) => void) => {
+  const socket = new WebSocket(`${API_BASE_URL.replace(/^http/, 'ws')}/game/ws/${sessionId}`);
+  socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+  return {
+    sendMove: (san: string) => socket.send(JSON.stringify({ t: 'move', san })),
+    close: () => socket.close(),
+    socket,
+  };
+};
+
+export interface PlyStats {
+  ply: number;
+  attempts: number;
+  mistakes: number;
+  mistake_rate: number;
+}
+
+export interface OpeningMistakeHeatmap {
+  opening_id: number;
+  name: string | null;
+  plies: PlyStats[];
+}
+
+export interface HardPosition {
+  fen: string | null;
+  opening_id: number | null;
+  expected_moves: string[];
+  attempts: number;
+  mistakes: number;
+  mistake_rate: number;
+}
+
+export interface AccuracyPoint {
+  day: string;
+  theory_moves: number;
+  mistakes: number;
+  accuracy: number;
+}
+
+export const getMistakeHeatmap = async (userId: number = 1): Promise<OpeningMistakeHeatmap[]> => {
+  const response = await api.get<OpeningMistakeHeatmap[]>('/stats/mistakes', { params: { user_id: userId } });
+  return response.data;
+};
+
+export const getHardestPositions = async (userId: number = 1, limit: number = 10): Promise<HardPosition[]> => {
+  const response = await api.get<HardPosition[]>('/stats/hardest_positions', { params: { user_id: userId, limit } });
+  return response.data;
+};
+
+export const getAccuracy = async (userId: number = 1, days: number = 30): Promise<AccuracyPoint[]> => {
+  const response = await api.get<AccuracyPoint[]>('/stats/accuracy', { params: { user_id: userId, days } });
+  return response.data;
+};
+
 export default api;